@@ -0,0 +1,295 @@
+
+'''
+    @file batch.py
+    @date 18/OCT/2026
+    @brief Run a list of explode/build/rescale/repack jobs read from a JSON (or TOML/YAML) file in one go, on a shared pool of processes,
+           so a pipeline handling lots of sheets only starts up (and loads the imaging libraries) once.
+'''
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import defaults
+import metrics
+import os
+import json
+import time
+
+try:
+    import tomllib
+except ImportError:
+    # Python 3.11+ only, TOML job files can't be read without it
+    tomllib = None
+
+try:
+    import yaml
+except ImportError:
+    # PyYAML is optional, YAML job files can't be read without it
+    yaml = None
+
+# Bump this if the layout of the batch report changes
+batch_report_version = 1
+
+# Options shared by every type of job, for how PNGs are written
+png_job_options = { 'png_compress_level': None, 'png_optimize': False, 'fast': False }
+
+# The options each type of job takes and their defaults, the same as the matching command's, None meaning the option has to be given
+job_options = {
+    'explode': { 'input': None, 'output': "./exploded", 'threads': 1, 'force': False, 'low_memory': False, 'band_height': defaults.default_band_height, 'archive': None },
+    'build':   { 'sprite_directory': None, 'output': None, 'maxw': 4096, 'maxh': 4096, 'no_cache': False, 'engine': 'pytexturepacker', 'compact_xml': False, 'no_dedup': False, 'optimize': False, 'jobs': 1, 'optimize_layout': False, 'layout_time_budget': defaults.default_layout_time_budget, 'layout_sidecar': False },
+    'rescale': { 'input': None, 'output': "./rescaled", 'scale': [0.5], 'resample': defaults.default_resample, 'maxw': 4096, 'maxh': 4096, 'engine': 'pytexturepacker', 'compact_xml': False, 'no_dedup': False, 'optimize': False },
+    'repack':  { 'sheet': None, 'output': None, 'overrides': None, 'maxw': 4096, 'maxh': 4096, 'engine': 'pytexturepacker', 'compact_xml': False, 'no_dedup': False, 'optimize': False },
+}
+
+# Options each type of job has to be given
+required_job_options = { 'explode': ['input'], 'build': ['sprite_directory', 'output'], 'rescale': ['input'], 'repack': ['sheet'] }
+
+
+# Read the jobs from a job file, either a list of jobs or a dict with the list under 'jobs'
+# Each job is a dict with its 'type' (explode, build, rescale or repack), an optional 'name' to report it by and any of the options the type takes
+# A job with 'wait' set to true only starts once every job before it has finished, e.g. to build sprites an earlier job explodes
+def load_jobs( jobs_path ):
+
+    ext = os.path.splitext( jobs_path )[1].lower()
+
+    if ext == ".toml":
+        if tomllib == None:
+            raise ValueError( "reading TOML job files needs Python 3.11 or later" )
+        with open(jobs_path, "rb") as f:
+            data = tomllib.load( f )
+    elif ext in [".yaml", ".yml"]:
+        if yaml == None:
+            raise ValueError( "reading YAML job files needs PyYAML installed" )
+        with open(jobs_path, "r") as f:
+            data = yaml.safe_load( f )
+    else:
+        with open(jobs_path, "r") as f:
+            data = json.load( f )
+
+    if isinstance(data, dict):
+        data = data.get( 'jobs', [] )
+
+    return [check_job(job, index) for (index, job) in enumerate(data)]
+
+
+# Fill in a job's defaults and check its options, returns the job ready to run
+def check_job( job, index ):
+
+    if not isinstance(job, dict):
+        raise ValueError( "job " + str(index) + " isn't a table of options" )
+
+    job_type = job.get( 'type' )
+    if not job_type in job_options:
+        raise ValueError( "job " + str(index) + " has unknown type '" + str(job_type) + "', expected one of: " + ", ".join(job_options.keys()) )
+
+    options = dict( job_options[job_type] )
+    options.update( png_job_options )
+
+    for key in job.keys():
+        if not key in options and not key in ['type', 'name', 'wait']:
+            raise ValueError( "job " + str(index) + " (" + job_type + ") has unknown option '" + key + "'" )
+
+    options.update( job )
+
+    for key in required_job_options[job_type]:
+        if options[key] == None:
+            raise ValueError( "job " + str(index) + " (" + job_type + ") needs '" + key + "'" )
+
+    options['index'] = index
+    options.setdefault( 'name', get_job_name(options) )
+    options.setdefault( 'wait', False )
+
+    return options
+
+
+# Name to report a job by, if it isn't given one
+def get_job_name( job ):
+
+    if job['type'] == 'build':
+        return "build " + job['sprite_directory'] + " -> " + job['output']
+    if job['type'] == 'repack':
+        return "repack " + job['sheet']
+
+    return job['type'] + " " + str(job['input'])
+
+
+# Run a single job, returns a dict of what happened
+#   'index'/'name'/'type' - which job it was
+#   'ok'                  - False if it raised an error or any of its sheets failed
+#   'error'               - the error, if there was one
+#   'sheets'/'failed'     - sheets handled and how many of them failed, for explode and rescale
+#   'time'                - seconds taken
+# This is the unit of work handed to the process pool, so it only takes/returns picklable values
+def run_job( job ):
+
+    start = time.time()
+    metrics_before = metrics.snapshot()
+
+    record = {'index': job['index'], 'name': job['name'], 'type': job['type'], 'ok': True, 'error': None}
+
+    png_options = defaults.get_png_options( job['png_compress_level'], job['png_optimize'], job['fast'] )
+
+    try:
+        summaries = None
+
+        if job['type'] == 'explode':
+            import explode
+
+            inputs = job['input'] if isinstance(job['input'], list) else [job['input']]
+            summaries = []
+            for path in inputs:
+                print("# Searching for sprite sheets at: " + path)
+                summaries.extend( explode.explode_spritesheet(path, job['output'], 1, job['threads'], job['force'], job['low_memory'], job['band_height'], png_options, job['archive']) )
+
+        elif job['type'] == 'build':
+            import build
+
+            output_texture_name = os.path.splitext( job['output'] )[0]
+
+            # make sure output folder path exists
+            output_dir = os.path.dirname( output_texture_name )
+            if output_dir != "" and not os.path.exists( output_dir ):
+                os.makedirs( output_dir, exist_ok=True )
+
+            build.build_spritesheet( job['sprite_directory'], output_texture_name, job['maxw'], job['maxh'], job['no_cache'] == False, job['engine'], job['compact_xml'], job['no_dedup'] == False, png_options, job['optimize'], job['jobs'], job['optimize_layout'], job['layout_time_budget'], job['layout_sidecar'] )
+
+        elif job['type'] == 'rescale':
+            import convert
+
+            inputs = job['input'] if isinstance(job['input'], list) else [job['input']]
+            scales = job['scale'] if isinstance(job['scale'], list) else [job['scale']]
+            summaries = convert.rescale_spritesheets( inputs, job['output'], scales, job['maxw'], job['maxh'], job['engine'], job['no_dedup'] == False, job['compact_xml'], job['resample'], 1, png_options, job['optimize'] )
+
+        elif job['type'] == 'repack':
+            import convert
+
+            output_texture_name = job['output']
+            if output_texture_name == None:
+                output_texture_name = os.path.splitext( os.path.basename(job['sheet']) )[0] + "_repacked"
+            output_texture_name = os.path.splitext( output_texture_name )[0]
+
+            print("# Repacking: " + job['sheet'])
+            if convert.repack_sheet( job['sheet'], output_texture_name, job['overrides'], job['maxw'], job['maxh'], job['engine'], job['no_dedup'] == False, job['compact_xml'], png_options, job['optimize'] ) == None:
+                raise ValueError( "no xml found for " + job['sheet'] )
+
+        if summaries != None:
+            record['sheets'] = len(summaries)
+            record['failed'] = sum([1 for summary in summaries if summary['failed'] > 0])
+            if record['failed'] > 0:
+                record['ok'] = False
+                record['error'] = str(record['failed']) + " sheets failed"
+
+    except Exception as e:
+        print("!# \tJob " + str(job['index']) + " failed: " + job['name'] + " (" + str(e) + ")")
+        record['ok'] = False
+        record['error'] = str(e)
+
+    record['time'] = time.time() - start
+
+    # What this job recorded goes back with it, when run in a worker process it's merged into the parent's metrics
+    record['metrics'] = metrics.since( metrics_before )
+
+    return record
+
+
+# Split a group of jobs to run side by side into chains of jobs that have to run one after another
+# Explode jobs writing into the same output root share its manifest and output folders, so they go in one chain, every other job is a chain of its own
+def get_job_chains( group ):
+
+    chains = []
+    map_output_chain = {}
+    for job in group:
+        if job['type'] != 'explode':
+            chains.append( [job] )
+            continue
+
+        output_root = os.path.normcase( os.path.abspath(job['output']) )
+        if not output_root in map_output_chain:
+            map_output_chain[output_root] = []
+            chains.append( map_output_chain[output_root] )
+        map_output_chain[output_root].append( job )
+
+    return chains
+
+
+# Run a chain of jobs (from get_job_chains) in turn, returns the record of each
+def run_job_chain( chain ):
+    return [run_job(job) for job in chain]
+
+
+# Run every job in jobs (from load_jobs), returns the report of how each went
+# With processes > 1 jobs run side by side on a pool of processes shared by the whole batch, jobs marked 'wait' hold back
+# everything after them until every job before them is done, and explode jobs into the same output root run one after another
+def run_batch( jobs, processes=1 ):
+
+    start = time.time()
+
+    records = []
+
+    # Serial path, each job in turn in this process
+    if processes <= 1:
+        for job in jobs:
+            print("# Job " + str(job['index']) + ": " + job['name'])
+
+            record = run_job( job )
+            record.pop( 'metrics' )
+            records.append( record )
+
+    # Parallel path, jobs are handed out to the pool a group at a time, a group ending before the next job that has to wait
+    else:
+        print("# Running " + str(len(jobs)) + " jobs with " + str(processes) + " processes...")
+
+        groups = []
+        for job in jobs:
+            if len(groups) == 0 or job['wait']:
+                groups.append( [] )
+            groups[-1].append( job )
+
+        with ProcessPoolExecutor( max_workers=processes ) as executor:
+            for group in groups:
+
+                futures = {}
+                for chain in get_job_chains( group ):
+                    for job in chain:
+                        print("# Job " + str(job['index']) + ": " + job['name'])
+                    futures[executor.submit( run_job_chain, chain )] = chain
+
+                for future in as_completed(futures):
+                    chain = futures[future]
+                    try:
+                        chain_records = future.result()
+                        for record in chain_records:
+                            metrics.merge( record.pop('metrics') )
+                    except Exception as e:
+                        chain_records = [{'index': job['index'], 'name': job['name'], 'type': job['type'], 'ok': False, 'error': str(e), 'time': 0.0} for job in chain]
+
+                    records.extend( chain_records )
+
+    records.sort( key=lambda record: record['index'] )
+
+    return { 'version': batch_report_version,
+             'jobs': records,
+             'succeeded': sum([1 for record in records if record['ok']]),
+             'failed': sum([1 for record in records if not record['ok']]),
+             'total_time': time.time() - start }
+
+
+def write_report( report, path ):
+    with open(path, "w") as f:
+        json.dump( report, f, indent='\t' )
+
+    print("# Batch report written to: " + path)
+
+
+# Print how each job in a batch went
+def print_report( report ):
+
+    print("# Batch summary:")
+
+    for record in report['jobs']:
+        line = "# \t" + str(record['index']) + ": " + record['name'] + ", " + ("ok" if record['ok'] else "failed") + ", {:.3f}s".format(record['time'])
+        if 'sheets' in record:
+            line += ", " + str(record['sheets']) + " sheets"
+        if not record['ok']:
+            line = "!" + line + " (" + str(record['error']) + ")"
+        print(line)
+
+    print("# \t" + str(len(report['jobs'])) + " jobs, " + str(report['succeeded']) + " succeeded, " + str(report['failed']) + " failed, {:.3f}s".format(report['total_time']))
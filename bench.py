@@ -0,0 +1,276 @@
+
+'''
+    @file bench.py
+    @date 18/OCT/2026
+    @brief Benchmark explode and build against generated sprite corpora, results are written out as JSON to track between releases.
+'''
+
+from PIL import Image, ImageDraw
+from concurrent.futures import ProcessPoolExecutor
+from defaults import bench_suites as suites
+import build
+import explode
+import metrics
+import os
+import json
+import time
+import random
+import sys
+import shutil
+import platform
+import subprocess
+
+# Bump this if the layout of the results file changes
+bench_results_version = 3
+
+# Width/height range of generated sprites (before alpha padding) for each size distribution
+map_size_distributions = { 'small': (8, 32), 'mixed': (8, 128), 'large': (64, 256) }
+
+# Times each startup measurement is repeated, the quickest is kept
+startup_runs = 5
+
+# Frames per animation folder in generated corpora, and animations per parent folder when nesting deeper
+sprites_per_anim = 8
+anims_per_group = 4
+
+
+# List the cases to run for a suite, the base case followed by each variation of it
+def get_cases( suite_name ):
+
+    suite = suites[suite_name]
+    base = suite['base']
+
+    cases = []
+    def add_case( **changes ):
+        case = dict(base)
+        case.update( changes )
+        if not case in cases:
+            cases.append( case )
+
+    for count in suite['counts']:
+        add_case( sprites=count )
+    for sizes in map_size_distributions.keys():
+        add_case( sizes=sizes )
+    for alpha_padding in suite['paddings']:
+        add_case( alpha_padding=alpha_padding )
+    for anim_depth in suite['depths']:
+        add_case( anim_depth=anim_depth )
+
+    return cases
+
+
+def get_case_name( case ):
+    return "n" + str(case['sprites']) + "_" + case['sizes'] + "_p" + str(case['alpha_padding']) + "_d" + str(case['anim_depth'])
+
+
+# Folder a sprite goes in within a corpus, anim_depth folders deep with the last one being its animation
+def get_sprite_dir( index, anim_depth ):
+
+    if anim_depth == 0:
+        return ""
+
+    anim = index // sprites_per_anim
+    parts = ["anim_" + str(anim).zfill(5)]
+
+    group = anim
+    for depth in range(1, anim_depth):
+        group = group // anims_per_group
+        parts.insert( 0, "group" + str(depth) + "_" + str(group).zfill(5) )
+
+    return os.path.join( *parts )
+
+
+# Generate a corpus of sprites for a case under corpus_dir, the same case always generates the same sprites
+# Corpora are kept between runs, and only generated if they aren't already there
+def generate_corpus( case, corpus_dir ):
+
+    done_path = os.path.join( corpus_dir, ".complete" )
+    if os.path.exists(done_path):
+        return
+
+    print("# Generating corpus: " + corpus_dir)
+
+    if os.path.exists(corpus_dir):
+        shutil.rmtree( corpus_dir )
+
+    rng = random.Random( get_case_name(case) )
+    (min_size, max_size) = map_size_distributions[case['sizes']]
+    padding = case['alpha_padding']
+
+    for index in range(case['sprites']):
+        w = rng.randint( min_size, max_size )
+        h = rng.randint( min_size, max_size )
+        colour = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255), 255)
+
+        # A solid shape with a soft edge, surrounded by fully transparent padding for the packer to trim
+        img = Image.new( "RGBA", (w + padding * 2, h + padding * 2), (0, 0, 0, 0) )
+        draw = ImageDraw.Draw( img )
+        draw.ellipse( (padding, padding, padding + w - 1, padding + h - 1), fill=colour )
+        draw.rectangle( (padding + w // 4, padding + h // 4, padding + w // 2, padding + h // 2), fill=(colour[0], colour[1], colour[2], 128) )
+
+        sprite_dir = os.path.join( corpus_dir, get_sprite_dir(index, case['anim_depth']) )
+        if not os.path.exists(sprite_dir):
+            os.makedirs( sprite_dir )
+
+        img.save( os.path.join(sprite_dir, "sprite_" + str(index).zfill(6) + ".png") )
+
+    with open(done_path, "w") as f:
+        f.write( "" )
+
+
+# Run func, adding how long it took to stages[name] and recording the peak memory so far
+def time_stage( stages, name, func, *args ):
+
+    start = time.perf_counter()
+    result = func( *args )
+
+    stage_record = stages.setdefault( name, {'time': 0.0} )
+    stage_record['time'] += time.perf_counter() - start
+    stage_record['peak_rss_mb'] = metrics.get_peak_rss_mb()
+
+    return result
+
+
+# Benchmark building a sheet from a corpus then exploding it again, run in its own process so peak memory is per case
+def run_case( case, corpus_dir, case_dir, engine, max_w, max_h ):
+
+    if os.path.exists(case_dir):
+        shutil.rmtree( case_dir )
+    os.makedirs( case_dir )
+
+    sheet_name = os.path.join( case_dir, "sheet" )
+
+    metrics.reset()
+
+    stages = {}
+    sheets = time_stage( stages, 'generate_spritesheet', build.generate_spritesheet, corpus_dir, sheet_name, max_w, max_h, engine )
+
+    for sheet in sheets:
+        map_sprites = time_stage( stages, 'convert_plist', build.convert_plist, sheet, corpus_dir )
+        time_stage( stages, 'pad_sprites', build.pad_sprites, map_sprites, sheet )
+        time_stage( stages, 'save_spritesheet', build.save_spritesheet, sheet )
+
+    summaries = []
+    for sheet in sheets:
+        summaries.extend( time_stage(stages, 'explode_spritesheet', explode.explode_spritesheet, sheet['name'] + ".png", os.path.join(case_dir, "exploded"), 1, 1, True) )
+
+    # How much of the sheets are taken up by (trimmed) sprites, aliased duplicates only take up space once
+    texture_area = 0
+    sprite_area = 0
+    for sheet in sheets:
+        texture_area += sheet['texture_wh'][0] * sheet['texture_wh'][1]
+        sprite_area += sum([frame['w'] * frame['h'] for frame in {(frame['x'], frame['y']): frame for (frame_key, frame) in sheet['frames']}.values()])
+
+    result = dict(case)
+    result['name'] = get_case_name( case )
+    result['pages'] = len(sheets)
+    result['texture_wh'] = [sheet['texture_wh'] for sheet in sheets]
+    result['fill_ratio'] = sprite_area / float(texture_area)
+    result['exploded'] = sum([summary['cells'] for summary in summaries])
+    result['failed'] = sum([summary['failed'] for summary in summaries])
+    result['stages'] = stages
+    result['counts'] = metrics.snapshot()['counts']
+    result['peak_rss_mb'] = metrics.get_peak_rss_mb()
+
+    return result
+
+
+# Time how long it takes to start up, from a fresh process each time, returns seconds for
+#   cli_version    - the command line printing --version, which loads no imaging libraries
+#   import_explode - loading everything explode needs
+#   import_build   - loading everything build needs
+# When frozen into an exe only the command line can be timed
+def measure_startup():
+
+    module_dir = os.path.dirname( os.path.abspath(__file__) )
+
+    if getattr(sys, 'frozen', False):
+        commands = { 'cli_version': [sys.executable, "--version"] }
+    else:
+        commands = { 'cli_version': [sys.executable, os.path.join(module_dir, "sprite_sheet_rebuilder.py"), "--version"],
+                     'import_explode': [sys.executable, "-c", "import explode"],
+                     'import_build': [sys.executable, "-c", "import build"] }
+
+    startup = {}
+    for (name, command) in commands.items():
+        times = []
+        for run in range(startup_runs):
+            start = time.perf_counter()
+            subprocess.run( command, cwd=module_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True )
+            times.append( time.perf_counter() - start )
+
+        startup[name] = min( times )
+
+    return startup
+
+
+# Run every case in a suite and write the results to results_path as JSON
+# Corpora and outputs are kept under work_dir, corpora are reused by later runs
+def run_benchmarks( work_dir, results_path, suite_name='quick', engine='pytexturepacker', max_w=16384, max_h=16384, version="" ):
+
+    results = { 'version': bench_results_version,
+                'rebuilder_version': version,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'suite': suite_name,
+                'engine': engine,
+                'max_wh': [max_w, max_h],
+                'startup': None,
+                'cases': [] }
+
+    print("# Timing startup...")
+
+    try:
+        results['startup'] = measure_startup()
+    except Exception as e:
+        print("!# \tFailed to time startup (" + str(e) + ")")
+
+    for case in get_cases( suite_name ):
+        case_name = get_case_name( case )
+        corpus_dir = os.path.join( work_dir, "corpora", case_name )
+        case_dir = os.path.join( work_dir, "runs", case_name )
+
+        generate_corpus( case, corpus_dir )
+
+        print("# Benchmarking: " + case_name)
+
+        # A fresh process for each case, otherwise peak memory would carry over from the cases before it
+        try:
+            with ProcessPoolExecutor( max_workers=1 ) as executor:
+                result = executor.submit( run_case, case, corpus_dir, case_dir, engine, max_w, max_h ).result()
+        except Exception as e:
+            print("!# \tFailed to benchmark: " + case_name + " (" + str(e) + ")")
+            result = dict(case)
+            result['name'] = case_name
+            result['error'] = str(e)
+
+        results['cases'].append( result )
+
+    with open(results_path, "w") as f:
+        json.dump( results, f, indent='\t' )
+
+    print_results( results )
+    print("# Results written to: " + results_path)
+
+    return results
+
+
+# Print a table of benchmark results
+def print_results( results ):
+
+    print("# Benchmark results (" + results['suite'] + ", " + results['engine'] + "):")
+
+    if results['startup'] != None:
+        print("# \tstartup: " + ", ".join([name + " {:.3f}s".format(seconds) for (name, seconds) in results['startup'].items()]))
+
+    for result in results['cases']:
+        if 'error' in result:
+            print("!# \t" + result['name'] + ": failed, " + result['error'])
+            continue
+
+        line = "# \t" + result['name'] + ": fill {:.3f}".format(result['fill_ratio'])
+        for (name, stage) in result['stages'].items():
+            line += ", " + name + " {:.3f}s".format(stage['time'])
+        if result['peak_rss_mb'] != None:
+            line += ", peak {:.1f}MB".format(result['peak_rss_mb'])
+        print(line)
@@ -6,89 +6,685 @@
     @brief Build a texture using supplied sprites and generate matching xml with positions/sizes.
 '''
 
-from PIL import Image, ImageOps
-from xml.etree.ElementTree import parse, Element, SubElement, Comment, tostring
-from xml.etree import ElementTree
-from xml.dom import minidom
-from PyTexturePacker import Packer
+from PIL import Image, ImageChops
+from concurrent.futures import ProcessPoolExecutor
+from PyTexturePacker import Packer, Utils
+from PyTexturePacker.ImageRect import ImageRect
+from explode import file_stamp, is_stamp_current, hash_file
+from defaults import default_layout_time_budget
+import native_packer
+import layout_search
+import layout_sidecar
+import metrics
 import os
-import plistlib
-import argparse
-import time
+import io
+import zlib
+import zipfile
+import tarfile
+import json
+import hashlib
 
-def generate_spritesheet( src_dir, sheet_name, max_w, max_h ):
+texture_border_padding = 2
+
+# Bump this if the contents of the build cache change
+build_cache_version = 4
+
+# Bump this if the layout of the trim cache changes
+trim_cache_version = 1
+# Extension of each sprite's file in the trim cache, and the zlib level their pixels are compressed with (quick, most of a sprite is usually flat)
+trim_cache_ext = ".trim"
+trim_cache_compress_level = 1
+
+# How far PyTexturePacker's alpha bleeding spreads out from the sprites (Utils.alpha_bleeding's default)
+alpha_bleed_pixels = 8
+
+# Arguments for the packer, these are also part of the build cache key so changing any of them forces a full repack
+# See here for argument details: https://github.com/wo1fsea/PyTexturePacker/blob/master/README.rst
+def get_packer_options( max_w, max_h ):
+    return { 'texture_format': ".png",
+             'max_width': max_w,
+             'max_height': max_h,
+             'bg_color': (255,255,255,0),
+             'enable_rotated': False,
+             # 'force_square': False,
+             'border_padding': texture_border_padding,
+             'shape_padding': 2,
+             'inner_padding': 1,
+             'trim_mode': 1,
+             'reduce_border_artifacts': True }
+
+# Pack the sprites under src_dir into sheets held in memory, returns a list of sheets (pages), each a dict of
+#   'name'       - output name (without extension), 'type' - image type/extension
+#   'image'      - the packed and cropped sheet image
+#   'frames'     - list of (sprite file name, frame) in packing order, frame being a dict of x/y/w/h/ax/ay/aw/ah
+#   'texture_wh' - size of the sheet
+# If the sprites don't all fit within max_w x max_h they're spread over as few pages as possible, named <sheet_name>_0, <sheet_name>_1...
+# Nothing is written to disk until save_spritesheet
+# With dedup, sprites whose trimmed pixels are identical are only packed once and share the same frame x/y/w/h
+# With jobs > 1 the sprites are loaded and trimmed on a pool of processes
+# Given sprite_stamps (from stamp_sprites), sprites trimmed by an earlier build are read from the sheet's trim cache rather than decoded again
+# Given a layout_time_budget, the layout is searched for as generate_spritesheet_from_trimmed does
+def generate_spritesheet( src_dir, sheet_name, max_w, max_h, engine='pytexturepacker', dedup=True, jobs=1, sprite_stamps=None, layout_time_budget=None ):
 
     print("# Generating sprite sheet from sprites found in \"" + src_dir + "\"...")
+
+    packer_options = get_packer_options( max_w, max_h )
+
+    sprite_paths = find_sprites( src_dir )
+
+    with metrics.stage( 'load_sprites' ):
+        if sprite_stamps == None:
+            sprites = load_trimmed_sprites( sprite_paths, packer_options['trim_mode'], jobs )
+        else:
+            sprites = load_cached_trimmed_sprites( sprite_paths, sprite_stamps, sheet_name, packer_options['trim_mode'], jobs )
+
     print("# \tPacking sprites (this may take a minute for larger sheets)...")
 
-    texture_border_padding = 2
+    return generate_spritesheet_from_trimmed( sprites, sheet_name, max_w, max_h, engine, dedup, layout_time_budget, jobs )
 
-    # create a MaxRectsBinPacker
-    # See here for argument details: https://github.com/wo1fsea/PyTexturePacker/blob/master/README.rst
-    packer = Packer.create( texture_format=".png",
-                            max_width=max_w, 
-                            max_height=max_h, 
-                            bg_color=(255,255,255,0),
-                            enable_rotated=False,
-                            # force_square=False,
-                            border_padding=texture_border_padding,
-                            shape_padding=2,
-                            inner_padding=1,
-                            trim_mode=1,
-                            reduce_border_artifacts=True )
-
-    # pack texture images under directory <src_dir> and name the output image[s] as <sheet_name>.
-    packer.pack( src_dir, sheet_name )
-
-    print("# \tCropping sheet...")
-
-    # Read image and get info
-    new_img_path = sheet_name + ".png"
-    img = Image.open( new_img_path )
-    img_info = img.info
-
-    tweaked_bbox = img.getbbox()
-    cropped_bbox = img.convert("RGBa").getbbox()
-
-    if ( cropped_bbox == None ):
-        bands = ""
-        for band in img.getbands():
-            bands += band + ","
-        print( "!# \tFailed to convert image to pre-multiplied alpha, skipping cropping step, image bands: " + bands )
+# The same as generate_spritesheet, but packing sprites already in memory rather than loading them from a folder
+# sprites is a list (or any iterable) of (file name, untrimmed image), file names being what the sprites would be saved as (e.g. 'idle_00.png')
+def generate_spritesheet_from_images( sprites, sheet_name, max_w, max_h, engine='pytexturepacker', dedup=True, layout_time_budget=None, jobs=1 ):
+
+    trim_mode = get_packer_options( max_w, max_h )['trim_mode']
+
+    with metrics.stage( 'trim' ):
+        trimmed_sprites = [(file_name,) + trim_sprite(img, trim_mode) for (file_name, img) in sprites]
+
+    return generate_spritesheet_from_trimmed( trimmed_sprites, sheet_name, max_w, max_h, engine, dedup, layout_time_budget, jobs )
+
+# The same again, but for sprites that have already been through trim_sprite, a list of (file name, trimmed image, source box, source size)
+# so sprites kept in memory between builds only get trimmed once
+# Given a layout_time_budget, the smallest layout the native packer can find within that many seconds is used (whatever the engine), see layout_search
+def generate_spritesheet_from_trimmed( sprites, sheet_name, max_w, max_h, engine='pytexturepacker', dedup=True, layout_time_budget=None, jobs=1 ):
+
+    packer_options = get_packer_options( max_w, max_h )
+
+    with metrics.stage( 'pack' ):
+        if engine == 'native' or layout_time_budget != None:
+            pages = pack_trimmed_sprites( sprites, packer_options, dedup, layout_time_budget, jobs )
+        else:
+            image_rects = [make_trimmed_image_rect(trimmed_sprite[1:], trimmed_sprite[0]) for trimmed_sprite in sprites]
+            pages = pack_image_rects( image_rects, packer_options, dedup )
+
+    # Only PyTexturePacker's sheets need bleeding exactly as it does it, the native packer's get the much quicker bleed_alpha
+    return finish_pages( pages, sheet_name, packer_options, engine == 'native' or layout_time_budget != None )
+
+# Pack sprites held in memory, without reading or writing anything
+# images is a list of (file name, image) or a dict of file name -> image, file names being what the sprites would be saved as (e.g. 'idle_00.png')
+# anims optionally gives the animation each file name belongs to
+# Returns a list of pages, each (atlas image, layout), the layout being a map of sprite name -> dict of x/y/w/h/ax/ay/aw/ah/anim as written to the xml
+# The atlas images are finished, exactly as build would save them
+def pack_pages( images, max_w=4096, max_h=4096, engine='pytexturepacker', dedup=True, anims={} ):
+
+    if isinstance(images, dict):
+        images = list( images.items() )
+
+    pages = []
+    for sheet in generate_spritesheet_from_images( images, "", max_w, max_h, engine, dedup ):
+        layout = get_map_sprites( sheet, anims )
+        pad_sprites( layout, sheet )
+        pages.append( (sheet['image'], layout) )
+
+    return pages
+
+# The same as pack_pages for sprites that all fit in one max_w x max_h sheet, returns (atlas image, layout)
+# Raises ValueError if they need more than one sheet
+def pack( images, max_w=4096, max_h=4096, engine='pytexturepacker', dedup=True, anims={} ):
+
+    pages = pack_pages( images, max_w, max_h, engine, dedup, anims )
+    if len(pages) > 1:
+        raise ValueError( "sprites don't fit in a single " + str(max_w) + "x" + str(max_h) + " sheet, use pack_pages for more than one" )
+
+    return pages[0]
+
+# Bleed, crop and name each packed page (a list of (image, frames)), returns the list of sheets
+# With quick_bleed pages are bled with bleed_alpha, rather than PyTexturePacker's own (much slower) Utils.alpha_bleeding
+def finish_pages( pages, sheet_name, packer_options, quick_bleed=False ):
+
+    max_w = packer_options['max_width']
+    max_h = packer_options['max_height']
+
+    if len(pages) > 1:
+        print("# \tSprites don't fit in a single " + str(max_w) + "x" + str(max_h) + " sheet, split over " + str(len(pages)) + " pages")
+
+    metrics.count( 'pages', len(pages) )
+
+    sheets = []
+    for (page_index, (img, frames)) in enumerate(pages):
+
+        metrics.count( 'sprites', len(frames) )
+
+        if packer_options['reduce_border_artifacts']:
+            with metrics.stage( 'alpha_bleeding' ):
+                if quick_bleed:
+                    img = bleed_alpha( img, alpha_bleed_pixels )
+                else:
+                    img = Utils.alpha_bleeding( img )
+
+        print("# \tCropping sheet...")
+
+        with metrics.stage( 'crop' ):
+            (img, tweaked_bbox) = crop_spritesheet( img, frames, alpha_bleed_pixels if packer_options['reduce_border_artifacts'] else 0 )
+
+        texture_wh = (tweaked_bbox[2], tweaked_bbox[3])
+
+        sheets.append( {'name': get_page_name(sheet_name, page_index, len(pages)), 'type': "png", 'image': img, 'frames': frames, 'texture_wh': texture_wh} )
+
+    return sheets
+
+# Alpha bleed an image the way PyTexturePacker's Utils.alpha_bleeding does, every fully transparent pixel within bleed_pixels of one
+# that isn't (in any direction, diagonals included) takes on the colour of one of those it's near, with an alpha of 1
+# Rather than pixel by pixel in Python, the colours are spread across and then down the whole image at once with Pillow
+# a jump at a time (1, 2, 4... pixels), so it only takes a few passes however big the sheet is
+# The same pixels are bled as by PyTexturePacker, but which nearby pixel's colour each gets can differ
+def bleed_alpha( img, bleed_pixels=alpha_bleed_pixels ):
+
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
     else:
-        # we know the 0/0 top left point is fine, but add border padding to the cropped w/h
-        tweaked_bbox = (0, 0, cropped_bbox[2] + texture_border_padding, cropped_bbox[3] + texture_border_padding)
+        img = img.copy()
+
+    # Pixels with any alpha at all are bled from, as in PyTexturePacker
+    alpha = img.getchannel("A")
+    visible = alpha.point( lambda a: 255 if a else 0 )
+
+    # Jumps adding up to bleed_pixels, spreading by each in turn reaches every pixel up to bleed_pixels away
+    jumps = []
+    while sum(jumps) < bleed_pixels:
+        jumps.append( min(2 ** len(jumps), bleed_pixels - sum(jumps)) )
+
+    filled = visible
+    for offsets in [[(jump, 0), (-jump, 0)] for jump in jumps] + [[(0, jump), (0, -jump)] for jump in jumps]:
+        source = img.copy()
+        source_filled = filled
+
+        for (dx, dy) in offsets:
+            # Pixels filled before this pass whose pixel (dx, dy) away nothing has been spread into yet
+            mask = ImageChops.subtract( source_filled, shift_image(filled, -dx, -dy, 255) )
+            bbox = mask.getbbox()
+            if bbox == None:
+                continue
+
+            img.paste( source.crop(bbox), (bbox[0] + dx, bbox[1] + dy), mask.crop(bbox) )
+            filled = ImageChops.lighter( filled, shift_image(mask, dx, dy, 0) )
+
+    alpha.paste( 1, mask=ImageChops.subtract(filled, visible) )
+    img.putalpha( alpha )
+
+    return img
+
+# Move a single band image by (dx, dy), filling in what's uncovered with fill
+def shift_image( img, dx, dy, fill ):
+    shifted = Image.new( img.mode, img.size, fill )
+    shifted.paste( img, (dx, dy) )
+    return shifted
+
+# Output name of a page, a sheet that fits on one page keeps the plain sheet name
+def get_page_name( sheet_name, page_index, page_count ):
+
+    if page_count == 1:
+        return sheet_name
+
+    return sheet_name + "_" + str(page_index)
+
+# Crop the empty space off the right and bottom of a packed sheet, keeping the border padding
+# The sheet's used area is worked out from where its frames were packed (plus however far alpha bleeding spread past them),
+# so the pixels are never scanned
+# Returns (cropped image, box it was cropped to)
+def crop_spritesheet( img, frames, bleed=0 ):
+
+    if len(frames) == 0:
+        return (img, (0, 0) + img.size)
+
+    used_w = min( max([frame['x'] + frame['w'] for (frame_key, frame) in frames]) + bleed, img.width )
+    used_h = min( max([frame['y'] + frame['h'] for (frame_key, frame) in frames]) + bleed, img.height )
+
+    # we know the 0/0 top left point is fine, but add border padding to the cropped w/h
+    tweaked_bbox = (0, 0, used_w + texture_border_padding, used_h + texture_border_padding)
+
+    # crop
+    img = img.crop( tweaked_bbox )
+
+    return (img, tweaked_bbox)
+
+# Find sprites with identical (trimmed) pixels, returns a list giving the index of the first identical image for each image
+# so unique images map to themselves
+def find_duplicate_sprites( images ):
+
+    alias_of = []
+    map_hash_index = {}
+    for (i, img) in enumerate(images):
+        key = (img.mode, img.size, hashlib.sha1(img.tobytes()).digest())
+        alias_of.append( map_hash_index.setdefault(key, i) )
+
+    return alias_of
+
+# Report how many sprites were duplicates of others, and how much sheet area that saved
+def report_duplicates( sizes, alias_of ):
+
+    duplicates = 0
+    total_area = 0
+    saved_area = 0
+    for (i, (w, h)) in enumerate(sizes):
+        total_area += w * h
+        if alias_of[i] != i:
+            duplicates += 1
+            saved_area += w * h
+
+    metrics.count( 'duplicate_sprites', duplicates )
+    metrics.count( 'duplicate_area_saved', saved_area )
+
+    if duplicates == 0:
+        return
+
+    print("# \tAliased " + str(duplicates) + " duplicate sprites, saving " + str(saved_area) + " pixels of sprite area ({:.1f}%)".format(100.0 * saved_area / total_area))
+
+# Group things to pack by the first of their identical sprites, returns {index of first: [indices sharing its place]}
+def group_duplicates( images, dedup ):
+
+    alias_of = list(range(len(images)))
+    if dedup:
+        alias_of = find_duplicate_sprites( images )
+        report_duplicates( [img.size for img in images], alias_of )
+
+    map_aliases = {}
+    for (i, unique_index) in enumerate(alias_of):
+        map_aliases.setdefault( unique_index, [] ).append( i )
+
+    return map_aliases
+
+# Load and trim sprites, sprite_paths being a map of path relative to the sprite folder -> full path (from find_sprites)
+# Returns a list of (file name, trimmed image, source box, source size), in the same order as sprite_paths
+# With jobs > 1 the sprites are decoded and trimmed on a pool of processes, a chunk of sprites at a time
+def load_trimmed_sprites( sprite_paths, trim_mode, jobs=1 ):
+
+    paths = list( sprite_paths.values() )
+
+    # Serial path, each sprite in turn
+    if jobs <= 1 or len(paths) < 2:
+        return [(os.path.basename(sprite_path),) + load_trimmed_sprite(sprite_path, trim_mode) for sprite_path in paths]
+
+    # Parallel path, a few chunks per process so they all stay busy if some sprites are bigger than others
+    chunk_size = max( 1, -(-len(paths) // (jobs * 4)) )
+
+    sprites = []
+    with ProcessPoolExecutor( max_workers=jobs ) as executor:
+        futures = [executor.submit( load_trimmed_chunk, paths[i:i + chunk_size], trim_mode ) for i in range(0, len(paths), chunk_size)]
+
+        # Taken in the order they were submitted, so the sprites stay in order
+        for future in futures:
+            chunk = future.result()
+            metrics.merge( chunk['metrics'] )
+            sprites.extend( chunk['sprites'] )
+
+    return sprites
+
+# Load and trim a chunk of sprites, the unit of work handed to the process pool by load_trimmed_sprites
+# so it only takes/returns picklable values (Pillow images pickle as their pixels)
+def load_trimmed_chunk( paths, trim_mode ):
+
+    metrics_before = metrics.snapshot()
+
+    sprites = [(os.path.basename(sprite_path),) + load_trimmed_sprite(sprite_path, trim_mode) for sprite_path in paths]
+
+    # What this chunk recorded goes back with it, to be merged into the parent's metrics
+    return {'sprites': sprites, 'metrics': metrics.since(metrics_before)}
+
+# The same as load_trimmed_sprites, but sprites already in the trim cache from the last build of sheet_name are taken from there
+# sprite_stamps (from stamp_sprites) give the hash of each sprite, which is what the cache is keyed on
+# Only the sprites that weren't in the cache are written to it, and any it holds for sprites that have gone are removed
+def load_cached_trimmed_sprites( sprite_paths, sprite_stamps, sheet_name, trim_mode, jobs=1 ):
 
-        # crop
-        img = img.crop( tweaked_bbox )
+    cache_dir = get_trim_cache_dir( sheet_name )
+
+    cached_sprites = {}
+    missing_paths = {}
+    for (rel_path, sprite_path) in sprite_paths.items():
+        cached = load_trim_cache_entry( cache_dir, sprite_stamps[rel_path]['hash'], trim_mode )
+        if cached != None:
+            cached_sprites[rel_path] = (os.path.basename(sprite_path),) + cached
+        else:
+            missing_paths[rel_path] = sprite_path
+
+    metrics.count( 'trim_cache_hits', len(cached_sprites) )
+    metrics.count( 'trim_cache_misses', len(missing_paths) )
+
+    if len(cached_sprites) > 0:
+        print("# \tLoading and trimming " + str(len(missing_paths)) + " sprites, " + str(len(cached_sprites)) + " unchanged since the last build")
+
+    loaded_sprites = dict( zip(missing_paths.keys(), load_trimmed_sprites(missing_paths, trim_mode, jobs)) )
+
+    sprites = []
+    for rel_path in sprite_paths:
+        sprites.append( cached_sprites[rel_path] if rel_path in cached_sprites else loaded_sprites[rel_path] )
+
+    with metrics.stage( 'save_trim_cache' ):
+        if len(missing_paths) > 0 and not os.path.isdir( cache_dir ):
+            os.makedirs( cache_dir, exist_ok=True )
+
+        map_hash_sprite = {sprite_stamps[rel_path]['hash']: loaded_sprites[rel_path][1:] for rel_path in missing_paths}
+        for (sprite_hash, trimmed_sprite) in map_hash_sprite.items():
+            save_trim_cache_entry( cache_dir, sprite_hash, trim_mode, trimmed_sprite )
+
+        prune_trim_cache( cache_dir, set([stamp['hash'] for stamp in sprite_stamps.values()]) )
+
+    return sprites
+
+# The trim cache of a sheet is a folder of trimmed sprites, a file for each keyed by the hash of the sprite's file
+def get_trim_cache_dir( sheet_name ):
+    return sheet_name + ".trimcache"
+
+def get_trim_cache_entry_path( cache_dir, sprite_hash ):
+    return os.path.join( cache_dir, sprite_hash + trim_cache_ext )
+
+# Read a sprite back from the trim cache, returns (trimmed image, source box, source size), or None if it isn't there (for trim_mode)
+# Each entry is a line of json saying what the sprite is, followed by its raw pixels compressed with zlib,
+# so reading a sprite back is an inflate and copy rather than a PNG decode
+def load_trim_cache_entry( cache_dir, sprite_hash, trim_mode ):
+
+    entry_path = get_trim_cache_entry_path( cache_dir, sprite_hash )
+    if os.path.isfile(entry_path) == False:
+        return None
+
+    try:
+        with open(entry_path, "rb") as f_entry:
+            header = json.loads( f_entry.readline() )
+            if header.get('version') != trim_cache_version or header.get('trim_mode') != trim_mode:
+                return None
+
+            data = zlib.decompress( f_entry.read() )
+
+        sprite_img = Image.frombytes( header['mode'], tuple(header['size']), data )
+
+    except (OSError, ValueError, KeyError, zlib.error):
+        print("!# \tCould not read trim cache entry, trimming the sprite again: " + entry_path)
+        return None
+
+    return (sprite_img, tuple(header['box']), tuple(header['source_size']))
+
+# Write a sprite trimmed by trim_sprite (its (trimmed image, source box, source size)) into the trim cache
+def save_trim_cache_entry( cache_dir, sprite_hash, trim_mode, trimmed_sprite ):
+
+    (sprite_img, source_box, source_size) = trimmed_sprite
+
+    # Palette images can't be rebuilt from their raw pixels alone (trimmed sprites are RGBA anyway)
+    if sprite_img.mode == "P":
+        return
+
+    header = { 'version': trim_cache_version,
+               'trim_mode': trim_mode,
+               'mode': sprite_img.mode,
+               'size': sprite_img.size,
+               'box': source_box,
+               'source_size': source_size }
+
+    # Written to the side and swapped in, so an interrupted build never leaves a broken entry behind
+    entry_path = get_trim_cache_entry_path( cache_dir, sprite_hash )
+    with open(entry_path + ".tmp", "wb") as f_entry:
+        f_entry.write( json.dumps(header).encode("utf-8") + b"\n" )
+        f_entry.write( zlib.compress(sprite_img.tobytes(), trim_cache_compress_level) )
+
+    os.replace( entry_path + ".tmp", entry_path )
+
+    metrics.count( 'trim_cache_writes' )
+
+# Remove every entry from the trim cache that isn't for one of sprite_hashes
+def prune_trim_cache( cache_dir, sprite_hashes ):
+
+    if os.path.isdir(cache_dir) == False:
+        return
+
+    for file_name in os.listdir( cache_dir ):
+        (sprite_hash, ext) = os.path.splitext( file_name )
+        if ext != trim_cache_ext or not sprite_hash in sprite_hashes:
+            os.remove( os.path.join(cache_dir, file_name) )
+
+# Wrap an image already in memory up as a PyTexturePacker ImageRect, as if it had been loaded from image_path
+def make_image_rect( img, image_path ):
+
+    image_rect = ImageRect()
+    image_rect.image = img
+    image_rect.image_path = image_path
+    image_rect.x, image_rect.y = 0, 0
+    image_rect.width, image_rect.height = img.size
+    image_rect.source_size = img.size
+    image_rect.source_box = (0, 0) + img.size
+
+    return image_rect
+
+# Wrap a sprite trimmed by trim_sprite (its (trimmed image, source box, source size)) up as a PyTexturePacker ImageRect
+# marked as already trimmed, so the packer doesn't trim it again
+def make_trimmed_image_rect( trimmed_sprite, image_path ):
+
+    (img, source_box, source_size) = trimmed_sprite
+
+    image_rect = make_image_rect( img, image_path )
+    image_rect.source_box = source_box
+    image_rect.source_size = source_size
+    # Private, but it's the flag ImageRect.trim checks before trimming (PyTexturePacker is pinned in requirements.txt for this)
+    image_rect._trimmed = True
+
+    return image_rect
+
+# Trim (any that aren't already) and pack PyTexturePacker ImageRects, returns a list of pages, each the packed image and its sorted frames
+def pack_image_rects( image_rects, packer_options, dedup=True ):
+
+    # create a MaxRectsBinPacker
+    packer = Packer.create( **packer_options )
+
+    for image_rect in image_rects:
+        image_rect.trim( packer_options['trim_mode'] )
+
+    # Only the first of each set of identical sprites is packed, the rest share its place in the sheet
+    map_aliases = group_duplicates( [image_rect.image for image_rect in image_rects], dedup )
+    map_rect_aliases = {id(image_rects[i]): [image_rects[alias] for alias in aliases] for (i, aliases) in map_aliases.items()}
+
+    # Sprites that don't fit in one atlas spill over into more
+    # Packer.pack only takes paths and writes the atlases out to disk, so this goes through the private _pack it wraps
+    # to keep everything in memory (PyTexturePacker is pinned in requirements.txt for this)
+    # A sprite too big for a sheet on its own would leave PyTexturePacker trying new atlases forever, so check first
+    packed_rects = [image_rects[i] for i in map_aliases.keys()]
+    check_sprites_fit( [os.path.basename(image_rect.image_path) for image_rect in packed_rects], [(image_rect.width, image_rect.height) for image_rect in packed_rects], packer_options )
+
+    atlas_list = packer._pack( packed_rects )
+
+    pages = []
+    for atlas in atlas_list:
+
+        # Frames are keyed by file name and sorted, the same as PyTexturePacker's plist
+        map_frames = {}
+        for packed_rect in atlas.image_rect_list:
+            for image_rect in map_rect_aliases[id(packed_rect)]:
+                map_frames[os.path.basename(image_rect.image_path)] = {'x': packed_rect.x,'y': packed_rect.y,'w': packed_rect.width,'h': packed_rect.height,'ax': image_rect.source_box[0],'ay': image_rect.source_box[1],'aw': image_rect.source_size[0],'ah': image_rect.source_size[1]}
+
+        pages.append( (atlas.dump_image(packer_options['bg_color']), sorted(map_frames.items())) )
+
+    return pages
+
+# Load a sprite and trim it the same way PyTexturePacker does, clearing out pixels with alpha below trim_mode first
+# Returns (trimmed image, box the trimmed image came from within the original, size of the original)
+def load_trimmed_sprite( sprite_path, trim_mode ):
+
+    metrics.count( 'decode_calls' )
+
+    with Image.open( sprite_path ) as sprite_img:
+        sprite_img.load()
+
+        if trim_mode == 0:
+            return (sprite_img.copy(), (0, 0) + sprite_img.size, sprite_img.size)
+
+        return trim_sprite( sprite_img, trim_mode )
+
+# Trim a sprite already in memory, returns (trimmed image, box the trimmed image came from within the original, size of the original)
+# The result is the same as PyTexturePacker's trim (clear pixels with alpha below trim_mode, then crop to what's left),
+# but the box is found from the alpha band alone and only pixels within the box are ever cleared
+def trim_sprite( sprite_img, trim_mode ):
+
+    if trim_mode == 0:
+        return (sprite_img, (0, 0) + sprite_img.size, sprite_img.size)
+
+    if sprite_img.mode != "RGBA":
+        sprite_img = sprite_img.convert("RGBA")
+
+    source_size = sprite_img.size
+
+    # Pixels at or above the alpha cut off are the ones kept
+    alpha = sprite_img.getchannel("A")
+    if trim_mode > 1:
+        alpha = alpha.point( lambda a: 255 if a >= trim_mode else 0 )
+
+    bbox = alpha.getbbox()
+    if bbox == None:
+        # Nothing left once cleared, so it's all cleared and left untrimmed
+        return (Image.new("RGBA", source_size, (0,0,0,0)), (0, 0) + source_size, source_size)
+
+    sprite_img = sprite_img.crop( bbox )
+
+    # Clear anything within the box below the cut off, if there is anything
+    alpha = alpha.crop( bbox )
+    if alpha.getextrema()[0] == 0:
+        sprite_img.paste( (0,0,0,0), mask=alpha.point( lambda a: 0 if a else 255 ) )
+
+    return (sprite_img, bbox, source_size)
+
+# Pack a list of (file name, trimmed image, source box, source size) with native_packer
+# returns a list of pages, each the packed image and its sorted frames
+# With a layout_time_budget, sprites that fit on one sheet are laid out by searching for the smallest sheet on jobs processes
+def pack_trimmed_sprites( sprites, packer_options, dedup=True, layout_time_budget=None, jobs=1 ):
+
+    # Only the first of each set of identical sprites is packed, the rest share its place in the sheet
+    map_aliases = group_duplicates( [sprite[1] for sprite in sprites], dedup )
+    unique_sprites = list( map_aliases.keys() )
+    sizes = [sprites[i][1].size for i in unique_sprites]
+
+    packed_pages = None
+    if layout_time_budget != None and len(sizes) > 0:
+        bleed = alpha_bleed_pixels if packer_options['reduce_border_artifacts'] else 0
+        with metrics.stage( 'search_layouts' ):
+            packed = layout_search.search_layouts( sizes, packer_options, layout_time_budget, jobs, bleed )
+
+        if packed != None:
+            packed_pages = [(list(range(len(sizes))), packed[0], packed[1])]
+        else:
+            print("# \tNo layout found with every sprite on one sheet, packing as usual")
+
+    if packed_pages == None:
+        packed_pages = native_packer.pack_pages( sizes,
+                                                 packer_options['max_width'],
+                                                 packer_options['max_height'],
+                                                 border_padding=packer_options['border_padding'],
+                                                 shape_padding=packer_options['shape_padding'],
+                                                 inner_padding=packer_options['inner_padding'] )
+
+    if packed_pages == None:
+        check_sprites_fit( [sprites[i][0] for i in unique_sprites], sizes, packer_options )
+        raise ValueError( "sprites don't fit in a " + str(packer_options['max_width']) + "x" + str(packer_options['max_height']) + " sheet" )
+
+    pages = []
+    for (page, positions, sheet_wh) in packed_pages:
+
+        img = Image.new( "RGBA", sheet_wh, packer_options['bg_color'] )
+
+        map_frames = {}
+        for (unique_index, (x, y)) in zip([unique_sprites[i] for i in page], positions):
+            sprite_img = sprites[unique_index][1]
+            img.paste( sprite_img, (x, y) )
+
+            for i in map_aliases[unique_index]:
+                (file_name, alias_img, source_box, source_size) = sprites[i]
+                map_frames[file_name] = {'x': x,'y': y,'w': sprite_img.width,'h': sprite_img.height,'ax': source_box[0],'ay': source_box[1],'aw': source_size[0],'ah': source_size[1]}
+
+        pages.append( (img, sorted(map_frames.items())) )
+
+    return pages
+
+# Raise a ValueError naming the first of the (trimmed) sprites that doesn't fit in a sheet of the max size on its own
+def check_sprites_fit( file_names, sizes, packer_options ):
+
+    max_w = packer_options['max_width']
+    max_h = packer_options['max_height']
+    padding = (packer_options['border_padding'], packer_options['shape_padding'], packer_options['inner_padding'])
+
+    for (file_name, (w, h)) in zip(file_names, sizes):
+        if native_packer.pack_rects( [(w, h)], max_w, max_h, *padding ) == None:
+            raise ValueError( "sprite \"" + file_name + "\" (" + str(w) + "x" + str(h) + " trimmed) doesn't fit in a " + str(max_w) + "x" + str(max_h) + " sheet, even on its own" )
+
+# Encode the sheet's image, this should be the only time it gets written
+# png_options (from defaults.get_png_options) are passed to the PNG encoder, with optimize the smallest encoding found is written instead
+def save_spritesheet( sheet, png_options={}, optimize=False ):
 
     print("# \tSaving sheet...")
 
-    # Re-save texture
-    img.save( new_img_path, **img_info )
+    sheet_path = sheet['name'] + "." + sheet['type']
 
-    texture_wh = (tweaked_bbox[2], tweaked_bbox[3])
-    return texture_wh
-    
+    save_sheet_image( sheet['image'], sheet_path, png_options, optimize )
+
+
+def save_sheet_image( img, img_path, png_options={}, optimize=False ):
 
-def prettify(elem):
-    """Return a pretty-printed XML string for the Element.
-    """
-    rough_string = ElementTree.tostring(elem, 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    return reparsed.toprettyxml(indent="\t")
+    if os.path.splitext( img_path )[1].lower() != ".png":
+        png_options = {}
+        optimize = False
+
+    if optimize:
+        with metrics.stage( 'optimize_sheet' ):
+            data = optimize_png( img, png_options )
+        with open(img_path, "wb") as f:
+            f.write( data )
+    else:
+        with metrics.stage( 'encode_sheet' ):
+            img.save( img_path, **png_options )
+
+    metrics.count( 'encode_calls' )
+    metrics.count( 'bytes_written', os.path.getsize(img_path) )
+
+
+# zlib strategies tried by optimize_png, which suits a sheet depends on how much flat colour and empty space it has
+optimize_strategies = [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE]
+
+# Final pass for sheets that are being shipped, encode the image with Pillow's optimize at the highest compression level
+# trying each of optimize_strategies, and return the smallest PNG as bytes
+def optimize_png( img, png_options={} ):
+
+    smallest = None
+    for strategy in optimize_strategies:
+        options = dict(png_options)
+        options.update( {'compress_level': 9, 'optimize': True, 'compress_type': strategy} )
+
+        buffer = io.BytesIO()
+        img.save( buffer, "PNG", **options )
+        data = buffer.getvalue()
+        metrics.count( 'optimize_attempts' )
+
+        if smallest == None or len(data) < len(smallest):
+            smallest = data
+
+    # How much smaller it came out than a plain encode with the same settings
+    buffer = io.BytesIO()
+    img.save( buffer, "PNG", **png_options )
+    metrics.count( 'optimize_bytes_saved', max(0, buffer.tell() - len(smallest)) )
+
+    return smallest
+    
 
 def get_immediate_subdirectories(a_dir):
     return [name for name in os.listdir(a_dir)
             if os.path.isdir(os.path.join(a_dir, name))]
 
-# Convert PyTexturePacker's auto-generated plist into NK XML format
-def convert_plist( plist_name, texture_wh, src_dir ):
+# Convert a packed sheet's frames (what PyTexturePacker would write out as a plist) into NK XML format
+def convert_plist( sheet, src_dir, compact_xml=False, sidecar=False ):
 
     print("# Generating xml...")
 
     print("# \tSearching for animations for special formatting...")
 
+    return convert_frames( sheet, find_sprite_anims(src_dir), compact_xml, sidecar )
+
+# Find the animation each sprite under src_dir belongs to, returns a map of sprite file name -> animation name
+# Only sprites in the deepest folders are grouped into animations, named after their folder
+def find_sprite_anims( src_dir ):
+
     # keep track of deepest image we've found
     deepest_depth = 0
     # keep track of image and parent directory
@@ -113,112 +709,131 @@ def convert_plist( plist_name, texture_wh, src_dir ):
 
             # print( "Depth: " + str(dirpath.count(os.sep)) + " or " + str(sep_count) + ", " + dirpath )
 
-    # Build plist file path
-    plist_path = plist_name + '.plist'
+    return map_image_parent_dir
 
+# Write the NK XML for a packed sheet's frames, map_image_anim giving the animation (if any) of each sprite file name
+# Returns the map of sprites written, with sidecar the binary layout sidecar is written too (see write_xml)
+def convert_frames( sheet, map_image_anim, compact_xml=False, sidecar=False ):
 
-    print("# \tLoading plist...")
+    texture_name_type = [sheet['name'], sheet['type']]
 
-    # Read plist file and load data
-    f_plist = open(plist_path,"rb")
-    plist_contents = plistlib.load( f_plist )
-    f_plist.close()
 
-    # Get root dict
-    frames = plist_contents['frames']
+    print("# \tConverting to xml...")
 
-    metadata = plist_contents['metadata']
-    # print( metadata['realTextureFileName'] )
+    map_sprites = get_map_sprites( sheet, map_image_anim )
 
-    texture_name_type = metadata['realTextureFileName'].split('.')
+    write_xml( texture_name_type, sheet['texture_wh'], map_sprites, compact_xml, sidecar )
 
+    return map_sprites
 
-    print("# \tConverting to xml...")
+# A packed sheet's frames as a map of sprite name -> dict of x/y/w/h/ax/ay/aw/ah and 'anim', the animation it's in (if any)
+def get_map_sprites( sheet, map_image_anim ):
 
-    xml_root = Element('SpriteInformation')
-    xml_frame_info = SubElement(xml_root, 'FrameInformation')
-    xml_frame_info.set('name', texture_name_type[0])
-    xml_frame_info.set('texw', str(texture_wh[0]) )
-    xml_frame_info.set('texh', str(texture_wh[1]) )
-    xml_frame_info.set('type', texture_name_type[1])
+    map_sprites = {}
 
-    current_anim = ""
+    # For each frame
+    for (frame_key, frame) in sheet['frames']:
 
-    anim = None
+        sprite_name = os.path.splitext(frame_key)[0]
 
-    map_sprites = {}
+        map_sprites[sprite_name] = dict(frame)
 
-    # For each frame in dict
-    for frame_key in frames:
-        frame = frames[frame_key]
+        map_sprites[sprite_name]['anim'] = map_image_anim.get(frame_key)
 
-        sprite_name = os.path.splitext(frame_key)[0]
-        xywh = frame['frame']
-        xywh = xywh.replace('{', '')
-        xywh = xywh.replace('}', '')
-        xywh = xywh.split(',')
-        # offset = frame['offset'] # Unused
-        # rotated = frame['rotated'] # Unused
-        sourceColorRect = frame['sourceColorRect']
-        sourceColorRect = sourceColorRect.replace('{', '')
-        sourceColorRect = sourceColorRect.replace('}', '')
-        sourceColorRect = sourceColorRect.split(',')
-        sourceSize = frame['sourceSize']
-        sourceSize = sourceSize.replace('{', '')
-        sourceSize = sourceSize.replace('}', '')
-        sourceSize = sourceSize.split(',')
-        # print ( frame['frame'] )
-
-        map_sprites[sprite_name] = {'x': xywh[0],'y': xywh[1],'w': xywh[2],'h': xywh[3],'ax': sourceColorRect[0],'ay': sourceColorRect[1],'aw': sourceSize[0],'ah': sourceSize[1]}
-
-        cell = None
-
-        if frame_key in map_image_parent_dir:
-            new_anim = map_image_parent_dir[frame_key]
+    return map_sprites
+
+# Escape a value for use in an xml attribute
+def escape_attrib( value ):
+    return str(value).replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+# Write the NK XML for a map of sprites (in the order they should appear) to <texture name>.xml
+# The xml is written straight out a line at a time, indented with tabs, or all on one line if compact
+def write_xml( texture_name_type, texture_wh, map_sprites, compact=False, sidecar=False ):
+
+    # Group the cells under their animations first, a sprite rejoins the animation it follows
+    # even when a sprite from outside any animation comes between them
+    frame_info_children = []
+
+    current_anim = ""
+
+    anim_cells = None
+
+    for sprite_name, v in map_sprites.items():
+
+        if v['anim'] != None:
+            new_anim = v['anim']
             if new_anim != current_anim:
                 current_anim = new_anim
-                anim = SubElement(xml_frame_info, 'Animation')
-                anim.set('name', current_anim)
-            
-            cell = SubElement(anim, 'Cell')
+                anim_cells = []
+                frame_info_children.append( (current_anim, anim_cells) )
+
+            anim_cells.append( (sprite_name, v) )
         else:
 
-            cell = SubElement(xml_frame_info, 'Cell')
-        
-        cell.set('name', sprite_name)
-        cell.set('x', xywh[0])
-        cell.set('y', xywh[1])
-        cell.set('w', xywh[2])
-        cell.set('h', xywh[3])
-        cell.set('ax', sourceColorRect[0])
-        cell.set('ay', sourceColorRect[1])
-        cell.set('aw', sourceSize[0])
-        cell.set('ah', sourceSize[1])
+            frame_info_children.append( (None, (sprite_name, v)) )
 
     print("# \tFormatting and writing xml...")
 
-    # Write back to file
-    xmlstr = prettify(xml_root)
-    with open(texture_name_type[0] + '.xml', "w") as f_xml:
-        f_xml.write(xmlstr)
-        f_xml.close()
+    newline = "" if compact else "\n"
+    indent = "" if compact else "\t"
 
-    os.remove( plist_path )
+    def cell_line( depth, sprite_name, v ):
+        line = indent * depth + '<Cell name="' + escape_attrib(sprite_name) + '"'
+        for key in ('x', 'y', 'w', 'h', 'ax', 'ay', 'aw', 'ah'):
+            line += ' ' + key + '="' + escape_attrib(v[key]) + '"'
+        return line + '/>' + newline
 
-    return map_sprites
+    xml_path = texture_name_type[0] + '.xml'
+
+    with metrics.stage( 'write_xml' ), open(xml_path, "w") as f_xml:
+        f_xml.write( '<?xml version="1.0" ?>' + newline )
+        f_xml.write( '<SpriteInformation>' + newline )
+
+        frame_info = indent + '<FrameInformation name="' + escape_attrib(os.path.basename(texture_name_type[0])) + '" texw="' + escape_attrib(texture_wh[0]) + '" texh="' + escape_attrib(texture_wh[1]) + '" type="' + escape_attrib(texture_name_type[1]) + '"'
+
+        if len(frame_info_children) == 0:
+            f_xml.write( frame_info + '/>' + newline )
+        else:
+            f_xml.write( frame_info + '>' + newline )
+
+            for (anim_name, child) in frame_info_children:
+                if anim_name == None:
+                    f_xml.write( cell_line(2, *child) )
+                    continue
+
+                f_xml.write( indent * 2 + '<Animation name="' + escape_attrib(anim_name) + '">' + newline )
+                for (sprite_name, v) in child:
+                    f_xml.write( cell_line(3, sprite_name, v) )
+                f_xml.write( indent * 2 + '</Animation>' + newline )
 
-def pad_sprites( map_sprites, sheet_name ):
+            f_xml.write( indent + '</FrameInformation>' + newline )
+
+        f_xml.write( '</SpriteInformation>' + "\n" )
+
+    metrics.count( 'bytes_written', os.path.getsize(xml_path) )
+
+    # The same cells in the same order, for loaders that would rather not parse the xml
+    if sidecar:
+        groups = [(anim_name, child) if anim_name != None else (None, [child]) for (anim_name, child) in frame_info_children]
+        sidecar_path = layout_sidecar.get_sidecar_path( xml_path )
+
+        with metrics.stage( 'write_sidecar' ):
+            layout_sidecar.write_sidecar( sidecar_path, texture_name_type, texture_wh, groups, hash_file(xml_path) )
+
+        metrics.count( 'bytes_written', os.path.getsize(sidecar_path) )
+
+def pad_sprites( map_sprites, sheet ):
     print("# \tDuplicating sprite edges...")
 
-    # Read image and get info
-    new_img_path = sheet_name + ".png"
-    img = Image.open( new_img_path )
+    with metrics.stage( 'pad_sprites' ):
+        duplicate_edges( sheet['image'], map_sprites )
 
-    pixels = img.load() # create the pixel map
+# Duplicate the edge pixels of sprites that touch the edge of their original image out into the padding around them
+# Each edge is copied as a whole 1 pixel strip, rather than pixel by pixel
+def duplicate_edges( img, map_sprites ):
 
     for k, v in map_sprites.items():
 
-        # left edge
         x = int(v['x'])
         y = int(v['y'])
         w = int(v['w'])
@@ -232,41 +847,423 @@ def pad_sprites( map_sprites, sheet_name ):
         # Left
         if ax == 0:
             # print("Duplicated left edge for sprite " + k)
-            _x = x
-            for _y in range(y, y+h):
-                if _y % 2 == 0 or True:
-                    pixels[_x-1, _y] = pixels[_x, _y]
-                else:
-                    pixels[_x-1, _y] = (255,0,0,255)
+            img.paste( img.crop((x, y, x+1, y+h)), (x-1, y) )
 
         # Right
         if aw-ax == w:
             # print("Duplicated right edge for sprite " + k)
-            _x = x + w - 1
-            for _y in range(y, y+h):
-                if _y % 2 == 0 or True:
-                    pixels[_x+1, _y] = pixels[_x, _y]
-                else:
-                    pixels[_x+1, _y] = (255,0,0,255)
+            img.paste( img.crop((x+w-1, y, x+w, y+h)), (x+w, y) )
 
         # Top
         if ay == 0:
             # print("Duplicated top edge for sprite " + k)
-            _y = y
-            for _x in range(x, x+w):
-                if _x % 2 == 0 or True:
-                    pixels[_x, _y-1] = pixels[_x, _y]
-                else:
-                    pixels[_x, _y-1] = (255,0,0,255)
+            img.paste( img.crop((x, y, x+w, y+1)), (x, y-1) )
             
         # Bottom
         if ah-ay == h:
             # print("Duplicated bottom edge for sprite " + k)
-            _y = y + h - 1
-            for _x in range(x, x+w):
-                if _x % 2 == 0 or True:
-                    pixels[_x, _y+1] = pixels[_x, _y]
-                else:
-                    pixels[_x, _y+1] = (255,0,0,255)
-        
-    img.save( new_img_path )
+            img.paste( img.crop((x, y+h-1, x+w, y+h)), (x, y+h) )
+
+# Find every sprite the packer will pick up under src_dir, keyed by path relative to src_dir
+def find_sprites( src_dir ):
+
+    sprite_paths = {}
+    for (dirpath, dirnames, filenames) in os.walk(src_dir):
+        for filename in filenames:
+            if os.path.splitext(filename)[1].lower() in Utils.SUPPORTED_IMAGE_FORMAT:
+                sprite_path = os.path.join(dirpath, filename)
+                sprite_paths[os.path.relpath(sprite_path, src_dir).replace(os.sep, "/")] = sprite_path
+
+    return sprite_paths
+
+# Sprites can also come from a zip or tar archive (e.g. one written by explode --archive) rather than a folder
+def is_sprite_archive( src_dir ):
+    return os.path.isfile( src_dir ) and (zipfile.is_zipfile( src_dir ) or tarfile.is_tarfile( src_dir ))
+
+# Files the sprites for a build come from, keyed by path relative to src_dir, for an archive that's just the archive itself
+def find_sprite_sources( src_dir ):
+
+    if is_sprite_archive( src_dir ):
+        return {os.path.basename(src_dir): src_dir}
+
+    return find_sprites( src_dir )
+
+# Read every sprite out of an archive without extracting it to disk
+# Returns (list of (file name, image) in the order they're stored, map of sprite file name -> animation, as find_sprite_anims would give for the same folders)
+def read_sprite_archive( archive_path ):
+
+    print("# Reading sprites from archive \"" + archive_path + "\"...")
+
+    members = []
+    if zipfile.is_zipfile( archive_path ):
+        with zipfile.ZipFile( archive_path, "r" ) as archive_file:
+            for member_name in archive_file.namelist():
+                if os.path.splitext(member_name)[1].lower() in Utils.SUPPORTED_IMAGE_FORMAT:
+                    members.append( (member_name, archive_file.read(member_name)) )
+    else:
+        with tarfile.open( archive_path, "r" ) as archive_file:
+            for member_info in archive_file:
+                if member_info.isfile() and os.path.splitext(member_info.name)[1].lower() in Utils.SUPPORTED_IMAGE_FORMAT:
+                    members.append( (member_info.name, archive_file.extractfile(member_info).read()) )
+
+    sprites = []
+    with metrics.stage( 'decode_sprites' ):
+        for (member_name, data) in members:
+            with Image.open( io.BytesIO(data) ) as sprite_img:
+                sprite_img.load()
+                sprites.append( (os.path.basename(member_name), sprite_img.copy()) )
+
+    metrics.count( 'decode_calls', len(sprites) )
+
+    # Only the deepest sprites get an animation, the folder they're in, sprites in the root of the archive are in one named after the archive
+    archive_name = os.path.splitext( os.path.basename(archive_path) )[0]
+    deepest_depth = max( [member_name.count('/') for (member_name, data) in members] + [0] )
+
+    map_image_anim = {}
+    for (member_name, data) in members:
+        if member_name.count('/') == deepest_depth:
+            member_dir = os.path.dirname( member_name )
+            map_image_anim[os.path.basename(member_name)] = os.path.basename(member_dir) if member_dir != "" else archive_name
+
+    return (sprites, map_image_anim)
+
+def get_build_cache_path( sheet_name ):
+    return sheet_name + ".buildcache.json"
+
+# Stamp every sprite, reusing the hash from the last build for any sprite whose mtime and size haven't changed
+def stamp_sprites( sprite_paths, old_stamps ):
+
+    metrics.count( 'sprites_stamped', len(sprite_paths) )
+
+    stamps = {}
+    for rel_path, sprite_path in sprite_paths.items():
+        old_stamp = old_stamps.get(rel_path)
+        if old_stamp != None and is_stamp_current(sprite_path, old_stamp):
+            stamps[rel_path] = old_stamp
+        else:
+            stamps[rel_path] = file_stamp(sprite_path)
+
+    return stamps
+
+# Read the build cache of a sheet as it is, whether or not it's still valid, returns None if there isn't one that can be read
+def read_build_cache( sheet_name ):
+
+    cache_path = get_build_cache_path( sheet_name )
+    if os.path.exists(cache_path) == False:
+        return None
+
+    try:
+        with open(cache_path, "r") as f_cache:
+            cache = json.load( f_cache )
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(cache, dict):
+        return None
+
+    return cache
+
+# Read the build cache of a sheet, returns None if there isn't one or it was built with different options or settings
+def load_build_cache( sheet_name, max_w, max_h, settings ):
+
+    cache = read_build_cache( sheet_name )
+    if cache == None:
+        if os.path.exists( get_build_cache_path(sheet_name) ):
+            print("!# \tCould not read build cache, rebuilding: " + get_build_cache_path(sheet_name))
+        return None
+
+    # Round trip the options through json so they compare the same way as the cached ones
+    options = json.loads( json.dumps(get_packer_options(max_w, max_h)) )
+    if cache.get('version') != build_cache_version or cache.get('options') != options or cache.get('settings') != settings:
+        return None
+
+    return cache
+
+# pages is a list of what was written for each page of the sheet, dicts of 'texture_name_type', 'texture_wh' and 'map_sprites'
+# Any pages the last build wrote that this one didn't (e.g. the sheet now fits on fewer pages) are removed first
+def save_build_cache( sheet_name, max_w, max_h, settings, sprite_stamps, pages ):
+
+    remove_stale_pages( sheet_name, pages )
+
+    cache_pages = []
+    for page in pages:
+        texture_name_type = page['texture_name_type']
+
+        cache_page = dict(page)
+        cache_page['png'] = file_stamp( texture_name_type[0] + "." + texture_name_type[1] )
+        cache_page['xml'] = file_stamp( texture_name_type[0] + ".xml" )
+        cache_pages.append( cache_page )
+
+    cache = { 'version': build_cache_version,
+              'options': get_packer_options(max_w, max_h),
+              'settings': settings,
+              'sprites': sprite_stamps,
+              'pages': cache_pages }
+
+    with open(get_build_cache_path(sheet_name), "w") as f_cache:
+        json.dump( cache, f_cache )
+
+# Files written for a page of a sheet, its image, xml and layout sidecar (if there is one)
+def get_page_files( texture_name_type ):
+    return [texture_name_type[0] + "." + texture_name_type[1], texture_name_type[0] + ".xml", layout_sidecar.get_sidecar_path(texture_name_type[0] + ".xml")]
+
+# Remove the files of any page the sheet's build cache recorded that isn't one of pages, so the page count
+# shrinking (or a sheet going from one page to several) doesn't leave old sheets behind to be picked up by explode
+# The old pages are read from the cache whether or not it's still valid, it only has to say what was written
+def remove_stale_pages( sheet_name, pages ):
+
+    cache = read_build_cache( sheet_name )
+    if cache == None:
+        return
+
+    old_pages = cache.get( 'pages', [] )
+
+    page_files = set()
+    for page in pages:
+        page_files.update( get_page_files(page['texture_name_type']) )
+
+    for old_page in old_pages:
+        try:
+            old_files = get_page_files( old_page['texture_name_type'] )
+        except (KeyError, TypeError, IndexError):
+            continue
+
+        for path in old_files:
+            if not path in page_files and os.path.isfile( path ):
+                print("# \tRemoving page no longer in the sheet: " + path)
+                os.remove( path )
+
+# Check an output file still matches what the last build wrote
+def is_output_current( path, stamp ):
+
+    if os.path.exists(path) == False:
+        return False
+
+    if is_stamp_current(path, stamp):
+        return True
+
+    return file_stamp(path)['hash'] == stamp['hash']
+
+# Try to bring the sheet up to date using the last build, returns (whether it was, the sprites' stamps if they got taken along the way or None)
+# If no sprites changed then there's nothing to do, if some sprites changed but trim to the same size
+# they're re-blitted into the existing sheet in place of a full repack, otherwise a full build is needed and can reuse the stamps
+def update_cached_spritesheet( src_dir, sheet_name, max_w, max_h, settings ):
+
+    cache = load_build_cache( sheet_name, max_w, max_h, settings )
+    if cache == None:
+        return (False, None)
+
+    pages = cache['pages']
+
+    # Make sure nobody has touched the outputs since
+    for page in pages:
+        texture_name_type = page['texture_name_type']
+        if is_output_current(texture_name_type[0] + "." + texture_name_type[1], page['png']) == False or is_output_current(texture_name_type[0] + ".xml", page['xml']) == False:
+            return (False, None)
+
+        if settings['layout_sidecar'] and os.path.isfile( layout_sidecar.get_sidecar_path(texture_name_type[0] + ".xml") ) == False:
+            return (False, None)
+
+    sprite_paths = find_sprite_sources( src_dir )
+    if set(sprite_paths.keys()) != set(cache['sprites'].keys()):
+        return (False, None)
+
+    sprite_stamps = stamp_sprites( sprite_paths, cache['sprites'] )
+    changed_sprites = [rel_path for rel_path in sprite_paths if sprite_stamps[rel_path]['hash'] != cache['sprites'][rel_path]['hash']]
+
+    # Anything changing in an archive means reading it all again anyway
+    if len(changed_sprites) > 0 and is_sprite_archive( src_dir ):
+        return (False, sprite_stamps)
+
+    packer_options = get_packer_options( max_w, max_h )
+
+    sprite_places = get_sprite_places( pages )
+
+    # Trim the changed sprites the same way the packer does, any that come out a different size need a repack
+    changed_images = [{} for page in pages]
+    for rel_path in changed_sprites:
+        sprite_name = os.path.splitext( os.path.basename(rel_path) )[0]
+        if not sprite_name in sprite_places[0]:
+            return (False, sprite_stamps)
+
+        trimmed_sprite = load_trimmed_sprite( sprite_paths[rel_path], packer_options['trim_mode'] )
+
+        page_index = find_reblit_page( pages, sprite_places, rel_path, trimmed_sprite )
+        if page_index == None:
+            return (False, sprite_stamps)
+
+        changed_images[page_index][sprite_name] = trimmed_sprite
+
+    if len(changed_sprites) == 0:
+        print("# Sprites unchanged since last build, nothing to do.")
+
+    for (page, page_changed_images) in zip(pages, changed_images):
+        if len(page_changed_images) > 0:
+            reblit_sprites( page, page_changed_images, packer_options, settings )
+
+    save_build_cache( sheet_name, max_w, max_h, settings, sprite_stamps, pages )
+
+    return (True, sprite_stamps)
+
+# Find the page each sprite is on, and count the sprites at each place on each page
+# (more than one means they were aliased as duplicates), returns (map of sprite name -> page index, map of (page index, x, y) -> count)
+def get_sprite_places( pages ):
+
+    map_sprite_page = {}
+    map_position_count = {}
+    for (page_index, page) in enumerate(pages):
+        for (sprite_name, v) in page['map_sprites'].items():
+            map_sprite_page[sprite_name] = page_index
+            position = (page_index, v['x'], v['y'])
+            map_position_count[position] = map_position_count.get( position, 0 ) + 1
+
+    return (map_sprite_page, map_position_count)
+
+# Work out which page a changed sprite (trimmed as by trim_sprite) can be re-blitted into, using the places from get_sprite_places
+# Returns None if it can't be, and the sheet needs a repack
+def find_reblit_page( pages, sprite_places, rel_path, trimmed_sprite ):
+
+    (map_sprite_page, map_position_count) = sprite_places
+
+    sprite_name = os.path.splitext( os.path.basename(rel_path) )[0]
+    if not sprite_name in map_sprite_page:
+        return None
+
+    page_index = map_sprite_page[sprite_name]
+    v = pages[page_index]['map_sprites'][sprite_name]
+    if trimmed_sprite[0].size != (v['w'], v['h']):
+        print("# \t\"" + rel_path + "\" changed size, repacking...")
+        return None
+
+    # Re-blitting would change every sprite it shares its place with too
+    if map_position_count[(page_index, v['x'], v['y'])] > 1:
+        print("# \t\"" + rel_path + "\" was a duplicate of another sprite, repacking...")
+        return None
+
+    return page_index
+
+# Paste changed sprites (a map of sprite name -> trimmed sprite) over the old ones in a page of the sheet
+# then write out the page's sheet and xml again
+# The page's image is decoded from disk, unless it's passed in as img (e.g. still in memory from the last build)
+def reblit_sprites( page, changed_images, packer_options, settings, img=None ):
+
+    texture_name_type = page['texture_name_type']
+    map_sprites = page['map_sprites']
+    img_path = texture_name_type[0] + "." + texture_name_type[1]
+
+    print("# Re-blitting " + str(len(changed_images)) + " changed sprites into \"" + img_path + "\"...")
+
+    if img == None:
+        with metrics.stage( 'decode_sheet' ):
+            img = Image.open( img_path )
+            img.load()
+
+        metrics.count( 'decode_calls' )
+
+    blit_sprites( img, map_sprites, changed_images, packer_options )
+
+    save_sheet_image( img, img_path, settings['png_options'], settings['optimize'] )
+
+    write_xml( texture_name_type, page['texture_wh'], map_sprites, settings['compact_xml'], settings['layout_sidecar'] )
+
+# Paste changed sprites over the old ones in a sheet's image, updating their entries in map_sprites
+def blit_sprites( img, map_sprites, changed_images, packer_options ):
+
+    inner_padding = packer_options['inner_padding']
+
+    for sprite_name, (sprite_img, source_box, source_size) in changed_images.items():
+        v = map_sprites[sprite_name]
+        x = v['x']
+        y = v['y']
+
+        # Area taken by the sprite, including the inner padding its edges are duplicated into
+        area = (x - inner_padding, y - inner_padding, x + sprite_img.width + inner_padding, y + sprite_img.height + inner_padding)
+
+        # Clear out the old sprite and paste the new one in
+        img.paste( (0,0,0,0), area )
+        img.paste( sprite_img, (x, y) )
+
+        # Redo the border artifact reduction within the sprite's own area
+        # (anything the old sprite bled out into the surrounding padding is left as is)
+        if packer_options['reduce_border_artifacts']:
+            img.paste( Utils.alpha_bleeding(img.crop(area)), area )
+
+        # The offset within the original image may have moved even though the trimmed size hasn't
+        v['ax'] = source_box[0]
+        v['ay'] = source_box[1]
+        v['aw'] = source_size[0]
+        v['ah'] = source_size[1]
+
+    duplicate_edges( img, {sprite_name: map_sprites[sprite_name] for sprite_name in changed_images} )
+
+# Anything else that changes the output, alongside the packer options, a change to any of these needs a full build
+def get_build_settings( engine='pytexturepacker', compact_xml=False, dedup=True, png_options={}, optimize=False, optimize_layout=False, sidecar=False ):
+    return {'engine': engine, 'compact_xml': compact_xml, 'dedup': dedup, 'png_options': png_options, 'optimize': optimize, 'optimize_layout': optimize_layout, 'layout_sidecar': sidecar}
+
+# Build a sprite sheet and matching xml from the sprites in src_dir, a folder or a zip/tar archive of sprites
+# Unless use_cache is False, the last build of the sheet is reused where the sprites allow
+# png_options and optimize are passed on to save_spritesheet
+# With jobs > 1 sprites are loaded and trimmed on a pool of processes, and unless use_cache is False sprites that haven't changed come from the trim cache
+# With optimize_layout, the smallest layout that can be found within layout_time_budget seconds is used (searched on jobs processes)
+# With sidecar, a binary copy of each xml is written alongside it (see layout_sidecar)
+def build_spritesheet( src_dir, sheet_name, max_w, max_h, use_cache=True, engine='pytexturepacker', compact_xml=False, dedup=True, png_options={}, optimize=False, jobs=1, optimize_layout=False, layout_time_budget=default_layout_time_budget, sidecar=False ):
+
+    settings = get_build_settings( engine, compact_xml, dedup, png_options, optimize, optimize_layout, sidecar )
+
+    if not optimize_layout:
+        layout_time_budget = None
+
+    sprite_stamps = None
+    if use_cache:
+        with metrics.stage( 'update_cached' ):
+            (updated, sprite_stamps) = update_cached_spritesheet( src_dir, sheet_name, max_w, max_h, settings )
+        if updated:
+            return
+
+    # Stamp the sprites before packing, so anything edited mid-build gets picked up next time
+    # (unless they were just stamped checking the last build, otherwise that build's stamps save hashing sprites that haven't been touched)
+    if sprite_stamps == None:
+        old_stamps = {}
+        if use_cache:
+            cache = read_build_cache( sheet_name )
+            if cache != None and isinstance(cache.get('sprites'), dict):
+                old_stamps = cache['sprites']
+
+        with metrics.stage( 'stamp_sprites' ):
+            sprite_stamps = stamp_sprites( find_sprite_sources(src_dir), old_stamps )
+
+    # pack sprite sheet in memory, over several pages if it won't fit on one
+    map_image_anim = None
+    if is_sprite_archive( src_dir ):
+        (sprites, map_image_anim) = read_sprite_archive( src_dir )
+        sheets = generate_spritesheet_from_images( sprites, sheet_name, max_w, max_h, engine, dedup, layout_time_budget, jobs )
+    else:
+        sheets = generate_spritesheet( src_dir, sheet_name, max_w, max_h, engine, dedup, jobs, sprite_stamps if use_cache else None, layout_time_budget )
+
+    pages = save_pages( sheets, src_dir, settings, map_image_anim )
+
+    save_build_cache( sheet_name, max_w, max_h, settings, sprite_stamps, pages )
+
+# Write out each packed page of a sheet and its xml, returns what was written for each page (as kept in the build cache)
+# Sprites' animations are found from the folders under src_dir, unless they're given in map_image_anim
+def save_pages( sheets, src_dir, settings, map_image_anim=None ):
+
+    pages = []
+    for sheet in sheets:
+
+        # Convert the packed frames into the NK xml format, return map of sprites and locations
+        with metrics.stage( 'convert_plist' ):
+            if map_image_anim == None:
+                map_sprites = convert_plist( sheet, src_dir, settings['compact_xml'], settings['layout_sidecar'] )
+            else:
+                map_sprites = convert_frames( sheet, map_image_anim, settings['compact_xml'], settings['layout_sidecar'] )
+
+        # Do a final pass on the spritesheet, duplicating edges where appropriate
+        pad_sprites( map_sprites, sheet )
+
+        # Only now is the sheet encoded and written out
+        save_spritesheet( sheet, settings['png_options'], settings['optimize'] )
+
+        pages.append( {'texture_name_type': [sheet['name'], sheet['type']], 'texture_wh': sheet['texture_wh'], 'map_sprites': map_sprites} )
+
+    return pages
@@ -1,158 +1,266 @@
+
 '''
-Decompiles either one spritesheet, a list of desired spritesheets, or every spritesheet in a given folder into individual sprites, 
-giving each spritesheet its own folder. Remembers every nonzero ah, aw, ax, and ay value and the sprites they belong to 
-(maybe append these values to the file name, or list them in a separate file?)
-
-- Scales every sprite to a desired scale, and multiplies all the memorized a values by the same scale. 
-  Rounds any decimal a values to the nearest integer.
-- Recompiles all the sprite folders into their spritesheets (options are PNG, JPEG, JPNG, or initial, warn about recompression for the latter three). 
-  Inserts them as demonstrated in this image.
-  
+    @file convert.py
+    @date 18/OCT/2026
+    @brief Rescale and repack sprite sheets straight from the sheet, without exploding the sprites out to disk.
+           Rescaling scales every sprite (and so its ax/ay/aw/ah) by a factor, e.g. to make half and quarter resolution tiers of a game's assets.
+           Repacking swaps in edited sprites from an overrides folder and packs the sheet again.
 '''
 
-from PIL import Image, ImageOps
-from xml.etree.ElementTree import parse, Element, SubElement, Comment, tostring
-from xml.etree import ElementTree
-from xml.dom import minidom
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from defaults import default_resample
+import explode
+import build
+import metrics
 import os
-import plistlib
-
-from PyTexturePacker import Packer
-
-def explode_spritesheet( sheet_name ):
-    img_path = sheet_name + '.png'
-    xml_path = sheet_name + '.xml'
-
-    img = Image.open( img_path )
-    img_info = img.info
-    
-    # make sure output folder exists
-    dir_name = sheet_name + '/'
-    if not os.path.exists( dir_name ):
-        os.mkdir( dir_name )
-
-    # Open xml file
-    texture_xml = parse( xml_path )
-
-    for cell in texture_xml.getroot().iter('Cell'):
-        print(cell.attrib['name'])
-
-        sprite_x = int(cell.attrib['x'])
-        sprite_y = int(cell.attrib['y'])
-        sprite_w = int(cell.attrib['w'])
-        sprite_h = int(cell.attrib['h'])
-
-        sprite_ax = int(cell.attrib['ax'])
-        sprite_ay = int(cell.attrib['ay'])
-        sprite_aw = int(cell.attrib['aw'])
-        sprite_ah = int(cell.attrib['ah'])
-
-        sprite_area = ( sprite_x, sprite_y, sprite_x + sprite_w, sprite_y + sprite_h )
-        cropped = img.crop( sprite_area )
-
-        alpha_border = (sprite_ax, sprite_ay, sprite_aw - sprite_ax - sprite_w, sprite_ah - sprite_ay - sprite_h)
-        cropped = ImageOps.expand( cropped, alpha_border, 0)
-
-        cropped.save( dir_name + cell.attrib['name'] + '.png', **img_info )
-
-
-def generate_spritesheet( src_dir, sheet_name ):
-    # create a MaxRectsBinPacker
-    # See here for argument details: https://github.com/wo1fsea/PyTexturePacker/blob/master/README.rst
-    packer = Packer.create( texture_format=".png",
-                            max_width=4096, 
-                            max_height=4096, 
-                            bg_color=(255,255,255,0),
-                            enable_rotated=False,
-                            force_square=False,
-                            border_padding=2,
-                            shape_padding=2,
-                            inner_padding=False,
-                            trim_mode=1,
-                            reduce_border_artifacts=False )
-
-    # pack texture images under directory <src_dir> and name the output image[s] as <sheet_name>.
-    packer.pack( src_dir, sheet_name )
-
-def prettify(elem):
-    """Return a pretty-printed XML string for the Element.
-    """
-    rough_string = ElementTree.tostring(elem, 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    return reparsed.toprettyxml(indent="\t")
-
-# Convert PyTexturePacker's auto-generated plist into NK XML format
-def convert_plist( plist_name ):
-    # Build plist file path
-    plist_path = plist_name + '.plist'
-
-    # Read plist file and load data
-    f = open(plist_path,"rb")
-    plist_contents = plistlib.load( f )
-
-    # Get root dict
-    frames = plist_contents['frames']
-
-    metadata = plist_contents['metadata']
-    print( metadata['realTextureFileName'] )
-
-    texture_name_type = metadata['realTextureFileName'].split('.')
-    texture_wh = metadata['size'][1:-1].split(',')
-
-
-    xml_root = Element('SpriteInformation')
-    xml_frame_info = SubElement(xml_root, 'FrameInformation')
-    xml_frame_info.set('name', texture_name_type[0])
-    xml_frame_info.set('texw', texture_wh[0])
-    xml_frame_info.set('texh', texture_wh[1])
-    xml_frame_info.set('type', texture_name_type[1])
-
-    # For each frame in dict
-    for frame_key in frames:
-        frame = frames[frame_key]
-
-        xywh = frame['frame']
-        xywh = xywh.replace('{', '')
-        xywh = xywh.replace('}', '')
-        xywh = xywh.split(',')
-        offset = frame['offset']
-        rotated = frame['rotated']
-        sourceColorRect = frame['sourceColorRect']
-        sourceColorRect = sourceColorRect.replace('{', '')
-        sourceColorRect = sourceColorRect.replace('}', '')
-        sourceColorRect = sourceColorRect.split(',')
-        sourceSize = frame['sourceSize']
-        sourceSize = sourceSize.replace('{', '')
-        sourceSize = sourceSize.replace('}', '')
-        sourceSize = sourceSize.split(',')
-        # print ( frame['frame'] )
-
-        cell = SubElement(xml_frame_info, 'Cell')
-        cell.set('name', frame_key)
-        cell.set('x', xywh[0])
-        cell.set('y', xywh[1])
-        cell.set('w', xywh[2])
-        cell.set('h', xywh[3])
-        cell.set('ax', sourceColorRect[0])
-        cell.set('ay', sourceColorRect[1])
-        cell.set('aw', sourceSize[0])
-        cell.set('ah', sourceSize[1])
-
-    # Write back to file
-    xmlstr = prettify(xml_root)
-    with open(texture_name_type[0] + '_CONVERT.xml', "w") as f:
-        f.write(xmlstr)
-        f.close()
-
-
-
-
-src_texture_name = 'boss_death'
-
-explode_spritesheet( src_texture_name )
-
-output_texture_name = 'boss_death_repacked'
-
-generate_spritesheet( src_texture_name, output_texture_name )
-
-convert_plist( output_texture_name )
+import time
+
+# Resampling filters that can be used when scaling sprites, one for each of defaults.resample_filters
+map_resample_filters = { 'nearest': Image.NEAREST,
+                         'bilinear': Image.BILINEAR,
+                         'bicubic': Image.BICUBIC,
+                         'lanczos': Image.LANCZOS }
+
+
+# Name of the folder a scale's sheets are written to, e.g. 'x0.5'
+def get_tier_name( scale ):
+    return "x" + "{:g}".format(scale)
+
+
+# Scale a sprite (padded out to its original size) by scale, never scaling anything down to nothing
+def scale_sprite( sprite_img, scale, resample=default_resample ):
+
+    scaled_size = ( max(1, int(round(sprite_img.width * scale))), max(1, int(round(sprite_img.height * scale))) )
+    if scaled_size == sprite_img.size:
+        return sprite_img
+
+    # Resample with pre-multiplied alpha, otherwise the colour of fully transparent pixels bleeds into the edges
+    if sprite_img.mode == "RGBA":
+        return sprite_img.convert("RGBa").resize( scaled_size, map_resample_filters[resample] ).convert("RGBA")
+
+    return sprite_img.resize( scaled_size, map_resample_filters[resample] )
+
+
+# Pack sprites (a list of (file name, image)) and write out the sheet(s) and xml, returns the number of pages written
+# png_options and optimize are passed on to build.save_spritesheet
+def save_sprites( sprites, map_image_anim, sheet_name, max_w, max_h, engine='pytexturepacker', dedup=True, compact_xml=False, png_options={}, optimize=False ):
+
+    sheet_dir = os.path.dirname( sheet_name )
+    if sheet_dir != "" and not os.path.exists( sheet_dir ):
+        os.makedirs( sheet_dir, exist_ok=True )
+
+    sheets = build.generate_spritesheet_from_images( sprites, sheet_name, max_w, max_h, engine, dedup )
+    for sheet in sheets:
+        with metrics.stage( 'convert_frames' ):
+            map_sprites = build.convert_frames( sheet, map_image_anim, compact_xml )
+        build.pad_sprites( map_sprites, sheet )
+        build.save_spritesheet( sheet, png_options, optimize )
+
+    return len(sheets)
+
+
+# Rescale one sheet to every scale, writing each to the matching output sheet name (without extension)
+# This is the unit of work handed to the process pool, so it only takes/returns picklable values
+# The sheet is decoded once, every cell is cut out and scaled to each size in turn, and only the packed sheets are written
+def rescale_sheet( sheet_path, xml_path, scaled_sheet_names, scales, max_w, max_h, engine='pytexturepacker', dedup=True, compact_xml=False, resample=default_resample, png_options={}, optimize=False ):
+
+    start = time.time()
+    metrics_before = metrics.snapshot()
+
+    # Scaled sprites for each scale, as (file name, image) ready for the packer, and the animation each sprite belongs to
+    scaled_sprites = [[] for scale in scales]
+    map_image_anim = {}
+
+    cell_count = 0
+    failed = 0
+    sheet_ext = os.path.splitext( sheet_path )[1]
+
+    for cell in explode.iter_cells( sheet_path, xml_path ):
+
+        cell_count += 1
+        (anim_name, file_name, sprite_img) = (cell['anim'], cell['name'] + sheet_ext, cell['image'])
+        if sprite_img == None:
+            failed += 1
+            continue
+
+        with metrics.stage( 'scale_sprites' ):
+            for (i, scale) in enumerate(scales):
+                scaled_sprites[i].append( (file_name, scale_sprite(sprite_img, scale, resample)) )
+
+        if anim_name != None:
+            map_image_anim[file_name] = anim_name
+
+    metrics.count( 'failed_cells', failed )
+
+    # Pack and write out each scale
+    page_count = 0
+    for (sheet_name, sprites) in zip(scaled_sheet_names, scaled_sprites):
+        page_count += save_sprites( sprites, map_image_anim, sheet_name, max_w, max_h, engine, dedup, compact_xml, png_options, optimize )
+
+    # What this call recorded goes back with the summary, when run in a worker process it's merged into the parent's metrics
+    return {'sheet': sheet_path, 'cells': cell_count, 'failed': failed, 'pages': page_count, 'time': time.time() - start, 'metrics': metrics.since(metrics_before)}
+
+
+# Repack a sheet into output_sheet_name (without extension), replacing sprites with any edited versions found in overrides_dir
+# Overrides are matched to cells by their path as explode would save them (e.g. 'run/run_00.png' for a cell in the 'run' animation),
+# or just by file name. Any overrides that don't match a cell are added as new sprites, in the animation named by their folder.
+# Only the sheet and the overrides are decoded, the sprites that haven't changed go straight from the sheet to the packer
+def repack_sheet( sheet_path, output_sheet_name, overrides_dir=None, max_w=4096, max_h=4096, engine='pytexturepacker', dedup=True, compact_xml=False, png_options={}, optimize=False ):
+
+    start = time.time()
+
+    xml_path = explode.find_sheet_xml( sheet_path, False )
+    if xml_path == None:
+        return None
+
+    sheet_ext = os.path.splitext( sheet_path )[1]
+
+    # Find the overrides, by path and by file name
+    override_paths = {}
+    if overrides_dir != None:
+        override_paths = build.find_sprites( overrides_dir )
+    map_name_override = {os.path.basename(rel_path): rel_path for rel_path in override_paths}
+
+    sprites = []
+    map_image_anim = {}
+    used_overrides = set()
+
+    cell_count = 0
+    failed = 0
+    for cell in explode.iter_cells( sheet_path, xml_path ):
+
+        cell_count += 1
+        (anim_name, file_name, sprite_img) = (cell['anim'], cell['name'] + sheet_ext, cell['image'])
+
+        # Swap in the override, if there is one
+        rel_path = explode.cell_sprite_path( anim_name, cell, sheet_ext )
+        if not rel_path in override_paths:
+            rel_path = map_name_override.get( file_name )
+
+        if rel_path != None:
+            sprite_img = load_override( override_paths[rel_path] )
+            used_overrides.add( rel_path )
+        elif sprite_img == None:
+            failed += 1
+            continue
+
+        sprites.append( (file_name, sprite_img) )
+        if anim_name != None:
+            map_image_anim[file_name] = anim_name
+
+    metrics.count( 'failed_cells', failed )
+
+    # Anything left over is a new sprite
+    added = 0
+    for (rel_path, override_path) in sorted(override_paths.items()):
+        if rel_path in used_overrides:
+            continue
+
+        file_name = os.path.basename( rel_path )
+        sprites.append( (file_name, load_override(override_path)) )
+
+        anim_dir = os.path.dirname( rel_path )
+        if anim_dir != "":
+            map_image_anim[file_name] = os.path.basename( anim_dir )
+
+        added += 1
+
+    print("# \t" + str(len(used_overrides)) + " sprites replaced, " + str(added) + " added from: " + str(overrides_dir))
+
+    page_count = save_sprites( sprites, map_image_anim, output_sheet_name, max_w, max_h, engine, dedup, compact_xml, png_options, optimize )
+
+    return {'sheet': sheet_path, 'cells': cell_count, 'failed': failed, 'pages': page_count, 'replaced': len(used_overrides), 'added': added, 'time': time.time() - start}
+
+
+def load_override( override_path ):
+
+    with metrics.stage( 'decode_overrides' ), Image.open( override_path ) as f_img:
+        override_img = f_img.copy()
+    metrics.count( 'decode_calls' )
+
+    return override_img
+
+
+# Rescale every sprite sheet found at each of sheet_paths to each scale, returns a list of per-sheet summaries
+# Sheets are written to output_root/<tier>/..., following the same folder structure as explode, e.g. output_root/x0.5/my_sheet.png
+# With jobs > 1 sheets are rescaled on a pool of processes
+def rescale_spritesheets( sheet_paths, output_root, scales, max_w, max_h, engine='pytexturepacker', dedup=True, compact_xml=False, resample=default_resample, jobs=1, png_options={}, optimize=False ):
+
+    # Find every sheet, and where each scale of it goes
+    sheets = []
+    for sheet_path in sheet_paths:
+        print("# Searching for sprite sheets at: " + sheet_path)
+
+        for (sub_file, sub_output_root) in explode.find_spritesheets( sheet_path, output_root ):
+
+            xml_path = explode.find_sheet_xml( sub_file, False )
+            if xml_path == None:
+                continue
+
+            sheet_name = os.path.splitext( os.path.basename(sub_file) )[0]
+            relative_path = os.path.relpath( sub_output_root, output_root )
+
+            scaled_sheet_names = [os.path.normpath(os.path.join(output_root, get_tier_name(scale), relative_path, sheet_name)) for scale in scales]
+            sheets.append( (sub_file, xml_path, scaled_sheet_names) )
+
+    summaries = []
+
+    def failed_summary( sub_file, e ):
+        print("!# \tFailed to rescale: " + sub_file + " (" + str(e) + ")")
+        return {'sheet': sub_file, 'cells': 0, 'failed': 1, 'pages': 0, 'time': 0.0}
+
+    # Serial path, rescale each sheet in turn
+    if jobs <= 1:
+        for (sub_file, xml_path, scaled_sheet_names) in sheets:
+            print("# Rescaling: " + sub_file)
+
+            try:
+                summary = rescale_sheet( sub_file, xml_path, scaled_sheet_names, scales, max_w, max_h, engine, dedup, compact_xml, resample, png_options, optimize )
+                summary.pop( 'metrics' )
+            except Exception as e:
+                summary = failed_summary( sub_file, e )
+
+            summaries.append( summary )
+
+        return summaries
+
+    # Parallel path, one sheet per process at a time
+    print("# Rescaling " + str(len(sheets)) + " sheets with " + str(jobs) + " processes...")
+
+    with ProcessPoolExecutor( max_workers=jobs ) as executor:
+
+        futures = {}
+        for (sub_file, xml_path, scaled_sheet_names) in sheets:
+            future = executor.submit( rescale_sheet, sub_file, xml_path, scaled_sheet_names, scales, max_w, max_h, engine, dedup, compact_xml, resample, png_options, optimize )
+            futures[future] = sub_file
+
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+                metrics.merge( summary.pop('metrics') )
+            except Exception as e:
+                summary = failed_summary( futures[future], e )
+
+            summaries.append( summary )
+
+    return sorted( summaries, key=lambda summary: summary['sheet'] )
+
+
+# Print the per-sheet results of a rescale
+def print_summary( summaries ):
+
+    print("# Rescale summary:")
+
+    total_cells = 0
+    total_failed = 0
+    for summary in summaries:
+        total_cells += summary['cells']
+        total_failed += summary['failed']
+
+        line = "# \t" + summary['sheet'] + ": " + str(summary['cells']) + " sprites, " + str(summary['pages']) + " sheets written, " + str(summary['failed']) + " failed, " + "{:.3f}s".format(summary['time'])
+        if summary['failed'] > 0:
+            line = "!" + line
+        print(line)
+
+    print("# \t" + str(len(summaries)) + " sheets, " + str(total_cells) + " sprites, " + str(total_failed) + " failed")
@@ -0,0 +1,64 @@
+
+'''
+    @file defaults.py
+    @date 18/OCT/2026
+    @brief Defaults and choices for the command line's options, kept apart from the modules that use them (and free of any imaging imports)
+           so the command line can parse its arguments, and print --help or --version, without loading Pillow or PyTexturePacker.
+'''
+
+# Packing engines that can be picked for a build
+#   pytexturepacker - PyTexturePacker's MaxRects packer
+#   native          - native_packer's skyline packer, much faster for big sheets
+engines = ['pytexturepacker', 'native']
+
+# Rows decoded at a time when exploding in low memory mode
+default_band_height = 256
+
+# Archive formats explode can write sprites into (and build can read them from), rather than loose files
+archive_formats = ['zip', 'tar']
+
+# PNG compression level used with --fast, much quicker to write than Pillow's default (6) for slightly bigger files
+fast_png_compress_level = 1
+
+# Resampling filters that can be used when rescaling sprites (see convert.map_resample_filters)
+resample_filters = ['nearest', 'bilinear', 'bicubic', 'lanczos']
+default_resample = 'lanczos'
+
+# Seconds build --optimize-layout spends searching for the smallest layout
+default_layout_time_budget = 10.0
+
+# Seconds to wait after a change for things to go quiet before rebuilding, so saving a batch of sprites only rebuilds once
+default_debounce = 0.2
+# Seconds between scans of the sprites when they have to be polled for changes
+default_poll_interval = 0.5
+
+# Benchmark suites, each varies one thing at a time from a base case:
+#   counts       - numbers of sprites to run with
+#   base         - the base case, the rest of its settings are used when varying the count
+#   paddings     - transparent pixels around each sprite
+#   depths       - number of folders each sprite sits under, the deepest being its animation
+bench_suites = {
+    'quick': { 'counts': [100, 1000],
+               'base': {'sprites': 100, 'sizes': 'mixed', 'alpha_padding': 4, 'anim_depth': 1},
+               'paddings': [0, 16],
+               'depths': [0, 2] },
+    'full':  { 'counts': [100, 1000, 10000, 50000],
+               'base': {'sprites': 1000, 'sizes': 'mixed', 'alpha_padding': 4, 'anim_depth': 1},
+               'paddings': [0, 16],
+               'depths': [0, 2] },
+}
+
+
+# Keyword arguments to save PNGs with, as chosen on the command line, empty for Pillow's defaults
+def get_png_options( compress_level=None, optimize=False, fast=False ):
+
+    if compress_level == None and fast:
+        compress_level = fast_png_compress_level
+
+    png_options = {}
+    if compress_level != None:
+        png_options['compress_level'] = compress_level
+    if optimize:
+        png_options['optimize'] = True
+
+    return png_options
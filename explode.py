@@ -7,72 +7,173 @@
 '''
 
 from PIL import Image, ImageOps
-from xml.etree.ElementTree import parse, Element, SubElement, Comment, tostring
-from xml.etree import ElementTree
+from xml.etree.ElementTree import iterparse
 from os import walk
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import os
-import argparse
+import io
+import json
+import hashlib
+import zipfile
+import tarfile
+import tempfile
+import threading
+from contextlib import contextmanager
+from defaults import default_band_height
+import png_bands
+import layout_sidecar
+import metrics
 import time
 
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    # Windows has no fcntl, the manifest is locked with msvcrt there instead
+    import msvcrt
+
 # Extensions to be silently ignored
 ignored_exts = [".xml"]
 # Extensions we support, if extension is not ignored and not in this list, then error.
 valid_img_exts = [".png", ".jpg", ".jpeg"]
+# Sheets with more cells than this are split into batches when exploding with a process pool
+cells_per_batch = 512
+# Sheet the current worker process last decoded, kept between batches of cells from the same sheet so each worker only decodes it once
+# None outside of the process pool (see init_explode_worker), where each call decodes the sheet it's given and lets go of it after
+worker_sheet = None
+# Manifest kept in the output root, records what each sheet produced so unchanged sheets can be skipped next time
+manifest_name = "explode_manifest.json"
+
 
+# Parse a cell's attributes (a dict of strings, as found on the xml 'Cell' element) and save out the sprite
+# img may be just a band of the sheet, starting at row 'top' of the sheet
+# Returns True if the sprite was saved
+# With archive (from open_sprite_archive) the sprite is written into the archive instead, dir_name being the folder within it
+def parse_cell( cell, img, img_info, dir_name, sheet_ext, top=0, archive=None ):
 
-def parse_cell( cell, img, img_info, dir_name, sheet_ext ):
+    sprite_area = None
 
     try:
-        sprite_x = int(cell.attrib['x'])
-        sprite_y = int(cell.attrib['y'])
-        sprite_w = int(cell.attrib['w'])
-        sprite_h = int(cell.attrib['h'])
-
-        sprite_ax = int(cell.attrib['ax'])
-        sprite_ay = int(cell.attrib['ay'])
-        sprite_aw = int(cell.attrib['aw'])
-        sprite_ah = int(cell.attrib['ah'])
-
-        # Create new image from spritesheet cropped around the target sprite
-        sprite_area = ( sprite_x, sprite_y, sprite_x + sprite_w, sprite_y + sprite_h )
-
-        # print("sprite area: " + str(sprite_area[0]) + ", " + str(sprite_area[1]) + ", " + str(sprite_area[2]) + ", " + str(sprite_area[3]) )
-
-        # Wait what?  Impossible?
-        if sprite_area[0] < 0:
-            print("\t!# Too big, impossible?")            
-        if sprite_area[1] < 0:
-            print("\t!# Too big, impossible?")
-
-        # Bad news
-        if sprite_area[2] >= img.width:
-            print("\t!# Too big! >= img.width")
-            
-        if sprite_area[3] >= img.height:
-            print("\t!# Too big! >= img.height")
+        (sprite_img, sprite_area) = cut_cell( cell, img, top )
 
-        sprite_img = img.crop( sprite_area )
+        if archive != None:
+            # Encode in memory and stream it straight into the archive
+            with metrics.stage( 'encode_sprites' ):
+                buffer = io.BytesIO()
+                sprite_img.save( buffer, Image.registered_extensions()[sheet_ext.lower()], **img_info )
 
-        # Expand border around to rebuild original alpha padding
-        alpha_border = (sprite_ax, sprite_ay, sprite_aw - sprite_ax - sprite_w, sprite_ah - sprite_ay - sprite_h)
-        sprite_img = ImageOps.expand( sprite_img, alpha_border, 0)
+            write_archive_member( archive, (dir_name + "/" if dir_name != "" else "") + cell['name'] + sheet_ext, buffer.getvalue() )
+
+            metrics.count( 'encode_calls' )
+            metrics.count( 'bytes_written', buffer.tell() )
+            return True
 
         # Save out sprite
-        output_sprite = os.path.join(dir_name, (cell.attrib['name'] + sheet_ext))
+        output_sprite = os.path.join(dir_name, (cell['name'] + sheet_ext))
         # print("Saving to: " + output_sprite)
-        sprite_img.save( output_sprite, **img_info )
+        with metrics.stage( 'encode_sprites' ):
+            sprite_img.save( output_sprite, **img_info )
+
+        metrics.count( 'encode_calls' )
+        metrics.count( 'bytes_written', os.path.getsize(output_sprite) )
 
     except:
-        print("\t!# Failed to save sprite '" + "', area: " + str(sprite_area))
+        print("\t!# Failed to save sprite '" + cell.get('name', '') + "', area: " + str(sprite_area))
+        return False
 
+    return True
+
+
+# Path of the archive a sheet's sprites are written to instead of the folder dir_name, e.g. 'exploded/my_sheet.zip'
+def get_archive_path( dir_name, archive_format ):
+    return dir_name + "." + archive_format
+
+
+# Open a new archive to write sprites into, returns a dict of the 'format', the open 'file' and a 'lock' to write to it with
+# It's written under a temporary name, and only replaces archive_path when closed with close_sprite_archive
+def open_sprite_archive( archive_path, archive_format ):
+
+    archive_dir = os.path.dirname( archive_path )
+    if archive_dir != "" and not os.path.exists( archive_dir ):
+        os.makedirs( archive_dir, exist_ok=True )
+
+    # Sprites are already compressed, so they're stored as they are
+    if archive_format == 'zip':
+        archive_file = zipfile.ZipFile( archive_path + ".tmp", "w", zipfile.ZIP_STORED )
+    else:
+        archive_file = tarfile.open( archive_path + ".tmp", "w" )
+
+    return {'format': archive_format, 'path': archive_path, 'file': archive_file, 'lock': threading.Lock()}
+
+
+# Add a file to an archive, member_name being its path within the archive, safe to call from several threads at once
+def write_archive_member( archive, member_name, data ):
+
+    with archive['lock']:
+        if archive['format'] == 'zip':
+            archive['file'].writestr( member_name, data )
+        else:
+            member_info = tarfile.TarInfo( member_name )
+            member_info.size = len(data)
+            member_info.mtime = int(time.time())
+            archive['file'].addfile( member_info, io.BytesIO(data) )
+
+
+def close_sprite_archive( archive ):
+    archive['file'].close()
+    os.replace( archive['path'] + ".tmp", archive['path'] )
 
-def explode_spritesheet( sheet_path, output_root ):
-    # print("explode_spritesheet: " + sheet_path + ", output_root: " + output_root)
+
+# Cut a cell's sprite out of the sheet, padded back out to its original size
+# img may be just a band of the sheet, starting at row 'top' of the sheet
+# Returns (sprite image, area of the sheet it came from), raises if the cell can't be read
+def cut_cell( cell, img, top=0 ):
+
+    sprite_x = int(cell['x'])
+    sprite_y = int(cell['y'])
+    sprite_w = int(cell['w'])
+    sprite_h = int(cell['h'])
+
+    sprite_ax = int(cell['ax'])
+    sprite_ay = int(cell['ay'])
+    sprite_aw = int(cell['aw'])
+    sprite_ah = int(cell['ah'])
+
+    # Create new image from spritesheet cropped around the target sprite
+    sprite_area = ( sprite_x, sprite_y, sprite_x + sprite_w, sprite_y + sprite_h )
+
+    # print("sprite area: " + str(sprite_area[0]) + ", " + str(sprite_area[1]) + ", " + str(sprite_area[2]) + ", " + str(sprite_area[3]) )
+
+    # Wait what?  Impossible?
+    if sprite_area[0] < 0:
+        print("\t!# Too big, impossible?")            
+    if sprite_area[1] < 0:
+        print("\t!# Too big, impossible?")
+
+    # Bad news
+    if sprite_area[2] >= img.width:
+        print("\t!# Too big! >= img.width")
+        
+    if sprite_area[3] >= top + img.height:
+        print("\t!# Too big! >= img.height")
+
+    sprite_img = img.crop( (sprite_area[0], sprite_area[1] - top, sprite_area[2], sprite_area[3] - top) )
+
+    # Expand border around to rebuild original alpha padding
+    alpha_border = (sprite_ax, sprite_ay, sprite_aw - sprite_ax - sprite_w, sprite_ah - sprite_ay - sprite_h)
+    sprite_img = ImageOps.expand( sprite_img, alpha_border, 0)
+
+    return (sprite_img, sprite_area)
+
+
+# Find every file under the given path, paired with the output folder it should be exploded into
+def find_spritesheets( sheet_path, output_root ):
 
     # Check the path is valid
     if os.path.exists(sheet_path) == False:
         print ("!# Invalid path?: " + sheet_path)
-        return
+        return []
 
     # If the path is a folder...
     if os.path.isdir(sheet_path) == True:
@@ -90,17 +191,160 @@ def explode_spritesheet( sheet_path, output_root ):
             for filename in filenames:
                 sub_files[os.path.join(dirpath, filename)] = relative_path
 
-        # Attempt to explode each file
+        # Gather every file, sub folders are walked above so this only ever finds files
+        sheets = []
         for (sub_file, relative_path) in sub_files.items():
             output_path = os.path.normpath(os.path.join(output_root, relative_path))
-            explode_spritesheet(sub_file, output_path)
+            sheets.extend( find_spritesheets(sub_file, output_path) )
+
+        return sheets
+
+    return [(sheet_path, output_root)]
+
+
+# Stream the cells from a sheet's xml, yields (animation name, cell attributes) in document order
+# Cells which aren't part of an animation have an animation name of None
+# The xml is read incrementally and elements are thrown away once they've been yielded,
+# so huge sheets never have the whole document in memory and sprites can be saved while the rest is still being read
+def read_cells( xml_path ):
+
+    elem_frame_info = None
+    frame_info_done = False
+    anim = None
+    anim_name = None
+
+    # Elements currently open, the parser can run ahead of the events so this is how we know an element's parent
+    open_elems = []
+
+    for (event, elem) in iterparse( xml_path, events=('start', 'end') ):
+
+        if event == 'end':
+            open_elems.pop()
+
+        parent = None
+        if len(open_elems) > 0:
+            parent = open_elems[-1]
+
+        if event == 'start':
+            open_elems.append( elem )
+
+        # Only the first 'FrameInformation' is used
+        if frame_info_done:
+            continue
+
+        if event == 'start':
+            if elem.tag == 'FrameInformation' and elem_frame_info == None:
+                elem_frame_info = elem
+            elif elem.tag == 'Animation' and parent is elem_frame_info and elem_frame_info != None:
+                anim = elem
+                anim_name = elem.attrib['name']
+                # print("Anim: " + anim_name)
+            continue
+
+        # Cells nested any deeper than an animation aren't part of the sheet
+        # Once a cell's been read its parent is cleared out, so the document never builds up in memory
+        if elem.tag == 'Cell' and parent != None:
+            if parent is elem_frame_info:
+                yield (None, dict(elem.attrib))
+                elem_frame_info.clear()
+            elif parent is anim:
+                yield (anim_name, dict(elem.attrib))
+                anim.clear()
+
+        elif elem is anim:
+            anim = None
+            anim_name = None
+            elem_frame_info.clear()
+
+        elif elem is elem_frame_info:
+            elem_frame_info.clear()
+            frame_info_done = True
+
+    if elem_frame_info == None:
+        raise ValueError("No 'FrameInformation' in " + str(xml_path))
+
+
+# Walk every cell of a sheet in memory, without writing anything out
+# sheet is the path to a sheet or an already opened Pillow image, xml is the path to its xml (or an open file of it), found next to the sheet if not given
+# yields a dict for each cell
+#   'name'/'anim' - the cell's name and the animation it's in (None if it isn't in one)
+#   'rect'        - (x, y, w, h) of the sprite within the sheet
+#   'alpha'       - (ax, ay, aw, ah), where the sprite sits within its original image
+#   'image'       - the sprite padded back out to its original size, or None if it couldn't be read
+# Call numpy.asarray() on the images for arrays of the pixels
+def iter_cells( sheet, xml=None ):
+
+    sheet_path = sheet if isinstance(sheet, str) else getattr(sheet, 'filename', "")
+
+    if xml == None:
+        xml = find_sheet_xml( sheet_path, False ) if sheet_path != "" else None
+        if xml == None:
+            raise ValueError( "no xml found for sheet: " + str(sheet_path) )
+
+    img = sheet
+    if isinstance(sheet, str):
+        with metrics.stage( 'decode_sheet' ):
+            img = Image.open( sheet )
+            img.load()
+        metrics.count( 'decode_calls' )
+
+    cell_count = 0
+    try:
+        for (anim_name, cell) in (read_sheet_cells( xml ) if isinstance(xml, str) else read_cells( xml )):
 
-        return
+            cell_count += 1
+
+            try:
+                (sprite_img, sprite_area) = cut_cell( cell, img )
+            except Exception:
+                print("\t!# Failed to read sprite '" + cell.get('name', '') + "' from " + str(sheet_path))
+                sprite_img = None
+
+            yield { 'name': cell.get('name', ''),
+                    'anim': anim_name,
+                    'rect': get_cell_values( cell, ['x', 'y', 'w', 'h'] ),
+                    'alpha': get_cell_values( cell, ['ax', 'ay', 'aw', 'ah'] ),
+                    'image': sprite_img }
+
+    finally:
+        if img is not sheet:
+            img.close()
+
+        metrics.count( 'cells', cell_count )
+
+
+# A cell's attributes as a tuple of ints, or None if any are missing or aren't numbers
+def get_cell_values( cell, keys ):
+    try:
+        return tuple( int(cell[key]) for key in keys )
+    except (KeyError, ValueError):
+        return None
+
+
+# Read a sheet's cells, from the binary layout sidecar next to its xml if there's one written with the xml as it is now, otherwise from the xml
+# yields the same as read_cells, xml_hash being the xml's hash if it's already known
+def read_sheet_cells( xml_path, xml_hash=None ):
+
+    sidecar_path = layout_sidecar.get_sidecar_path( xml_path )
+    if os.path.isfile( sidecar_path ):
+        if xml_hash == None:
+            xml_hash = hash_file( xml_path )
+
+        cells = layout_sidecar.read_sidecar_cells( sidecar_path, xml_hash )
+        if cells != None:
+            metrics.count( 'sidecar_reads' )
+            return cells
+
+    return read_cells( xml_path )
+
+
+# Check a file looks like a sprite sheet we can explode, returns the path to its xml or None
+def find_sheet_xml( sheet_path, verbose=True ):
 
     # We got this far and the thing still isn't a file?
     if os.path.isfile(sheet_path) == False:
         print ("!# Path is not a file: " + sheet_path)
-        return
+        return None
 
     # Get directory/file tuple
     split_path = os.path.split(sheet_path)
@@ -114,14 +358,15 @@ def explode_spritesheet( sheet_path, output_root ):
 
     # If file extension is an ignored type, silently bail out
     if sheet_ext in ignored_exts:
-        return
+        return None
         
-    print ("# Attempting to explode: " + sheet_path)
+    if verbose:
+        print ("# Attempting to explode: " + sheet_path)
 
     # Make sure file extension is valid image type
     if (sheet_ext in valid_img_exts) == False:
-        print("!# \tInvalid image extension: " + sheet_ext)
-        return
+        print("!# \tInvalid image extension: " + sheet_ext + " (" + sheet_path + ")")
+        return None
 
     # Build path to accompanying xml
     xml_path = os.path.join(sheet_dir, sheet_name + '.xml')
@@ -129,42 +374,527 @@ def explode_spritesheet( sheet_path, output_root ):
     # Make sure the xml exists
     if os.path.exists(xml_path) == False:
         print ("!# \tCould not find texture xml: " + xml_path)
-        return
+        return None
+
+    return xml_path
+
+
+# Run once in each process of the explode pool, so explode_cells keeps the sheet it decodes for the next batch
+def init_explode_worker():
+    global worker_sheet
+    worker_sheet = {}
+
+
+# The decoded sheet at sheet_path, decoded only if it isn't the one this worker process already holds (which it lets go of)
+def get_worker_sheet( sheet_path ):
+
+    stat = os.stat( sheet_path )
+    key = (os.path.abspath(sheet_path), stat.st_mtime_ns, stat.st_size)
+
+    if worker_sheet.get( 'key' ) != key:
+        if 'image' in worker_sheet:
+            worker_sheet.pop( 'image' ).close()
+
+        img = Image.open( sheet_path )
+        with metrics.stage( 'decode_sheet' ):
+            img.load()
+        metrics.count( 'decode_calls' )
+
+        worker_sheet['key'] = key
+        worker_sheet['image'] = img
+
+    return worker_sheet['image']
+
+
+# Explode the given cells (any iterable, it's only walked once) of a sheet into dir_name, returns a summary dict
+# This is the unit of work handed to the process pool, so it only takes/returns picklable values
+# With threads > 1 the sprites are cropped and encoded on a pool of threads sharing the one decoded sheet,
+# Pillow releases the GIL while encoding so this uses every core without copying the sheet around
+# In a worker process of the explode pool the decoded sheet is kept for the next batch of its cells (unless low_memory)
+# With low_memory the sheet is decoded in bands of band_height rows instead of all at once (PNGs only)
+# png_options (from defaults.get_png_options) are used when saving PNG sprites
+# With archive ('zip' or 'tar') the sprites are all written into one archive next to dir_name (see get_archive_path) rather than loose files
+def explode_cells( sheet_path, cells, dir_name, threads=1, low_memory=False, band_height=default_band_height, png_options={}, archive=None ):
+
+    start = time.time()
+    metrics_before = metrics.snapshot()
+
+    sheet_ext = os.path.splitext( sheet_path )[1]
 
     # Read image and get info
-    img = Image.open( sheet_path )
+    keep_sheet = worker_sheet != None and not low_memory
+    if keep_sheet:
+        img = get_worker_sheet( sheet_path )
+    else:
+        img = Image.open( sheet_path )
     img_info = img.info
-    
+
+    # Sprites are saved the same way as the sheet, with the encoder settings we've been asked for
+    if sheet_ext.lower() == ".png":
+        img_info = dict(img_info)
+        img_info.update( png_options )
+
+    sprite_archive = None
+    if archive != None:
+        sprite_archive = open_sprite_archive( get_archive_path(dir_name, archive), archive )
+
     # make sure output folder path exists
-    dir_name = os.path.join(output_root, sheet_name)
-    if not os.path.exists( dir_name ):
-        os.makedirs( dir_name )
+    elif not os.path.exists( dir_name ):
+        os.makedirs( dir_name, exist_ok=True )
+
+    cell_count = 0
+    failed = 0
+    created_dirs = set()
 
-    # Open xml file
-    texture_xml = parse( xml_path )
+    # Work out where the sheet comes from, either all at once or a band at a time
+    bands = None
+    sheet_h = 0
+    if low_memory:
+        band_mode = png_bands.get_band_mode( sheet_path )
+        if band_mode != None:
+            sheet_h = band_mode[1][1]
 
-    elem_frame_info = texture_xml.getroot().find('FrameInformation')
-    
-    # For each animation element
-    for anim in elem_frame_info.findall('Animation'):
-        anim_name = anim.attrib['name']
-        # print("Anim: " + anim_name)
+            img.close()
+            img = None
+            bands = png_bands.read_bands( sheet_path, band_height )
+
+            # Work down the sheet, so each band can be dropped once the cells above it are done
+            cells = sorted( cells, key=lambda anim_cell: get_cell_top(anim_cell[1]) )
+        else:
+            print("!# \tCan't decode in bands, decoding the whole sheet: " + sheet_path)
+
+    # Rows of the sheet currently decoded, when decoding in bands
+    window = None
+    window_top = 0
+    window_bottom = 0
+
+    # Decode up front, otherwise the first crop on each thread would race to load the sheet
+    if bands == None and not keep_sheet:
+        with metrics.stage( 'decode_sheet' ):
+            img.load()
+        metrics.count( 'decode_calls' )
+
+    executor = None
+    if threads > 1:
+
+        executor = ThreadPoolExecutor( max_workers=threads )
+
+        # Bound the number of sprites queued up so we never hold more than a few encoded sprites in memory at once
+        queue_slots = threading.BoundedSemaphore( threads * 2 )
+        futures = []
+
+    for (anim_name, cell) in cells:
+
+        cell_count += 1
+        cell_dir_name = dir_name
+
+        # Archives only need the animation's folder in the name of each sprite
+        if sprite_archive != None:
+            cell_dir_name = anim_name if anim_name != None else ""
 
         # Create a folder for the animation frame cells
-        anim_dir_name = os.path.join(dir_name, anim_name)
-        if not os.path.exists( anim_dir_name ):
-            os.makedirs( anim_dir_name )
+        elif anim_name != None:
+            cell_dir_name = os.path.join(dir_name, anim_name)
+            if not cell_dir_name in created_dirs:
+                os.makedirs( cell_dir_name, exist_ok=True )
+                created_dirs.add( cell_dir_name )
+
+        cell_img = img
+        cell_top = 0
+
+        if bands != None:
+            # Decode down past the bottom of the cell (and a row more, so it's clear whether it runs off the sheet)
+            # dropping every row above it, cells are sorted so nothing left needs them
+            keep_top = min( max(get_cell_top(cell), window_top), window_bottom )
+            cell_bottom = min( get_cell_top(cell) + get_cell_height(cell) + 1, sheet_h )
+
+            while window_bottom < cell_bottom:
+                with metrics.stage( 'decode_bands' ):
+                    band = next( bands )
+                metrics.count( 'decode_calls' )
+
+                new_window = Image.new( band.mode, (band.width, window_bottom - keep_top + band.height) )
+                if window != None and window_bottom > keep_top:
+                    new_window.paste( window.crop((0, keep_top - window_top, window.width, window_bottom - window_top)), (0, 0) )
+                new_window.paste( band, (0, window_bottom - keep_top) )
+
+                window = new_window
+                window_top = keep_top
+                window_bottom += band.height
+
+            cell_img = window
+            cell_top = window_top
+
+        if executor == None:
+            if parse_cell( cell, cell_img, img_info, cell_dir_name, sheet_ext, cell_top, sprite_archive ) == False:
+                failed += 1
+            continue
+
+        # Wait for a free slot, the slot is given back once the sprite has been saved
+        queue_slots.acquire()
+        future = executor.submit( parse_cell, cell, cell_img, img_info, cell_dir_name, sheet_ext, cell_top, sprite_archive )
+        future.add_done_callback( lambda f: queue_slots.release() )
+        futures.append( future )
+
+    if executor != None:
+        executor.shutdown( wait=True )
+        for future in futures:
+            if future.result() == False:
+                failed += 1
+
+    if img != None and not keep_sheet:
+        img.close()
+
+    if sprite_archive != None:
+        close_sprite_archive( sprite_archive )
+
+    metrics.count( 'cells', cell_count )
+    metrics.count( 'failed_cells', failed )
+
+    # What this call recorded goes back with the summary, when run in a worker process it's merged into the parent's metrics
+    return {'sheet': sheet_path, 'cells': cell_count, 'failed': failed, 'time': time.time() - start, 'metrics': metrics.since(metrics_before)}
+
+
+# Top row of a cell, 0 if it can't be read (parse_cell will report the cell as broken)
+def get_cell_top( cell ):
+    try:
+        return max( int(cell['y']), 0 )
+    except (KeyError, ValueError):
+        return 0
+
+def get_cell_height( cell ):
+    try:
+        return max( int(cell['h']), 0 )
+    except (KeyError, ValueError):
+        return 0
+
+
+# Load the manifest from the output root, returns an empty manifest if there isn't one yet
+def load_manifest( output_root ):
+
+    manifest_path = os.path.join(output_root, manifest_name)
+    if os.path.exists(manifest_path) == False:
+        return {}
+
+    try:
+        with open(manifest_path, "r") as f_manifest:
+            return json.load( f_manifest )
+    except (OSError, ValueError):
+        print("!# Could not read explode manifest, exploding everything: " + manifest_path)
+        return {}
+
+
+# Write the changes an explode made to the manifest in the output root, changes being a dict of manifest key to its new entry (None to remove it)
+# The manifest is read again and the changes merged into it under a lock, so explodes running side by side into the same output root
+# (e.g. batch jobs) keep each other's sheets
+def save_manifest( output_root, changes ):
+
+    if not os.path.exists( output_root ):
+        os.makedirs( output_root, exist_ok=True )
+
+    manifest_path = os.path.join(output_root, manifest_name)
+
+    with lock_manifest( output_root ):
+        manifest = load_manifest( output_root )
+
+        for (manifest_key, entry) in changes.items():
+            if entry == None:
+                manifest.pop( manifest_key, None )
+            else:
+                manifest[manifest_key] = entry
+
+        # Write to a temp file first so an interrupted run can't leave a half written manifest behind
+        with tempfile.NamedTemporaryFile( "w", dir=output_root, prefix=manifest_name + ".", suffix=".tmp", delete=False ) as f_manifest:
+            json.dump( manifest, f_manifest, indent="\t", sort_keys=True )
+
+        try:
+            os.replace( f_manifest.name, manifest_path )
+        except OSError:
+            os.remove( f_manifest.name )
+            raise
+
+
+# The file the manifest lock for the output root is held on, kept in the temp folder (named after the output root's full path) rather than in
+# the output root, so nothing is left behind among the exploded sprites. It stays there after the lock is let go of, removing it could let
+# a process waiting on the old file and one opening a new one both think they hold the lock
+def get_manifest_lock_path( output_root ):
+
+    root_hash = hashlib.sha1( os.path.normcase(os.path.realpath(output_root)).encode("utf-8", "surrogateescape") ).hexdigest()
+    return os.path.join(tempfile.gettempdir(), manifest_name + "." + root_hash[:16] + ".lock")
+
+
+# Hold the manifest lock for the output root for the length of a with block, waiting for any other process holding it
+# The OS lets go of the lock if the process holding it dies
+@contextmanager
+def lock_manifest( output_root ):
+
+    with open(get_manifest_lock_path( output_root ), "a+") as f_lock:
+        if msvcrt != None:
+            # Windows only locks a byte range, and gives up after ~10s so keep trying
+            while True:
+                try:
+                    f_lock.seek( 0 )
+                    msvcrt.locking( f_lock.fileno(), msvcrt.LK_LOCK, 1 )
+                    break
+                except OSError:
+                    pass
+        else:
+            fcntl.flock( f_lock.fileno(), fcntl.LOCK_EX )
+
+        try:
+            yield
+        finally:
+            if msvcrt != None:
+                f_lock.seek( 0 )
+                msvcrt.locking( f_lock.fileno(), msvcrt.LK_UNLCK, 1 )
+            else:
+                fcntl.flock( f_lock.fileno(), fcntl.LOCK_UN )
+
+
+def hash_file( path ):
+
+    file_hash = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            file_hash.update( chunk )
+
+    return file_hash.hexdigest()
 
-        # Parse each sprite cell in animation
-        for cell in anim.findall('Cell'):
-            # print("\tAnim frame: " + cell.attrib['name'])
 
-            parse_cell( cell, img, img_info, anim_dir_name, sheet_ext )
+# Hash, modified time and size of a file, as stored in the manifest
+def file_stamp( path ):
 
-    # Parse each sprite cell in xml
-    for cell in elem_frame_info.findall('Cell'):
-        # print(cell.attrib['name'])
+    stat = os.stat( path )
+    return {'hash': hash_file(path), 'mtime': stat.st_mtime, 'size': stat.st_size}
 
-        parse_cell( cell, img, img_info, dir_name, sheet_ext )
 
-    print ("# \tFinished exploding sprites: " + dir_name + "\n")
+def is_stamp_current( path, stamp ):
+
+    stat = os.stat( path )
+    return stat.st_mtime == stamp['mtime'] and stat.st_size == stamp['size']
+
+
+# Path of the sprite a cell is saved to, relative to the sheet's output folder
+def cell_sprite_path( anim_name, cell, sheet_ext ):
+
+    if anim_name == None:
+        return cell.get('name', '') + sheet_ext
+
+    return anim_name + "/" + cell.get('name', '') + sheet_ext
+
+
+# Work out which cells of a sheet need exploding, using the sheet's entry from the last explode (None if there isn't one)
+# Returns (cells to explode, new manifest entry), the cells are None if nothing changed
+# Otherwise the cells are streamed from the xml, the new entry's cells are only complete once they've all been read
+# Archives (see explode_cells) are always written whole, so if anything changed every cell is exploded again
+def plan_sheet( sheet_path, xml_path, dir_name, entry, archive=None ):
+
+    if archive != None:
+        have_output = os.path.isfile( get_archive_path(dir_name, archive) )
+    else:
+        have_output = os.path.isdir( dir_name )
+
+    # Cheap check first, if neither file has been touched then there's nothing to do
+    if entry != None and have_output:
+        if is_stamp_current(sheet_path, entry['png']) and is_stamp_current(xml_path, entry['xml']):
+            return (None, entry)
+
+    png_stamp = file_stamp( sheet_path )
+    xml_stamp = file_stamp( xml_path )
+
+    png_changed = entry == None or have_output == False or png_stamp['hash'] != entry['png']['hash']
+    xml_changed = entry == None or xml_stamp['hash'] != entry['xml']['hash']
+
+    # Files were touched but the contents are the same, just remember the new times
+    if png_changed == False and xml_changed == False:
+        return (None, {'png': png_stamp, 'xml': xml_stamp, 'cells': entry['cells']})
+
+    map_cells = {}
+    new_entry = {'png': png_stamp, 'xml': xml_stamp, 'cells': map_cells}
+
+    return (plan_cells(sheet_path, xml_path, dir_name, entry, png_changed or archive != None, map_cells, xml_stamp['hash']), new_entry)
+
+
+# Stream the cells of a sheet that need exploding, recording every cell in the sheet into map_cells on the way past
+# The cells come from the sheet's layout sidecar when it has one to match the xml (xml_hash)
+def plan_cells( sheet_path, xml_path, dir_name, entry, png_changed, map_cells, xml_hash=None ):
+
+    sheet_ext = os.path.splitext( sheet_path )[1]
+
+    for (anim_name, cell) in read_sheet_cells( xml_path, xml_hash ):
+        sprite_path = cell_sprite_path( anim_name, cell, sheet_ext )
+
+        # Kept as the xml's strings, whichever they were read from, so the manifest compares the same either way
+        rect = [None if cell.get(key) == None else str(cell[key]) for key in ('x', 'y', 'w', 'h', 'ax', 'ay', 'aw', 'ah')]
+        map_cells[sprite_path] = rect
+
+        # If the pixels changed then every sprite has to be saved again,
+        # otherwise only the cells that moved (or whose sprite has gone missing)
+        if entry == None or png_changed:
+            yield (anim_name, cell)
+        elif entry['cells'].get(sprite_path) != rect or os.path.exists(os.path.join(dir_name, sprite_path)) == False:
+            yield (anim_name, cell)
+
+    if entry == None:
+        return
+
+    # Remove sprites for cells that no longer exist
+    for sprite_path in entry['cells']:
+        if not sprite_path in map_cells:
+            stale_sprite = os.path.join(dir_name, sprite_path)
+            if os.path.exists( stale_sprite ):
+                os.remove( stale_sprite )
+
+
+# Print the per-sheet results of an explode
+def print_summary( summaries ):
+
+    print("# Explode summary:")
+
+    total_cells = 0
+    total_failed = 0
+    total_skipped = 0
+    for summary in summaries:
+        total_cells += summary['cells']
+        total_failed += summary['failed']
+
+        if summary.get('skipped', False):
+            total_skipped += 1
+            print("# \t" + summary['sheet'] + ": unchanged, skipped")
+            continue
+
+        line = "# \t" + summary['sheet'] + ": " + str(summary['cells']) + " sprites, " + str(summary['failed']) + " failed, " + "{:.3f}s".format(summary['time'])
+        if summary['failed'] > 0:
+            line = "!" + line
+        print(line)
+
+    print("# \t" + str(len(summaries)) + " sheets (" + str(total_skipped) + " unchanged), " + str(total_cells) + " sprites, " + str(total_failed) + " failed")
+
+
+# Explode every sprite sheet found at sheet_path into output_root, returns a list of per-sheet summaries
+# Sheets which haven't changed since the last explode into output_root are skipped, unless force is set
+# With archive ('zip' or 'tar') each sheet's sprites are written into a single archive, e.g. output_root/my_sheet.zip
+def explode_spritesheet( sheet_path, output_root, jobs=1, threads=1, force=False, low_memory=False, band_height=default_band_height, png_options={}, archive=None ):
+    # print("explode_spritesheet: " + sheet_path + ", output_root: " + output_root)
+
+    if low_memory and band_height < 1:
+        raise ValueError( "band height must be at least 1 row, not " + str(band_height) )
+
+    manifest = load_manifest( output_root )
+
+    # What this explode changed in the manifest, merged into whatever's there once it's done
+    changes = {}
+
+    # Work out what needs exploding in each sheet
+    sheets = []
+    summaries = []
+    for (sub_file, sub_output_root) in find_spritesheets( sheet_path, output_root ):
+
+        xml_path = find_sheet_xml( sub_file, jobs <= 1 )
+        if xml_path == None:
+            continue
+
+        sheet_name = os.path.splitext( os.path.basename(sub_file) )[0]
+        dir_name = os.path.join(sub_output_root, sheet_name)
+
+        # Sheets are keyed by their output folder, relative to the output root
+        manifest_key = os.path.relpath(dir_name, output_root).replace(os.sep, "/")
+
+        entry = None
+        if force == False:
+            entry = manifest.get( manifest_key )
+
+        with metrics.stage( 'plan_sheet' ):
+            (cells, new_entry) = plan_sheet( sub_file, xml_path, dir_name, entry, archive )
+
+        if cells == None:
+            if jobs <= 1:
+                print ("# \tUnchanged since last explode, skipping: " + dir_name + "\n")
+            changes[manifest_key] = new_entry
+            summaries.append( {'sheet': sub_file, 'cells': 0, 'failed': 0, 'time': 0.0, 'skipped': True} )
+            continue
+
+        sheets.append( (sub_file, dir_name, cells, manifest_key, new_entry) )
+
+    # Only remember sheets that exploded cleanly, anything that failed is retried next time
+    def record( summary, manifest_key, new_entry ):
+        if summary['failed'] == 0:
+            changes[manifest_key] = new_entry
+        else:
+            changes[manifest_key] = None
+
+    # Serial path, explode each sheet in turn
+    if jobs <= 1:
+        for (sub_file, dir_name, cells, manifest_key, new_entry) in sheets:
+
+            try:
+                with metrics.stage( 'explode_cells' ):
+                    summary = explode_cells( sub_file, cells, dir_name, threads, low_memory, band_height, png_options, archive )
+                summary.pop( 'metrics' )
+            except Exception as e:
+                print("!# \tFailed to explode: " + sub_file + " (" + str(e) + ")")
+                summary = {'sheet': sub_file, 'cells': 0, 'failed': 1, 'time': 0.0}
+
+            summaries.append( summary )
+            record( summary, manifest_key, new_entry )
+
+            print ("# \tFinished exploding sprites: " + dir_name + "\n")
+
+        save_manifest( output_root, changes )
+        return summaries
+
+    # Parallel path, hand sheets (or batches of cells from big sheets) to a pool of processes
+    print("# Exploding with " + str(jobs) + " processes...")
+
+    with metrics.stage( 'explode_cells' ), ProcessPoolExecutor( max_workers=jobs, initializer=init_explode_worker ) as executor:
+
+        futures = {}
+        map_summaries = {}
+        for (sub_file, dir_name, cells, manifest_key, new_entry) in sheets:
+
+            # Split big sheets into batches so they're spread across the pool, batches are handed out as the xml is read
+            # (each worker only decodes the sheet for the first of its batches, see get_worker_sheet)
+            # (an archive can only be written by one process, so those sheets go as a single batch)
+            batch_size = cells_per_batch
+            if archive != None:
+                batch_size = None
+
+            try:
+                batch = list( islice(cells, batch_size) )
+                while True:
+                    future = executor.submit( explode_cells, sub_file, batch, dir_name, threads, low_memory, band_height, png_options, archive )
+                    futures[future] = (sub_file, manifest_key, new_entry)
+
+                    batch = list( islice(cells, batch_size) )
+                    if len(batch) == 0:
+                        break
+            except Exception as e:
+                print("!# \tFailed to read texture xml: " + sub_file + " (" + str(e) + ")")
+                map_summaries[sub_file] = ({'sheet': sub_file, 'cells': 0, 'failed': 1, 'time': 0.0}, manifest_key, new_entry)
+
+        # Merge the batch results back into one summary per sheet
+        for future in as_completed(futures):
+            (sub_file, manifest_key, new_entry) = futures[future]
+
+            try:
+                result = future.result()
+                metrics.merge( result.pop('metrics') )
+            except Exception as e:
+                print("!# \tFailed to explode: " + sub_file + " (" + str(e) + ")")
+                result = {'sheet': sub_file, 'cells': 0, 'failed': 1, 'time': 0.0}
+
+            if sub_file in map_summaries:
+                summary = map_summaries[sub_file][0]
+                summary['cells'] += result['cells']
+                summary['failed'] += result['failed']
+                summary['time'] += result['time']
+            else:
+                map_summaries[sub_file] = (result, manifest_key, new_entry)
+
+    for (summary, manifest_key, new_entry) in map_summaries.values():
+        record( summary, manifest_key, new_entry )
+
+    summaries.extend( sorted([value[0] for value in map_summaries.values()], key=lambda summary: summary['sheet']) )
+
+    save_manifest( output_root, changes )
+    return summaries
@@ -0,0 +1,197 @@
+
+'''
+    @file layout_search.py
+    @date 18/OCT/2026
+    @brief Search for the smallest sheet a set of sprites can be packed into, trying the native packer's heuristics and sort orders
+           within a range of power of two bounds, side by side on a pool of processes and within a time budget.
+'''
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import native_packer
+import metrics
+import time
+
+
+# Every layout worth trying for sprites of the given (w, h) sizes, the quickest heuristics first then the smallest bounds,
+# so whatever's left when time runs out is what would have taken longest
+# Each candidate is a dict of 'heuristic' ('skyline' or one of native_packer.maxrects_heuristics), 'sort_order', 'bounds' (w, h)
+# and 'index', its place in the list
+def get_layout_candidates( sizes, max_w, max_h, border_padding=2, shape_padding=2, inner_padding=1 ):
+
+    footprints = [(w + 2 * inner_padding + shape_padding, h + 2 * inner_padding + shape_padding) for (w, h) in sizes]
+
+    widest = max([fw for (fw, fh) in footprints]) + 2 * border_padding
+    tallest = max([fh for (fw, fh) in footprints]) + 2 * border_padding
+    total_area = sum([fw * fh for (fw, fh) in footprints])
+
+    # Power of two sizes each side could be, from the smallest that fits the biggest sprite up to the max
+    widths = get_power_of_two_range( widest, max_w )
+    heights = get_power_of_two_range( tallest, max_h )
+
+    # For each width, the shortest height that could hold every sprite and the one after it, in case they don't pack that tightly
+    bounds = []
+    for w in widths:
+        fitting_heights = [h for h in heights if w * h >= total_area]
+        for h in fitting_heights[:2]:
+            bounds.append( (w, h) )
+
+    bounds.sort( key=lambda wh: (wh[0] * wh[1], abs(wh[0] - wh[1])) )
+
+    candidates = []
+    for heuristic in ['skyline'] + native_packer.maxrects_heuristics:
+        for (w, h) in bounds:
+            for sort_order in native_packer.sort_orders:
+                candidates.append( {'heuristic': heuristic, 'sort_order': sort_order, 'bounds': (w, h), 'index': len(candidates)} )
+
+    return candidates
+
+
+# Powers of two from the smallest at least low up to high, ending with high itself if it isn't one
+def get_power_of_two_range( low, high ):
+
+    values = []
+    value = 1
+    while value < low:
+        value *= 2
+
+    while value < high:
+        values.append( value )
+        value *= 2
+
+    if low <= high:
+        values.append( high )
+
+    return values
+
+
+# Pack sizes the way a candidate says to, the unit of work handed to the process pool so it only takes/returns picklable values
+# Returns the candidate with its result added
+#   'positions'/'sheet_wh' - where each sprite went and the size of the sheet, as native_packer.pack_rects returns them (None if they didn't fit)
+#   'timed_out'            - whether it gave up because the deadline passed
+#   'time'                 - seconds taken
+def pack_candidate( candidate, sizes, border_padding=2, shape_padding=2, inner_padding=1, deadline=None ):
+
+    start = time.time()
+
+    result = dict( candidate )
+    result['positions'] = None
+    result['sheet_wh'] = None
+    result['timed_out'] = deadline != None and start > deadline
+
+    if not result['timed_out']:
+        (bounds_w, bounds_h) = candidate['bounds']
+
+        if candidate['heuristic'] == 'skyline':
+            packed = pack_skyline_candidate( sizes, bounds_w, bounds_h, candidate['sort_order'], border_padding, shape_padding, inner_padding )
+        else:
+            packed = native_packer.pack_maxrects( sizes, bounds_w, bounds_h, candidate['heuristic'], candidate['sort_order'], border_padding, shape_padding, inner_padding, deadline )
+
+        if packed != None:
+            (result['positions'], result['sheet_wh']) = packed
+        else:
+            result['timed_out'] = deadline != None and time.time() > deadline
+
+    result['time'] = time.time() - start
+
+    return result
+
+
+# The skyline packer within fixed bounds, returns the same as native_packer.pack_maxrects
+def pack_skyline_candidate( sizes, bounds_w, bounds_h, sort_order, border_padding=2, shape_padding=2, inner_padding=1 ):
+
+    footprints = [(w + 2 * inner_padding + shape_padding, h + 2 * inner_padding + shape_padding) for (w, h) in sizes]
+
+    positions = native_packer.pack_skyline( footprints, bounds_w, bounds_h, border_padding, sort_order=sort_order )
+    if positions == None:
+        return None
+
+    used_w = max([x + fw for ((x, y), (fw, fh)) in zip(positions, footprints)])
+    used_h = max([y + fh for ((x, y), (fw, fh)) in zip(positions, footprints)])
+
+    return ([(x + inner_padding, y + inner_padding) for (x, y) in positions], (used_w + border_padding, used_h + border_padding))
+
+
+# Size a packed candidate's sheet is once cropped, the same way build.crop_spritesheet crops it
+def get_cropped_size( result, sizes, bleed=0, border_padding=2 ):
+
+    (sheet_w, sheet_h) = result['sheet_wh']
+
+    used_w = max([x + w for ((x, y), (w, h)) in zip(result['positions'], sizes)])
+    used_h = max([y + h for ((x, y), (w, h)) in zip(result['positions'], sizes)])
+
+    return (min(used_w + bleed, sheet_w) + border_padding, min(used_h + bleed, sheet_h) + border_padding)
+
+
+# Try every candidate layout for sprites of the given (w, h) sizes on one max_w x max_h sheet (from packer_options), keeping the one
+# with the smallest cropped sheet. Candidates run on a pool of jobs processes (in this process with jobs <= 1), any not finished
+# within time_budget seconds are given up on. bleed is how far alpha bleeding will spread past the sprites, so sheets are compared as they'll be cropped
+# Returns (positions, sheet size) as native_packer.pack_rects does, or None if no candidate fit the sprites on a single sheet
+def search_layouts( sizes, packer_options, time_budget, jobs=1, bleed=0 ):
+
+    padding = (packer_options['border_padding'], packer_options['shape_padding'], packer_options['inner_padding'])
+
+    candidates = get_layout_candidates( sizes, packer_options['max_width'], packer_options['max_height'], *padding )
+    if len(candidates) == 0:
+        return None
+
+    print("# \tSearching " + str(len(candidates)) + " layouts for the smallest sheet (up to " + str(time_budget) + "s)...")
+
+    deadline = time.time() + time_budget
+
+    results = []
+
+    # Serial path, each candidate in turn until time runs out
+    if jobs <= 1:
+        for candidate in candidates:
+            results.append( pack_candidate(candidate, sizes, *padding, deadline) )
+
+    # Parallel path, every candidate is handed out up front, those only started after the deadline give up straight away
+    else:
+        with ProcessPoolExecutor( max_workers=jobs ) as executor:
+            futures = [executor.submit( pack_candidate, candidate, sizes, *padding, deadline ) for candidate in candidates]
+
+            for future in as_completed(futures):
+                results.append( future.result() )
+
+        results.sort( key=lambda result: result['index'] )
+
+    sprite_area = sum([w * h for (w, h) in sizes])
+
+    best = None
+    for result in results:
+        if result['positions'] == None:
+            continue
+
+        result['cropped_wh'] = get_cropped_size( result, sizes, bleed, padding[0] )
+        result['occupancy'] = sprite_area / float(result['cropped_wh'][0] * result['cropped_wh'][1])
+
+        # Ties go to whichever was tried first
+        if best == None or result['cropped_wh'][0] * result['cropped_wh'][1] < best['cropped_wh'][0] * best['cropped_wh'][1]:
+            best = result
+
+    metrics.count( 'layout_candidates', len(results) )
+    metrics.count( 'layout_candidates_timed_out', sum([1 for result in results if result['timed_out']]) )
+
+    print_candidates( results, best )
+
+    if best == None:
+        return None
+
+    return (best['positions'], best['sheet_wh'])
+
+
+# Print how each candidate layout did, smallest sheets first
+def print_candidates( results, best ):
+
+    packed = sorted( [result for result in results if result['positions'] != None], key=lambda result: result['cropped_wh'][0] * result['cropped_wh'][1] )
+    for result in packed:
+        line = "# \t\t" + result['heuristic'] + ", sorted by " + result['sort_order'] + ", within " + "x".join(map(str, result['bounds'])) + ": "
+        line += "x".join(map(str, result['cropped_wh'])) + ", {:.1f}% occupied, {:.3f}s".format(100.0 * result['occupancy'], result['time'])
+        if result is best:
+            line += " (best)"
+        print(line)
+
+    didnt_fit = sum([1 for result in results if result['positions'] == None and not result['timed_out']])
+    timed_out = sum([1 for result in results if result['timed_out']])
+
+    print("# \t" + str(len(packed)) + " layouts packed, " + str(didnt_fit) + " didn't fit their bounds, " + str(timed_out) + " ran out of time")
@@ -0,0 +1,188 @@
+
+'''
+    @file layout_sidecar.py
+    @date 18/OCT/2026
+    @brief Binary copy of a sheet's xml layout, written next to it by build (--layout-sidecar) as '<sheet>.layout', for loaders that want
+           the cells without parsing xml. Everything is fixed width and little endian, so it can be mmap'd and read in place:
+             header     - magic 'SSRL', version (u16), flags (u16), texture w/h (u32 each), sha1 of the xml it was written with (20 bytes),
+                          texture name and type (u32 offset + u32 length into the string table, each), cell count, animation count,
+                          string table offset and size (u32 each)
+             animations - for each <Animation> in the xml, in order: name (offset + length), first cell, cell count (u32 each)
+             cells      - for each <Cell> in the xml, in order: name (offset + length, u32 each), animation index (i32, -1 if it isn't in one),
+                          then x, y, w, h, ax, ay, aw, ah (i32 each)
+             strings    - every name, utf-8 encoded
+'''
+
+import os
+import mmap
+import struct
+
+sidecar_magic = b'SSRL'
+
+# Bump this if the layout of the sidecar changes
+sidecar_version = 1
+
+header_struct = struct.Struct( '<4sHHII20sIIIIIIII' )
+anim_struct = struct.Struct( '<IIII' )
+cell_struct = struct.Struct( '<IIi8i' )
+
+cell_keys = ('x', 'y', 'w', 'h', 'ax', 'ay', 'aw', 'ah')
+
+
+# The sidecar that goes with a sheet's xml
+def get_sidecar_path( xml_path ):
+    return os.path.splitext( xml_path )[0] + ".layout"
+
+
+# Write the sidecar for a sheet's xml, groups being the xml's cells as written, a list of (animation name or None, list of (sprite name, cell))
+# with cells being dicts of x/y/w/h/ax/ay/aw/ah, and xml_hash the sha1 (hex) of the xml written
+def write_sidecar( sidecar_path, texture_name_type, texture_wh, groups, xml_hash ):
+
+    strings = bytearray()
+    map_string_offset = {}
+
+    # Names are only stored once, however many cells share them
+    def add_string( value ):
+        data = value.encode( "utf-8" )
+        if not data in map_string_offset:
+            map_string_offset[data] = len(strings)
+            strings.extend( data )
+        return (map_string_offset[data], len(data))
+
+    anims = bytearray()
+    cells = bytearray()
+    anim_count = 0
+    cell_count = 0
+
+    for (anim_name, group_cells) in groups:
+        anim_index = -1
+        if anim_name != None:
+            anim_index = anim_count
+            anims.extend( anim_struct.pack( *add_string(anim_name), cell_count, len(group_cells) ) )
+            anim_count += 1
+
+        for (sprite_name, cell) in group_cells:
+            cells.extend( cell_struct.pack( *add_string(sprite_name), anim_index, *[int(cell[key]) for key in cell_keys] ) )
+            cell_count += 1
+
+    texture_name = add_string( os.path.basename(texture_name_type[0]) )
+    texture_type = add_string( texture_name_type[1] )
+
+    strings_offset = header_struct.size + len(anims) + len(cells)
+
+    header = header_struct.pack( sidecar_magic, sidecar_version, 0, texture_wh[0], texture_wh[1], bytes.fromhex(xml_hash),
+                                 texture_name[0], texture_name[1], texture_type[0], texture_type[1],
+                                 cell_count, anim_count, strings_offset, len(strings) )
+
+    with open(sidecar_path + ".tmp", "wb") as f_sidecar:
+        f_sidecar.write( header )
+        f_sidecar.write( anims )
+        f_sidecar.write( cells )
+        f_sidecar.write( strings )
+
+    os.replace( sidecar_path + ".tmp", sidecar_path )
+
+
+# Map a sidecar into memory, returns a dict of
+#   'mmap'                  - the sidecar's bytes
+#   'texture_name_type'     - the texture's name and type, 'texture_wh' its size
+#   'xml_hash'              - sha1 (hex) of the xml it was written with
+#   'cell_count'/'anim_count'
+#   'anims_offset'/'cells_offset'/'strings_offset' - where each table starts
+# Raises ValueError if it isn't a sidecar this version can read, close it again with close_sidecar
+def open_sidecar( sidecar_path ):
+
+    with open(sidecar_path, "rb") as f_sidecar:
+        data = mmap.mmap( f_sidecar.fileno(), 0, access=mmap.ACCESS_READ )
+
+    try:
+        if len(data) < header_struct.size:
+            raise ValueError( "too short to be a layout sidecar" )
+
+        (magic, version, flags, texture_w, texture_h, xml_hash, name_offset, name_length, type_offset, type_length, cell_count, anim_count, strings_offset, strings_size) = header_struct.unpack_from( data, 0 )
+
+        if magic != sidecar_magic or version != sidecar_version:
+            raise ValueError( "not a version " + str(sidecar_version) + " layout sidecar" )
+
+        cells_offset = header_struct.size + anim_count * anim_struct.size
+        if cells_offset + cell_count * cell_struct.size != strings_offset or strings_offset + strings_size > len(data):
+            raise ValueError( "layout sidecar is truncated" )
+
+    except Exception:
+        data.close()
+        raise
+
+    sidecar = { 'mmap': data,
+                'texture_wh': (texture_w, texture_h),
+                'xml_hash': xml_hash.hex(),
+                'cell_count': cell_count,
+                'anim_count': anim_count,
+                'anims_offset': header_struct.size,
+                'cells_offset': cells_offset,
+                'strings_offset': strings_offset }
+
+    sidecar['texture_name_type'] = [read_string(sidecar, name_offset, name_length), read_string(sidecar, type_offset, type_length)]
+
+    return sidecar
+
+
+def close_sidecar( sidecar ):
+    sidecar['mmap'].close()
+
+
+def read_string( sidecar, offset, length ):
+    start = sidecar['strings_offset'] + offset
+    return sidecar['mmap'][start:start + length].decode( "utf-8" )
+
+
+# Name, first cell and cell count of animation index
+def read_anim( sidecar, index ):
+
+    (name_offset, name_length, first_cell, cell_count) = anim_struct.unpack_from( sidecar['mmap'], sidecar['anims_offset'] + index * anim_struct.size )
+
+    return (read_string(sidecar, name_offset, name_length), first_cell, cell_count)
+
+
+# Cell index, returns (animation index or -1, name, (x, y, w, h, ax, ay, aw, ah))
+def read_cell( sidecar, index ):
+
+    values = cell_struct.unpack_from( sidecar['mmap'], sidecar['cells_offset'] + index * cell_struct.size )
+
+    return (values[2], read_string(sidecar, values[0], values[1]), values[3:])
+
+
+# Read every cell from a sidecar, yields (animation name, cell) the same as explode.read_cells does from the xml
+# but with the cell's x/y/w/h/ax/ay/aw/ah already ints
+# Returns None if there's no sidecar that can be read, or (given xml_hash) it wasn't written with the xml as it is now
+def read_sidecar_cells( sidecar_path, xml_hash=None ):
+
+    if os.path.isfile(sidecar_path) == False:
+        return None
+
+    try:
+        sidecar = open_sidecar( sidecar_path )
+    except (OSError, ValueError):
+        return None
+
+    if xml_hash != None and sidecar['xml_hash'] != xml_hash:
+        close_sidecar( sidecar )
+        return None
+
+    return iter_sidecar_cells( sidecar )
+
+
+def iter_sidecar_cells( sidecar ):
+
+    anim_names = [read_anim(sidecar, index)[0] for index in range(sidecar['anim_count'])]
+
+    try:
+        for index in range(sidecar['cell_count']):
+            (anim_index, name, values) = read_cell( sidecar, index )
+
+            cell = dict( zip(cell_keys, values) )
+            cell['name'] = name
+
+            yield (anim_names[anim_index] if anim_index >= 0 else None, cell)
+
+    finally:
+        close_sidecar( sidecar )
@@ -0,0 +1,159 @@
+
+'''
+    @file metrics.py
+    @date 18/OCT/2026
+    @brief Record how long each stage of explode/build takes, counts of work done and peak memory, for --profile and --metrics-json.
+'''
+
+from contextlib import contextmanager
+import sys
+import json
+import time
+import threading
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is reported as None there
+    resource = None
+
+# Bump this if the layout of the metrics json changes
+metrics_version = 1
+
+# Everything recorded so far in this process
+#   stages - stage name -> {'time': total seconds, 'calls': times entered, 'peak_rss_mb': peak memory when it last finished}
+#   counts - counter name -> total, e.g. cells, bytes_written, decode_calls, encode_calls
+#   worker_peak_rss_mb - highest peak memory of any worker process merged in
+recorded = { 'stages': {}, 'counts': {}, 'worker_peak_rss_mb': None }
+
+# Stages and counts can be recorded from several threads at once
+lock = threading.Lock()
+
+
+# Forget everything recorded so far
+def reset():
+    with lock:
+        recorded['stages'] = {}
+        recorded['counts'] = {}
+        recorded['worker_peak_rss_mb'] = None
+
+
+# Peak resident memory of this process so far in MB, or None where it can't be measured
+def get_peak_rss_mb():
+
+    if resource == None:
+        return None
+
+    peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+    # Reported in bytes on macOS, KB everywhere else
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+# Time the code inside a with block as the named stage, stages entered more than once have their times added up
+@contextmanager
+def stage( name ):
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage( name, time.perf_counter() - start, 1, get_peak_rss_mb() )
+
+
+def add_stage( name, elapsed, calls, peak_rss_mb ):
+    with lock:
+        stage_record = recorded['stages'].setdefault( name, {'time': 0.0, 'calls': 0, 'peak_rss_mb': None} )
+        stage_record['time'] += elapsed
+        stage_record['calls'] += calls
+        stage_record['peak_rss_mb'] = max_rss( stage_record['peak_rss_mb'], peak_rss_mb )
+
+
+# Add n to the named counter
+def count( name, n=1 ):
+    with lock:
+        recorded['counts'][name] = recorded['counts'].get(name, 0) + n
+
+
+def max_rss( a, b ):
+    if a == None:
+        return b
+    if b == None:
+        return a
+    return max( a, b )
+
+
+# Copy of everything recorded so far, to pass to since() later
+def snapshot():
+    with lock:
+        return json.loads( json.dumps(recorded) )
+
+
+# Everything recorded since an earlier snapshot, as a picklable dict that can be merge()d into another process's metrics
+def since( before ):
+
+    now = snapshot()
+
+    stages = {}
+    for (name, stage_record) in now['stages'].items():
+        old = before['stages'].get( name, {'time': 0.0, 'calls': 0} )
+        if stage_record['calls'] != old['calls']:
+            stages[name] = {'time': stage_record['time'] - old['time'], 'calls': stage_record['calls'] - old['calls'], 'peak_rss_mb': stage_record['peak_rss_mb']}
+
+    counts = {}
+    for (name, total) in now['counts'].items():
+        if not name in before['counts'] or total != before['counts'][name]:
+            counts[name] = total - before['counts'].get(name, 0)
+
+    return { 'stages': stages, 'counts': counts, 'peak_rss_mb': get_peak_rss_mb() }
+
+
+# Add metrics recorded by a worker process (from since()) into this process's
+def merge( worker_metrics ):
+
+    for (name, stage_record) in worker_metrics['stages'].items():
+        add_stage( name, stage_record['time'], stage_record['calls'], None )
+
+    for (name, total) in worker_metrics['counts'].items():
+        count( name, total )
+
+    with lock:
+        recorded['worker_peak_rss_mb'] = max_rss( recorded['worker_peak_rss_mb'], worker_metrics['peak_rss_mb'] )
+
+
+# Everything recorded, in the form written to --metrics-json
+def get_report( command, settings ):
+    report = snapshot()
+    report['version'] = metrics_version
+    report['command'] = command
+    report['settings'] = settings
+    report['peak_rss_mb'] = get_peak_rss_mb()
+    return report
+
+
+def write_json( report, path ):
+    with open(path, "w") as f:
+        json.dump( report, f, indent='\t' )
+
+    print("# Metrics written to: " + path)
+
+
+# Print a table of stage times and counts
+def print_table( report ):
+
+    print("# Profile:")
+    print("# \t{:<24} {:>10} {:>8} {:>10}".format("stage", "seconds", "calls", "peak MB"))
+
+    for (name, stage_record) in report['stages'].items():
+        peak = "" if stage_record['peak_rss_mb'] == None else "{:.1f}".format(stage_record['peak_rss_mb'])
+        print("# \t{:<24} {:>10.3f} {:>8} {:>10}".format(name, stage_record['time'], stage_record['calls'], peak))
+
+    for (name, total) in sorted(report['counts'].items()):
+        print("# \t{:<24} {:>10}".format(name, total))
+
+    if report['peak_rss_mb'] != None:
+        print("# \t{:<24} {:>10.1f}".format("peak MB", report['peak_rss_mb']))
+    if report['worker_peak_rss_mb'] != None:
+        print("# \t{:<24} {:>10.1f}".format("worker peak MB", report['worker_peak_rss_mb']))
@@ -0,0 +1,312 @@
+
+'''
+    @file native_packer.py
+    @date 18/OCT/2026
+    @brief Skyline bin packer working directly on already trimmed sprite rectangles, an in process alternative to PyTexturePacker.
+'''
+
+import time
+
+# Pack rectangles of the given (w, h) sizes using the bottom-left skyline heuristic.
+# Padding follows PyTexturePacker's rules so sheets come out laid out the same way:
+#   border_padding - space between the sprites and the edge of the sheet
+#   shape_padding  - space between sprites
+#   inner_padding  - transparent space around each sprite, inside its own area
+# Returns (list of (x, y) positions in the same order as sizes, (sheet w, sheet h)), or None if they don't fit
+def pack_rects( sizes, max_w, max_h, border_padding=2, shape_padding=2, inner_padding=1 ):
+
+    if len(sizes) == 0:
+        return ([], (border_padding * 2, border_padding * 2))
+
+    # Space each rect takes up in the sheet, including its padding
+    footprints = [(w + 2 * inner_padding + shape_padding, h + 2 * inner_padding + shape_padding) for (w, h) in sizes]
+
+    widest = max([fw for (fw, fh) in footprints])
+    total_area = sum([fw * fh for (fw, fh) in footprints])
+
+    # Start with the narrowest power of two that could hold everything in a square, widen it if we run out of height
+    sheet_w = 1
+    while sheet_w * sheet_w < total_area or sheet_w - 2 * border_padding < widest:
+        sheet_w *= 2
+
+    sheet_w = min( sheet_w, max_w )
+
+    while True:
+        positions = pack_skyline( footprints, sheet_w, max_h, border_padding )
+        if positions != None:
+            break
+
+        if sheet_w >= max_w:
+            return None
+
+        sheet_w = min( sheet_w * 2, max_w )
+
+    # Move from the corner of each footprint to the sprite inside it
+    positions = [(x + inner_padding, y + inner_padding) for (x, y) in positions]
+
+    sheet_h = border_padding
+    for (i, (x, y)) in enumerate(positions):
+        sheet_h = max( sheet_h, y - inner_padding + footprints[i][1] )
+    sheet_h += border_padding
+
+    return (positions, (sheet_w, sheet_h))
+
+
+# Pack rectangles across as few pages of at most max_w x max_h as possible, for when they don't all fit on one
+# Each page is filled tallest first, anything that doesn't fit is skipped and later smaller rectangles can still fill the gaps
+# Returns a list of pages, each (list of indices into sizes, their (x, y) positions, (sheet w, sheet h)), or None if a rectangle won't fit even on its own
+def pack_pages( sizes, max_w, max_h, border_padding=2, shape_padding=2, inner_padding=1 ):
+
+    packed = pack_rects( sizes, max_w, max_h, border_padding, shape_padding, inner_padding )
+    if packed != None:
+        return [(list(range(len(sizes))), packed[0], packed[1])]
+
+    footprints = [(w + 2 * inner_padding + shape_padding, h + 2 * inner_padding + shape_padding) for (w, h) in sizes]
+
+    pages = []
+    remaining = list(range(len(sizes)))
+    while len(remaining) > 0:
+        positions = pack_skyline( [footprints[i] for i in remaining], max_w, max_h, border_padding, skip_unfit=True )
+
+        page = [i for (i, position) in zip(remaining, positions) if position != None]
+        if len(page) == 0:
+            return None
+
+        # Pack the page again on its own so it gets shrunk down to the narrowest width it fits
+        page_packed = pack_rects( [sizes[i] for i in page], max_w, max_h, border_padding, shape_padding, inner_padding )
+        pages.append( (page, page_packed[0], page_packed[1]) )
+
+        remaining = [i for (i, position) in zip(remaining, positions) if position == None]
+
+    return pages
+
+
+# Orders rectangles can be placed in, each a sort key of (w, h), the largest placed first
+sort_orders = { 'height':    lambda w, h: (h, w),
+                'area':      lambda w, h: (w * h, h),
+                'perimeter': lambda w, h: (w + h, h),
+                'max_side':  lambda w, h: (max(w, h), min(w, h)) }
+
+# Ways pack_maxrects can choose where each rectangle goes, as well as the skyline packer's own bottom-left, quickest first
+maxrects_heuristics = ['bottom_left', 'best_short_side_fit', 'best_area_fit', 'contact_point']
+
+
+# Place footprints into a sheet of the given width, tallest first (or in sort_order, one of sort_orders)
+# Returns the top left of each footprint in input order, or None if they don't fit within max_h
+# With skip_unfit, footprints that don't fit are left out (their position is None) instead
+def pack_skyline( footprints, sheet_w, max_h, border_padding, skip_unfit=False, sort_order='height' ):
+
+    right = sheet_w - border_padding
+    bottom = max_h - border_padding
+
+    # The skyline is a list of [x, y, width] segments running left to right across the sheet,
+    # y being the lowest point anything new can be placed at over that segment
+    skyline = [[border_padding, border_padding, sheet_w - 2 * border_padding]]
+
+    sort_key = sort_orders[sort_order]
+    order = sorted( range(len(footprints)), key=lambda i: sort_key(footprints[i][0], footprints[i][1]), reverse=True )
+    positions = [None] * len(footprints)
+
+    for i in order:
+        (fw, fh) = footprints[i]
+
+        best = None
+        best_index = -1
+
+        for (index, segment) in enumerate(skyline):
+            x = segment[0]
+            if x + fw > right:
+                break
+
+            # Find how high the footprint has to sit to clear every segment it spans
+            y = segment[1]
+            span_end = x + fw
+            j = index + 1
+            while skyline[j - 1][0] + skyline[j - 1][2] < span_end:
+                y = max( y, skyline[j][1] )
+                j += 1
+
+            if y + fh > bottom:
+                continue
+
+            # Bottom-left, prefer the placement that keeps the top of the footprint lowest
+            if best == None or (y + fh, x) < best:
+                best = (y + fh, x)
+                best_index = index
+
+        if best == None:
+            if skip_unfit:
+                continue
+            return None
+
+        x = skyline[best_index][0]
+        y = best[0] - fh
+        positions[i] = (x, y)
+
+        add_to_skyline( skyline, best_index, x, y + fh, fw )
+
+    return positions
+
+
+# Raise the skyline over [x, x + w) to height y, starting at the segment at index
+def add_to_skyline( skyline, index, x, y, w ):
+
+    skyline.insert( index, [x, y, w] )
+
+    # Shrink or remove the segments the new one covers
+    end = x + w
+    i = index + 1
+    while i < len(skyline):
+        segment = skyline[i]
+        if segment[0] >= end:
+            break
+
+        segment_end = segment[0] + segment[2]
+        if segment_end <= end:
+            del skyline[i]
+            continue
+
+        segment[2] = segment_end - end
+        segment[0] = end
+        break
+
+    # Merge neighbours at the same height
+    i = max( index - 1, 0 )
+    while i < len(skyline) - 1 and i <= index + 1:
+        if skyline[i][1] == skyline[i + 1][1]:
+            skyline[i][2] += skyline[i + 1][2]
+            del skyline[i + 1]
+        else:
+            i += 1
+
+
+# Pack rectangles into a sheet of exactly sheet_w x sheet_h with the MaxRects algorithm, placing each (in sort_order) by heuristic:
+#   best_short_side_fit - the free space it leaves the least room in along its shorter side
+#   best_area_fit       - the smallest free space it fits in
+#   bottom_left         - wherever keeps its bottom edge highest up, then furthest left
+#   contact_point       - wherever it touches the most edges of the sheet and other rectangles
+# Padding is the same as pack_rects. Gives up if time.time() passes deadline (when given), checked between rectangles
+# Returns (list of (x, y) positions in the same order as sizes, (sheet w, sheet h) actually used), or None if they don't fit
+def pack_maxrects( sizes, sheet_w, sheet_h, heuristic='best_short_side_fit', sort_order='height', border_padding=2, shape_padding=2, inner_padding=1, deadline=None ):
+
+    footprints = [(w + 2 * inner_padding + shape_padding, h + 2 * inner_padding + shape_padding) for (w, h) in sizes]
+
+    sort_key = sort_orders[sort_order]
+    order = sorted( range(len(footprints)), key=lambda i: sort_key(footprints[i][0], footprints[i][1]), reverse=True )
+
+    # Free space is kept as a list of (x, y, w, h) rectangles, which overlap each other
+    free_rects = [(border_padding, border_padding, sheet_w - 2 * border_padding, sheet_h - 2 * border_padding)]
+    placed = []
+    positions = [None] * len(footprints)
+
+    for i in order:
+        if deadline != None and time.time() > deadline:
+            return None
+
+        (fw, fh) = footprints[i]
+
+        best = None
+        best_position = None
+        for (x, y, w, h) in free_rects:
+            if fw > w or fh > h:
+                continue
+
+            if heuristic == 'best_short_side_fit':
+                score = (min(w - fw, h - fh), max(w - fw, h - fh))
+            elif heuristic == 'best_area_fit':
+                score = (w * h - fw * fh, min(w - fw, h - fh))
+            elif heuristic == 'bottom_left':
+                score = (y + fh, x)
+            else:
+                score = (-get_contact_score( x, y, fw, fh, sheet_w, sheet_h, border_padding, placed ), y, x)
+
+            if best == None or score < best:
+                best = score
+                best_position = (x, y)
+
+        if best_position == None:
+            return None
+
+        positions[i] = best_position
+        placed.append( best_position + (fw, fh) )
+
+        split_free_rects( free_rects, best_position + (fw, fh) )
+
+    # Move from the corner of each footprint to the sprite inside it
+    positions = [(x + inner_padding, y + inner_padding) for (x, y) in positions]
+
+    used_w = border_padding
+    used_h = border_padding
+    for (x, y, w, h) in placed:
+        used_w = max( used_w, x + w )
+        used_h = max( used_h, y + h )
+
+    return (positions, (used_w + border_padding, used_h + border_padding))
+
+
+# How much of a footprint placed at x, y would touch the edges of the sheet and the footprints already placed
+def get_contact_score( x, y, w, h, sheet_w, sheet_h, border_padding, placed ):
+
+    score = 0
+    if x == border_padding or x + w == sheet_w - border_padding:
+        score += h
+    if y == border_padding or y + h == sheet_h - border_padding:
+        score += w
+
+    for (px, py, pw, ph) in placed:
+        if px == x + w or px + pw == x:
+            score += max( 0, min(y + h, py + ph) - max(y, py) )
+        if py == y + h or py + ph == y:
+            score += max( 0, min(x + w, px + pw) - max(x, px) )
+
+    return score
+
+
+# Take a newly placed footprint out of the free space, splitting any free rectangles it overlaps
+# into the (up to four) parts of them left uncovered, then drop any free rectangles inside another
+def split_free_rects( free_rects, used ):
+
+    (ux, uy, uw, uh) = used
+
+    kept = []
+    new_rects = []
+    for free_rect in free_rects:
+        (x, y, w, h) = free_rect
+        if ux >= x + w or ux + uw <= x or uy >= y + h or uy + uh <= y:
+            kept.append( free_rect )
+            continue
+
+        if ux > x:
+            new_rects.append( (x, y, ux - x, h) )
+        if ux + uw < x + w:
+            new_rects.append( (ux + uw, y, x + w - ux - uw, h) )
+        if uy > y:
+            new_rects.append( (x, y, w, uy - y) )
+        if uy + uh < y + h:
+            new_rects.append( (x, uy + uh, w, y + h - uy - uh) )
+
+    # Only the new rectangles can be inside another one, the rest were already pruned
+    # (this is where most of the time goes, hence the comparisons being written out in full)
+    pruned = []
+    for (i, rect) in enumerate(new_rects):
+        (x, y, w, h) = rect
+        right = x + w
+        bottom = y + h
+
+        contained = False
+        for (ox, oy, ow, oh) in kept:
+            if x >= ox and y >= oy and right <= ox + ow and bottom <= oy + oh:
+                contained = True
+                break
+
+        if not contained:
+            for (j, other) in enumerate(new_rects):
+                (ox, oy, ow, oh) = other
+                if j != i and x >= ox and y >= oy and right <= ox + ow and bottom <= oy + oh and (rect != other or j < i):
+                    contained = True
+                    break
+
+        if not contained:
+            pruned.append( rect )
+
+    free_rects[:] = kept + pruned
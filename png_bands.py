@@ -0,0 +1,113 @@
+
+'''
+    @file png_bands.py
+    @date 18/OCT/2026
+    @brief Decode a PNG a horizontal band at a time, so huge sheets never have to be held in memory all at once.
+'''
+
+from PIL import Image
+import struct
+import zlib
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+# PNG colour types we can decode in bands, and the Pillow mode each one decodes to
+# Only 8 bit, non interlaced images are supported, which is everything the packer writes
+map_colour_type_mode = { 0: "L", 2: "RGB", 4: "LA", 6: "RGBA" }
+map_mode_bytes_per_pixel = { "L": 1, "RGB": 3, "LA": 2, "RGBA": 4 }
+
+
+# Read the chunks of a PNG file, yields (chunk type, chunk data)
+def read_chunks( f ):
+
+    while True:
+        chunk_header = f.read( 8 )
+        if len(chunk_header) < 8:
+            return
+
+        (length, chunk_type) = struct.unpack( ">I4s", chunk_header )
+        data = f.read( length )
+        f.read( 4 ) # crc
+
+        yield (chunk_type, data)
+
+        if chunk_type == b'IEND':
+            return
+
+
+# Check whether a PNG can be decoded in bands, returns (mode, (w, h)) if it can, otherwise None
+def get_band_mode( png_path ):
+
+    with open(png_path, "rb") as f:
+        if f.read( len(png_signature) ) != png_signature:
+            return None
+
+        for (chunk_type, data) in read_chunks( f ):
+            if chunk_type != b'IHDR':
+                return None
+
+            (w, h, bit_depth, colour_type, compression, filter_method, interlace) = struct.unpack( ">IIBBBBB", data )
+            if bit_depth != 8 or interlace != 0 or not colour_type in map_colour_type_mode:
+                return None
+
+            return (map_colour_type_mode[colour_type], (w, h))
+
+    return None
+
+
+# Decode a PNG top to bottom in bands of band_height rows, yields each band as an image
+# Only call this on images get_band_mode says are ok
+def read_bands( png_path, band_height ):
+
+    # Bands of no rows would never get any further down the sheet
+    if band_height < 1:
+        raise ValueError( "band height must be at least 1 row, not " + str(band_height) )
+
+    (mode, (w, h)) = get_band_mode( png_path )
+    row_bytes = 1 + w * map_mode_bytes_per_pixel[mode]
+
+    decompressor = zlib.decompressobj()
+    pending = bytearray()
+    previous_row = None
+    top = 0
+
+    with open(png_path, "rb") as f:
+        f.read( len(png_signature) )
+
+        for (chunk_type, data) in read_chunks( f ):
+            if chunk_type != b'IDAT':
+                continue
+
+            while len(data) > 0 and top < h:
+                # Never inflate more than a band's worth at a time
+                pending += decompressor.decompress( data, band_height * row_bytes )
+                data = decompressor.unconsumed_tail
+
+                while top < h:
+                    rows = min( band_height, h - top )
+                    if len(pending) < rows * row_bytes:
+                        break
+
+                    band = decode_band( mode, w, rows, bytes(pending[:rows * row_bytes]), previous_row )
+                    del pending[:rows * row_bytes]
+
+                    # Keep the last row around, the first row of the next band may be filtered against it
+                    previous_row = band.crop( (0, rows - 1, w, rows) ).tobytes()
+
+                    top += rows
+                    yield band
+
+    if top < h:
+        raise ValueError("PNG image data ended early: " + png_path)
+
+
+# Unfilter a band of raw PNG scanlines into an image
+# The rows above aren't available to PNG's filters, so the previous row is prepended unfiltered and cropped off again,
+# and the rows are wrapped back up in a (stored, uncompressed) zlib stream for Pillow's PNG decoder
+def decode_band( mode, w, rows, scanlines, previous_row ):
+
+    if previous_row == None:
+        return Image.frombytes( mode, (w, rows), zlib.compress(scanlines, 0), "zip", mode )
+
+    band = Image.frombytes( mode, (w, rows + 1), zlib.compress(b'\x00' + previous_row + scanlines, 0), "zip", mode )
+    return band.crop( (0, 1, w, rows + 1) )
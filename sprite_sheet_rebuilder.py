@@ -6,71 +6,291 @@
     @brief Tie together the funcionality of the explode and build scripts.
 '''
 
-import explode
-import build
+# Only what's needed to parse the arguments is imported up front, each command imports the modules it uses
+# so the imaging libraries aren't loaded for --help, --version or commands that don't need them
+import defaults
+import metrics
 
 import os
+import sys
 import time
 import argparse
 
 version = "0.4"
 
-print("# SpriteSheetRebuilder v" + version + ", By Argh\n")
+# Argument type for counts that have to be at least 1
+def positive_int( value ):
+    number = int( value )
+    if number < 1:
+        raise argparse.ArgumentTypeError( "must be at least 1, not " + value )
+    return number
 
-# root parser
-parser = argparse.ArgumentParser()
-subparsers = parser.add_subparsers(dest='command')
+if __name__ == '__main__':
 
-# explode parser
-parser_explode = subparsers.add_parser('explode', help="Explodes a sprite sheet into it's component sprites.")
-parser_explode.add_argument('f', nargs='+')
+    # Needed for the process pool when frozen into an exe
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
 
-# build parser
-parser_build = subparsers.add_parser('build', help="Builds a sprite sheet using given sprites and generates matching xml.")
-parser_build.add_argument("sprite_directory", nargs=1)
-parser_build.add_argument("output_sheet_name")
-parser_build.add_argument("-maxw", type=int, default=4096)
-parser_build.add_argument("-maxh", type=int, default=4096)
+    print("# SpriteSheetRebuilder v" + version + ", By Argh\n")
 
-results = parser.parse_args()
+    # root parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--version", action='version', version="SpriteSheetRebuilder v" + version)
+    subparsers = parser.add_subparsers(dest='command')
 
+    # profiling options, shared by explode and build
+    parser_profile = argparse.ArgumentParser(add_help=False)
+    parser_profile.add_argument("--profile", action='store_true', help="Print a table of how long each stage took, work done and peak memory.")
+    parser_profile.add_argument("--metrics-json", help="Write stage timings, counts and peak memory to this JSON file.")
+    parser_profile.add_argument("--cprofile", help="Run under cProfile and dump the stats to this file (view with pstats or snakeviz).")
 
-# Explode that sprite sheet
-if ( results.command == 'explode' ):
+    # PNG encoder options, shared by everything that writes PNGs
+    parser_png = argparse.ArgumentParser(add_help=False)
+    parser_png.add_argument("--png-compress-level", type=int, choices=range(0, 10), metavar="0-9", help="zlib level to write PNGs with, lower is faster but bigger (Pillow's default is 6).")
+    parser_png.add_argument("--png-optimize", action='store_true', help="Have Pillow search for the smallest encoding of each PNG, much slower to write.")
+    parser_png.add_argument("--fast", action='store_true', help="Write PNGs as quickly as possible (compress level " + str(defaults.fast_png_compress_level) + "), for intermediate files.")
 
-    start = time.time()
+    # explode parser
+    parser_explode = subparsers.add_parser('explode', parents=[parser_profile, parser_png], help="Explodes a sprite sheet into it's component sprites.")
+    parser_explode.add_argument('f', nargs='+')
+    parser_explode.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes to explode sheets with.")
+    parser_explode.add_argument("-t", "--threads", type=int, default=1, help="Number of threads encoding sprites within each sheet.")
+    parser_explode.add_argument("--force", action='store_true', help="Explode every sheet, even if it hasn't changed since the last explode.")
+    parser_explode.add_argument("--low-memory", action='store_true', help="Decode sheets a band of rows at a time rather than all at once.")
+    parser_explode.add_argument("--band-height", type=positive_int, default=defaults.default_band_height, help="Rows per band when using --low-memory.")
+    parser_explode.add_argument("--archive", choices=defaults.archive_formats, help="Write each sheet's sprites into a single archive rather than loose files.")
+
+    # build parser
+    parser_build = subparsers.add_parser('build', parents=[parser_profile, parser_png], help="Builds a sprite sheet using given sprites and generates matching xml.")
+    parser_build.add_argument("sprite_directory", nargs=1, help="Folder of sprites, or a zip/tar archive of them.")
+    parser_build.add_argument("output_sheet_name")
+    parser_build.add_argument("-maxw", type=int, default=4096)
+    parser_build.add_argument("-maxh", type=int, default=4096)
+    parser_build.add_argument("--no-cache", action='store_true', help="Always repack every sprite, ignoring the last build.")
+    parser_build.add_argument("--engine", choices=defaults.engines, default='pytexturepacker', help="Packer to lay the sprites out with, 'native' is much faster for big sheets.")
+    parser_build.add_argument("--compact-xml", action='store_true', help="Write the xml on a single line, without indentation.")
+    parser_build.add_argument("--no-dedup", action='store_true', help="Pack every sprite separately, even ones identical to another sprite.")
+    parser_build.add_argument("--optimize", action='store_true', help="Final pass over the finished sheets, keeping the smallest of several encodings, for sheets being shipped.")
+    parser_build.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes to load and trim sprites (and search layouts) with.")
+    parser_build.add_argument("--optimize-layout", action='store_true', help="Try many packing heuristics, sort orders and sheet bounds, keeping the smallest sheet found.")
+    parser_build.add_argument("--layout-time-budget", type=float, default=defaults.default_layout_time_budget, help="Seconds --optimize-layout searches for (default %(default)s).")
+    parser_build.add_argument("--layout-sidecar", action='store_true', help="Also write a binary copy of the xml ('.layout'), quicker to load and used by explode when present.")
+
+    # rescale parser
+    parser_rescale = subparsers.add_parser('rescale', aliases=['convert'], parents=[parser_profile, parser_png], help="Scales the sprites in sprite sheets and repacks them, without exploding them to disk.")
+    parser_rescale.add_argument('f', nargs='+')
+    parser_rescale.add_argument("-s", "--scale", type=float, nargs='+', default=[0.5], help="Scale(s) to make, e.g. '-s 0.5 0.25' for half and quarter resolution.")
+    parser_rescale.add_argument("-o", "--output", default="./rescaled", help="Folder to write the rescaled sheets to, each scale gets its own subfolder.")
+    parser_rescale.add_argument("--resample", choices=defaults.resample_filters, default=defaults.default_resample, help="Filter to scale sprites with.")
+    parser_rescale.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes to rescale sheets with.")
+    parser_rescale.add_argument("-maxw", type=int, default=4096)
+    parser_rescale.add_argument("-maxh", type=int, default=4096)
+    parser_rescale.add_argument("--engine", choices=defaults.engines, default='pytexturepacker', help="Packer to lay the sprites out with, 'native' is much faster for big sheets.")
+    parser_rescale.add_argument("--compact-xml", action='store_true', help="Write the xml on a single line, without indentation.")
+    parser_rescale.add_argument("--no-dedup", action='store_true', help="Pack every sprite separately, even ones identical to another sprite.")
+    parser_rescale.add_argument("--optimize", action='store_true', help="Final pass over the finished sheets, keeping the smallest of several encodings, for sheets being shipped.")
+
+    # repack parser
+    parser_repack = subparsers.add_parser('repack', parents=[parser_profile, parser_png], help="Repacks a sprite sheet, swapping in edited sprites, without exploding it to disk.")
+    parser_repack.add_argument("sheet")
+    parser_repack.add_argument("-x", "--overrides", help="Folder of edited sprites to use in place of the ones in the sheet, laid out as explode would (or all in one folder).")
+    parser_repack.add_argument("-o", "--output", help="Name of the repacked sheet, defaults to the sheet's name with '_repacked' on the end.")
+    parser_repack.add_argument("-maxw", type=int, default=4096)
+    parser_repack.add_argument("-maxh", type=int, default=4096)
+    parser_repack.add_argument("--engine", choices=defaults.engines, default='pytexturepacker', help="Packer to lay the sprites out with, 'native' is much faster for big sheets.")
+    parser_repack.add_argument("--compact-xml", action='store_true', help="Write the xml on a single line, without indentation.")
+    parser_repack.add_argument("--no-dedup", action='store_true', help="Pack every sprite separately, even ones identical to another sprite.")
+    parser_repack.add_argument("--optimize", action='store_true', help="Final pass over the finished sheets, keeping the smallest of several encodings, for sheets being shipped.")
+
+    # watch parser
+    parser_watch = subparsers.add_parser('watch', parents=[parser_png], help="Builds a sprite sheet, then rebuilds it whenever the sprites change until stopped with Ctrl+C.")
+    parser_watch.add_argument("sprite_directory", nargs=1)
+    parser_watch.add_argument("output_sheet_name")
+    parser_watch.add_argument("-maxw", type=int, default=4096)
+    parser_watch.add_argument("-maxh", type=int, default=4096)
+    parser_watch.add_argument("--engine", choices=defaults.engines, default='pytexturepacker', help="Packer to lay the sprites out with, 'native' is much faster for big sheets.")
+    parser_watch.add_argument("--compact-xml", action='store_true', help="Write the xml on a single line, without indentation.")
+    parser_watch.add_argument("--no-dedup", action='store_true', help="Pack every sprite separately, even ones identical to another sprite.")
+    parser_watch.add_argument("--optimize", action='store_true', help="Final pass over the finished sheets, keeping the smallest of several encodings, for sheets being shipped.")
+    parser_watch.add_argument("--debounce", type=float, default=defaults.default_debounce, help="Seconds to wait for changes to stop before rebuilding.")
+    parser_watch.add_argument("--poll", action='store_true', help="Poll the sprites for changes rather than using inotify.")
+    parser_watch.add_argument("--poll-interval", type=float, default=defaults.default_poll_interval, help="Seconds between checks when polling.")
+
+    # batch parser
+    parser_batch = subparsers.add_parser('batch', parents=[parser_profile], help="Runs a list of explode/build/rescale/repack jobs from a JSON (or TOML/YAML) file in one go.")
+    parser_batch.add_argument("jobs_file")
+    parser_batch.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes to run jobs on side by side.")
+    parser_batch.add_argument("-o", "--output", help="JSON file to write a report of how each job went to.")
+
+    # bench parser
+    parser_bench = subparsers.add_parser('bench', help="Times explode and build on generated sprites, writing the results out as JSON.")
+    parser_bench.add_argument("--suite", choices=sorted(defaults.bench_suites.keys()), default='quick', help="'quick' runs up to 1000 sprites, 'full' up to 50000.")
+    parser_bench.add_argument("--engine", choices=defaults.engines, default='pytexturepacker', help="Packer to build the sheets with.")
+    parser_bench.add_argument("--work-dir", default="./bench", help="Folder to generate sprites and sheets in, generated sprites are reused by later runs.")
+    parser_bench.add_argument("-o", "--output", default="bench_results.json", help="JSON file to write the results to.")
+    parser_bench.add_argument("-maxw", type=int, default=16384)
+    parser_bench.add_argument("-maxh", type=int, default=16384)
 
-    # Attempt to handle each value in file list
     results = parser.parse_args()
-    for path in results.f:
-        print("# Searching for sprite sheets at: " + path)
-        explode.explode_spritesheet( path, "./exploded" )
 
-    end = time.time()
-    time_elapsed = end - start
-    print("Finished exploding in " + str(time_elapsed))
+    # Keyword arguments PNGs are saved with
+    png_options = defaults.get_png_options( getattr(results, 'png_compress_level', None), getattr(results, 'png_optimize', False), getattr(results, 'fast', False) )
+
+    profiler = None
+    if getattr(results, 'cprofile', None) != None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+
+    # Explode that sprite sheet
+    if ( results.command == 'explode' ):
+
+        import explode
+
+        start = time.time()
+
+        # Attempt to handle each value in file list
+        summaries = []
+        for path in results.f:
+            print("# Searching for sprite sheets at: " + path)
+            summaries.extend( explode.explode_spritesheet( path, "./exploded", results.jobs, results.threads, results.force, results.low_memory, results.band_height, png_options, results.archive ) )
+
+        explode.print_summary( summaries )
+
+        end = time.time()
+        time_elapsed = end - start
+        print("Finished exploding in " + str(time_elapsed))
+
+    # Build new sprite sheet
+    elif ( results.command == 'build' ):
+
+        import build
+
+        # Get output file name (ignores extension if given)
+        output_texture_name = os.path.splitext( results.output_sheet_name )[0]
+        
+        start = time.time()
+
+        # build sprite sheet and xml, reusing the last build where possible
+        try:
+            build.build_spritesheet( results.sprite_directory[0], output_texture_name, results.maxw, results.maxh, results.no_cache == False, results.engine, results.compact_xml, results.no_dedup == False, png_options, results.optimize, results.jobs, results.optimize_layout, results.layout_time_budget, results.layout_sidecar )
+        except ValueError as e:
+            print("!# \tFailed to build: " + output_texture_name + " (" + str(e) + ")")
+            sys.exit( 1 )
+
+        end = time.time()
+        time_elapsed = end - start
+        print("# Finished building in " + str(time_elapsed))
+
+    # Rescale sprite sheets
+    elif ( results.command in ['rescale', 'convert'] ):
+
+        import convert
+
+        start = time.time()
+
+        try:
+            summaries = convert.rescale_spritesheets( results.f, results.output, results.scale, results.maxw, results.maxh, results.engine, results.no_dedup == False, results.compact_xml, results.resample, results.jobs, png_options, results.optimize )
+        except ValueError as e:
+            print("!# \tFailed to rescale (" + str(e) + ")")
+            sys.exit( 1 )
+
+        convert.print_summary( summaries )
+
+        end = time.time()
+        time_elapsed = end - start
+        print("# Finished rescaling in " + str(time_elapsed))
+
+    # Repack a sprite sheet
+    elif ( results.command == 'repack' ):
+
+        import convert
+
+        output_texture_name = results.output
+        if output_texture_name == None:
+            output_texture_name = os.path.splitext( os.path.basename(results.sheet) )[0] + "_repacked"
+
+        # Get output file name (ignores extension if given)
+        output_texture_name = os.path.splitext( output_texture_name )[0]
+
+        start = time.time()
+
+        print("# Repacking: " + results.sheet)
+        try:
+            convert.repack_sheet( results.sheet, output_texture_name, results.overrides, results.maxw, results.maxh, results.engine, results.no_dedup == False, results.compact_xml, png_options, results.optimize )
+        except ValueError as e:
+            print("!# \tFailed to repack: " + results.sheet + " (" + str(e) + ")")
+            sys.exit( 1 )
+
+        end = time.time()
+        time_elapsed = end - start
+        print("# Finished repacking in " + str(time_elapsed))
+
+    # Keep a sprite sheet built
+    elif ( results.command == 'watch' ):
+
+        import build
+        import watch
+
+        # Get output file name (ignores extension if given)
+        output_texture_name = os.path.splitext( results.output_sheet_name )[0]
+
+        settings = build.get_build_settings( results.engine, results.compact_xml, results.no_dedup == False, png_options, results.optimize )
+        watch.watch_spritesheet( results.sprite_directory[0], output_texture_name, results.maxw, results.maxh, settings, results.debounce, results.poll_interval, results.poll )
+
+    # Run a batch of jobs
+    elif ( results.command == 'batch' ):
+
+        import batch
+
+        start = time.time()
+
+        try:
+            jobs = batch.load_jobs( results.jobs_file )
+        except (OSError, ValueError) as e:
+            print("!# \tCould not read jobs from: " + results.jobs_file + " (" + str(e) + ")")
+            sys.exit( 1 )
+
+        batch_report = batch.run_batch( jobs, results.jobs )
+
+        batch.print_report( batch_report )
+        if results.output != None:
+            batch.write_report( batch_report, results.output )
+
+        end = time.time()
+        time_elapsed = end - start
+        print("# Finished batch in " + str(time_elapsed))
+
+    # Benchmark explode and build
+    elif ( results.command == 'bench' ):
 
-# Build new sprite sheet
-elif ( results.command == 'build' ):
+        import bench
 
-    # Get output file name (ignores extension if given)
-    output_texture_name = os.path.splitext( results.output_sheet_name )[0]
-    
-    start = time.time()
+        bench.run_benchmarks( results.work_dir, results.output, results.suite, results.engine, results.maxw, results.maxh, version )
 
-    # build sprite sheet, return size
-    texture_wh = build.generate_spritesheet( results.sprite_directory[0], output_texture_name, results.maxw, results.maxh )
+    else:
+        
+        print("You must use either the 'explode', 'build', 'rescale', 'repack', 'watch', 'batch' or 'bench' commands.")
 
-    # Convert the auto-generated plist file into the NK xml format, return map of sprites and locations
-    map_sprites = build.convert_plist( output_texture_name, texture_wh, results.sprite_directory[0] )
+    if profiler != None:
+        profiler.disable()
+        profiler.dump_stats( results.cprofile )
+        print("# cProfile stats written to: " + results.cprofile)
 
-    # Do a final pass on the spritesheet, duplicating edges where appropriate
-    build.pad_sprites( map_sprites, output_texture_name )
+    # Report what was recorded along the way
+    if getattr(results, 'profile', False) or getattr(results, 'metrics_json', None) != None:
+        settings = {key: value for (key, value) in vars(results).items() if not key in ['profile', 'metrics_json', 'cprofile']}
+        settings['png_options'] = png_options
+        report = metrics.get_report( results.command, settings )
+        report['total_time'] = time_elapsed
 
-    end = time.time()
-    time_elapsed = end - start
-    print("# Finished building in " + str(time_elapsed))
+        if results.profile:
+            metrics.print_table( report )
+        if results.metrics_json != None:
+            metrics.write_json( report, results.metrics_json )
 
-else:
-    
-    print("You must use either the 'explode' or 'build' commands.")
+    # Let whatever ran the batch know if any of it failed
+    if results.command == 'batch' and batch_report['failed'] > 0:
+        sys.exit( 1 )
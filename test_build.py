@@ -0,0 +1,181 @@
+
+'''
+    @file test_build.py
+    @date 18/OCT/2026
+    @brief Check build.duplicate_edges, which copies each edge a strip at a time, against the per pixel loop it replaced,
+           and build.bleed_alpha against PyTexturePacker's own alpha bleeding.
+'''
+
+from PIL import Image
+from PyTexturePacker import Utils
+import random
+import build
+
+
+# The per pixel PixelAccess loop duplicate_edges replaced, as it was
+def duplicate_edges_per_pixel( img, map_sprites ):
+
+    pixels = img.load()
+
+    for k, v in map_sprites.items():
+
+        x = int(v['x'])
+        y = int(v['y'])
+        w = int(v['w'])
+        h = int(v['h'])
+
+        ax = int(v['ax'])
+        ay = int(v['ay'])
+        aw = int(v['aw'])
+        ah = int(v['ah'])
+
+        # Left
+        if ax == 0:
+            _x = x
+            for _y in range(y, y+h):
+                pixels[_x-1, _y] = pixels[_x, _y]
+
+        # Right
+        if aw-ax == w:
+            _x = x + w - 1
+            for _y in range(y, y+h):
+                pixels[_x+1, _y] = pixels[_x, _y]
+
+        # Top
+        if ay == 0:
+            _y = y
+            for _x in range(x, x+w):
+                pixels[_x, _y-1] = pixels[_x, _y]
+
+        # Bottom
+        if ah-ay == h:
+            _y = y + h - 1
+            for _x in range(x, x+w):
+                pixels[_x, _y+1] = pixels[_x, _y]
+
+
+# A sheet of random noise with sprites laid out in rows, 1 or 2 pixels apart so neighbouring edges share the padding between them
+# Sprites come in every size from 1x1 up, and each side either touches the edge of its original image (and is duplicated) or was trimmed
+# The first and last sprites of each row/column sit border pixels from the sheet's edges
+def make_sheet( seed, sheet_w=96, sheet_h=96, border=1 ):
+
+    rand = random.Random( seed )
+
+    img = Image.new( "RGBA", (sheet_w, sheet_h) )
+    img.putdata( [tuple(rand.randrange(256) for i in range(4)) for i in range(sheet_w * sheet_h)] )
+
+    map_sprites = {}
+    y = border
+    while y + border < sheet_h:
+        # The last row and the last sprite in each row are cut to fit, so they reach right up to the border
+        row_h = min( rand.choice([1, 1, 2, 3, 5, 8]), sheet_h - border - y )
+
+        x = border
+        while x + border < sheet_w:
+            w = min( rand.choice([1, 1, 2, 3, 5, 8]), sheet_w - border - x )
+            h = rand.randint( 1, row_h )
+            if x + w + border == sheet_w:
+                h = row_h
+
+            # How much was trimmed off each side of the original image
+            (left, top, right, bottom) = [rand.choice([0, 0, 1, 3]) for i in range(4)]
+
+            map_sprites["sprite_" + str(len(map_sprites))] = {'x': x, 'y': y, 'w': w, 'h': h, 'ax': left, 'ay': top, 'aw': left + w + right, 'ah': top + h + bottom}
+
+            x += w + rand.choice( [1, 2] )
+
+        y += row_h + rand.choice( [1, 2] )
+
+    return (img, map_sprites)
+
+
+def test_duplicate_edges_matches_per_pixel():
+
+    for seed in range(20):
+        (img, map_sprites) = make_sheet( seed )
+
+        expected = img.copy()
+        duplicate_edges_per_pixel( expected, map_sprites )
+
+        build.duplicate_edges( img, map_sprites )
+
+        assert img.tobytes() == expected.tobytes(), "seed " + str(seed)
+
+
+def test_duplicate_edges_one_pixel_sprites():
+
+    img = Image.new( "RGBA", (5, 5), (0,0,0,0) )
+    img.putpixel( (2, 2), (10, 20, 30, 255) )
+
+    map_sprites = {'dot': {'x': 2, 'y': 2, 'w': 1, 'h': 1, 'ax': 0, 'ay': 0, 'aw': 1, 'ah': 1}}
+
+    expected = img.copy()
+    duplicate_edges_per_pixel( expected, map_sprites )
+
+    build.duplicate_edges( img, map_sprites )
+
+    assert img.tobytes() == expected.tobytes()
+    assert [img.getpixel(xy) for xy in [(1, 2), (3, 2), (2, 1), (2, 3)]] == [(10, 20, 30, 255)] * 4
+
+
+# Sprites flush with the sheet's edges have nowhere to duplicate their outer edges to, those strips are left off
+# (the per pixel loop wrapped around to the far side of the sheet, or raised going past it), everything else is the same
+# as the per pixel loop run on the sheet with an extra pixel all round
+def test_duplicate_edges_clipped_at_sheet_edges():
+
+    for seed in range(20):
+        (img, map_sprites) = make_sheet( seed, border=0 )
+
+        padded = Image.new( "RGBA", (img.width + 2, img.height + 2) )
+        padded.paste( img, (1, 1) )
+
+        padded_sprites = {}
+        for (k, v) in map_sprites.items():
+            padded_sprites[k] = dict( v, x=v['x'] + 1, y=v['y'] + 1 )
+
+        duplicate_edges_per_pixel( padded, padded_sprites )
+        expected = padded.crop( (1, 1, img.width + 1, img.height + 1) )
+
+        build.duplicate_edges( img, map_sprites )
+
+        assert img.tobytes() == expected.tobytes(), "seed " + str(seed)
+
+
+# Scattered blocks of colour, some only just visible, some running off the edges of the image
+def make_blocks( seed, sheet_w=120, sheet_h=90 ):
+
+    rand = random.Random( seed )
+
+    img = Image.new( "RGBA", (sheet_w, sheet_h) )
+    for i in range(30):
+        block = Image.new( "RGBA", (rand.randint(1, 20), rand.randint(1, 20)), tuple(rand.randrange(256) for i in range(3)) + (rand.choice([1, 128, 255]),) )
+        img.paste( block, (rand.randrange(-10, sheet_w), rand.randrange(-10, sheet_h)) )
+
+    return img
+
+
+# The same pixels are bled as PyTexturePacker bleeds, and each takes the colour of a visible pixel close enough to have bled into it
+def test_bleed_alpha_matches_pytexturepacker():
+
+    for seed in range(6):
+        img = make_blocks( seed )
+        bleed_pixels = [8, 1, 3][seed % 3]
+
+        expected = Utils.alpha_bleeding( img, bleed_pixels )
+        bled = build.bleed_alpha( img, bleed_pixels )
+
+        assert bled.getchannel("A").tobytes() == expected.getchannel("A").tobytes(), "seed " + str(seed)
+
+        pixels = img.load()
+        bled_pixels = bled.load()
+        for y in range(img.height):
+            for x in range(img.width):
+                if pixels[x, y][3] != 0:
+                    assert bled_pixels[x, y] == pixels[x, y]
+                elif bled_pixels[x, y][3] == 1:
+                    near = set()
+                    for near_y in range(max(y - bleed_pixels, 0), min(y + bleed_pixels + 1, img.height)):
+                        for near_x in range(max(x - bleed_pixels, 0), min(x + bleed_pixels + 1, img.width)):
+                            if pixels[near_x, near_y][3] != 0:
+                                near.add( pixels[near_x, near_y][:3] )
+                    assert bled_pixels[x, y][:3] in near, "seed " + str(seed)
@@ -0,0 +1,269 @@
+
+'''
+    @file watch.py
+    @date 18/OCT/2026
+    @brief Stay running and rebuild a sprite sheet whenever the sprites it's built from change, for artists iterating on sprites.
+           The sprites are kept decoded and trimmed in memory along with the last layout, so each save only re-reads the sprites that changed.
+'''
+
+from defaults import default_debounce, default_poll_interval
+import build
+import metrics
+import os
+import sys
+import time
+import select
+import ctypes
+import ctypes.util
+
+# inotify events that mean a sprite (or a folder of them) was written, added, moved or removed
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+inotify_mask = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+
+# libc with inotify, or None where there isn't one (anywhere but Linux), in which case the sprites are polled instead
+def load_inotify():
+
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL( ctypes.util.find_library('c') or "libc.so.6", use_errno=True )
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+# Start watching src_dir for changes, returns a dict of
+#   'libc'/'fd' - libc and the inotify file descriptor, both None when polling
+#   'scan'      - what the sprites looked like when last polled, see scan_sprites
+def start_watcher( src_dir, polling=False, poll_interval=default_poll_interval ):
+
+    watcher = {'libc': None, 'fd': None, 'scan': None}
+
+    libc = None
+    if not polling:
+        libc = load_inotify()
+
+    if libc != None:
+        fd = libc.inotify_init1( os.O_CLOEXEC )
+        if fd >= 0:
+            watcher['libc'] = libc
+            watcher['fd'] = fd
+            if add_inotify_watches( watcher, src_dir ):
+                print("# Watching \"" + src_dir + "\" for changes (inotify)...")
+                return watcher
+
+            os.close( fd )
+            watcher['libc'] = None
+            watcher['fd'] = None
+
+        print("!# \tCould not use inotify, polling for changes instead")
+
+    watcher['scan'] = scan_sprites( src_dir )
+    print("# Watching \"" + src_dir + "\" for changes (polling every " + str(poll_interval) + "s)...")
+
+    return watcher
+
+
+# inotify only watches a single folder, so add a watch for every folder under src_dir (folders already watched are left as they are)
+# Returns False if any couldn't be watched (e.g. the system's limit on watches was reached)
+def add_inotify_watches( watcher, src_dir ):
+
+    for (dirpath, dirnames, filenames) in os.walk(src_dir):
+        if watcher['libc'].inotify_add_watch( watcher['fd'], os.fsencode(dirpath), inotify_mask ) < 0:
+            print("!# \tFailed to watch: " + dirpath + " (" + os.strerror(ctypes.get_errno()) + ")")
+            return False
+
+    return True
+
+
+def stop_watcher( watcher ):
+    if watcher['fd'] != None:
+        os.close( watcher['fd'] )
+        watcher['fd'] = None
+
+
+# The modified time and size of every sprite under src_dir, to poll for changes with
+def scan_sprites( src_dir ):
+
+    scan = {}
+    for (rel_path, sprite_path) in build.find_sprites( src_dir ).items():
+        try:
+            stat = os.stat( sprite_path )
+            scan[rel_path] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            # Removed since it was found
+            pass
+
+    return scan
+
+
+# Block until something under src_dir changes, then until there have been no more changes for debounce seconds
+def wait_for_changes( watcher, src_dir, debounce=default_debounce, poll_interval=default_poll_interval ):
+
+    fd = watcher['fd']
+
+    if fd != None:
+        # Any event at all is enough, what actually changed is worked out from the sprites' stamps
+        select.select( [fd], [], [] )
+        os.read( fd, 65536 )
+
+        while len(select.select( [fd], [], [], debounce )[0]) > 0:
+            os.read( fd, 65536 )
+
+        # Pick up any new folders
+        if not add_inotify_watches( watcher, src_dir ):
+            print("!# \tCould not watch every folder, polling for changes instead")
+            stop_watcher( watcher )
+            watcher['scan'] = scan_sprites( src_dir )
+
+        return
+
+    scan = watcher['scan']
+    while True:
+        time.sleep( poll_interval )
+        new_scan = scan_sprites( src_dir )
+        if new_scan != scan:
+            break
+
+    while True:
+        time.sleep( debounce )
+        scan = new_scan
+        new_scan = scan_sprites( src_dir )
+        if new_scan == scan:
+            break
+
+    watcher['scan'] = new_scan
+
+
+# Everything kept in memory between builds of the sheet
+#   'sprites' - path relative to src_dir -> (file name, trimmed image, source box, source size), as passed to build.generate_spritesheet_from_trimmed
+#   'stamps'  - path relative to src_dir -> stamp of the sprite when it was read
+#   'pages'   - what was written for each page of the sheet (as kept in the build cache), None until the first build
+#   'images'  - the image of each page, as written
+def new_state():
+    return {'sprites': {}, 'stamps': {}, 'pages': None, 'images': []}
+
+
+# Bring the sheet up to date with the sprites on disk, only reading sprites that changed since the last update
+# Sprites that changed without changing their trimmed size are pasted into the sheet in memory, anything else repacks the sprites held in memory
+# Returns False if nothing had changed
+def update_sheet( state, src_dir, sheet_name, max_w, max_h, settings ):
+
+    packer_options = build.get_packer_options( max_w, max_h )
+
+    sprite_paths = build.find_sprites( src_dir )
+
+    with metrics.stage( 'stamp_sprites' ):
+        sprite_stamps = build.stamp_sprites( sprite_paths, state['stamps'] )
+
+    changed = [rel_path for rel_path in sprite_paths if not rel_path in state['stamps'] or sprite_stamps[rel_path]['hash'] != state['stamps'][rel_path]['hash']]
+    removed = [rel_path for rel_path in state['sprites'] if not rel_path in sprite_paths]
+    if len(changed) == 0 and len(removed) == 0:
+        return False
+
+    print("# " + str(len(changed)) + " sprites changed, " + str(len(removed)) + " removed")
+
+    # Read just the sprites that changed, anything that can't be read yet (e.g. still being written) is picked up next time
+    changed_sprites = {}
+    for rel_path in changed:
+        try:
+            with metrics.stage( 'load_sprites' ):
+                changed_sprites[rel_path] = (os.path.basename(rel_path),) + build.load_trimmed_sprite( sprite_paths[rel_path], packer_options['trim_mode'] )
+        except Exception as e:
+            print("!# \tFailed to read sprite: " + rel_path + " (" + str(e) + ")")
+
+            if rel_path in state['stamps']:
+                sprite_stamps[rel_path] = state['stamps'][rel_path]
+            else:
+                sprite_paths.pop( rel_path )
+                sprite_stamps.pop( rel_path )
+
+    for rel_path in removed:
+        state['sprites'].pop( rel_path )
+
+    # Work out whether the changed sprites can be pasted straight into the sheets in memory
+    changed_images = None
+    if state['pages'] != None and len(removed) == 0:
+        pages = state['pages']
+        sprite_places = build.get_sprite_places( pages )
+
+        changed_images = [{} for page in pages]
+        for (rel_path, changed_sprite) in changed_sprites.items():
+            page_index = None
+            if rel_path in state['sprites']:
+                page_index = build.find_reblit_page( pages, sprite_places, rel_path, changed_sprite[1:] )
+
+            if page_index == None:
+                changed_images = None
+                break
+
+            changed_images[page_index][os.path.splitext(changed_sprite[0])[0]] = changed_sprite[1:]
+
+    state['sprites'].update( changed_sprites )
+    state['stamps'] = sprite_stamps
+
+    if changed_images != None:
+        for (page, page_changed_images, img) in zip(state['pages'], changed_images, state['images']):
+            if len(page_changed_images) > 0:
+                build.reblit_sprites( page, page_changed_images, packer_options, settings, img )
+    else:
+        # Repack everything held in memory, in the same order build would load the sprites in
+        sprites = [state['sprites'][rel_path] for rel_path in sprite_paths if rel_path in state['sprites']]
+        sheets = build.generate_spritesheet_from_trimmed( sprites, sheet_name, max_w, max_h, settings['engine'], settings['dedup'] )
+
+        state['pages'] = build.save_pages( sheets, src_dir, settings )
+        state['images'] = [sheet['image'] for sheet in sheets]
+
+    # Leave the build cache up to date too, so a build afterwards has nothing to do
+    build.save_build_cache( sheet_name, max_w, max_h, settings, sprite_stamps, state['pages'] )
+
+    return True
+
+
+# Build the sheet from the sprites in src_dir, then keep rebuilding it whenever they change until interrupted (Ctrl+C)
+# Uses inotify where available, otherwise (or with polling) the sprites are checked every poll_interval seconds
+def watch_spritesheet( src_dir, sheet_name, max_w, max_h, settings, debounce=default_debounce, poll_interval=default_poll_interval, polling=False ):
+
+    state = new_state()
+
+    # A build that fails is reported and retried from scratch on the next change, the same as a failed rebuild
+    start = time.time()
+    try:
+        update_sheet( state, src_dir, sheet_name, max_w, max_h, settings )
+        print("# Finished building in " + str(time.time() - start))
+    except Exception as e:
+        print("!# \tFailed to build: " + sheet_name + " (" + str(e) + ")")
+        state.update( new_state() )
+
+    watcher = start_watcher( src_dir, polling, poll_interval )
+
+    try:
+        while True:
+            wait_for_changes( watcher, src_dir, debounce, poll_interval )
+
+            start = time.time()
+            try:
+                if update_sheet( state, src_dir, sheet_name, max_w, max_h, settings ):
+                    print("# Finished rebuilding in " + str(time.time() - start))
+            except Exception as e:
+                print("!# \tFailed to rebuild: " + sheet_name + " (" + str(e) + ")")
+
+                # Start again from scratch next time, rather than trust what's in memory
+                state.update( new_state() )
+
+    except KeyboardInterrupt:
+        print("# Stopped watching \"" + src_dir + "\"")
+
+    finally:
+        stop_watcher( watcher )